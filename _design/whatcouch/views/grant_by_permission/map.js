@@ -0,0 +1,5 @@
+function(doc) {
+	if (doc.doc_type == 'Grant') {
+		emit(doc.permission, doc.group);
+	}
+}
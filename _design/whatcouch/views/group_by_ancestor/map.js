@@ -0,0 +1,7 @@
+function(doc) {
+	if (doc.doc_type == 'Group' && doc.ancestors) {
+		for (var i = 0; i < doc.ancestors.length; i++) {
+			emit(doc.ancestors[i], doc);
+		}
+	}
+}
@@ -0,0 +1,9 @@
+function(doc) {
+	if (doc.doc_type == 'User') {
+		for (var i = 0; i < doc.groups.length; i++) {
+			if (doc.groups[i].expires) {
+				emit(doc.groups[i].expires, doc.groups[i].name);
+			}
+		}
+	}
+}
@@ -0,0 +1,5 @@
+function(doc) {
+	if (doc.doc_type == 'Membership') {
+		emit(doc.group, doc.user);
+	}
+}
@@ -3,5 +3,10 @@ function(doc) {
 		for (var i = 0; i < doc.permissions.length; i++) {
 			emit(doc.name, doc.permissions[i]);
 		}
+		if (doc.inherited_permissions) {
+			for (var i = 0; i < doc.inherited_permissions.length; i++) {
+				emit(doc.name, doc.inherited_permissions[i]);
+			}
+		}
 	}
 }
@@ -0,0 +1,5 @@
+function(doc) {
+	if (doc.doc_type == 'Permission') {
+		emit(doc.name, null);
+	}
+}
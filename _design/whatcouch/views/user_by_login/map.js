@@ -0,0 +1,9 @@
+function(doc) {
+	if (doc.doc_type == 'User') {
+		var username = doc.username.toLowerCase();
+		emit(username, doc);
+		if (doc.email && doc.email.toLowerCase() != username) {
+			emit(doc.email.toLowerCase(), doc);
+		}
+	}
+}
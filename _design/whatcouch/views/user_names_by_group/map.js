@@ -0,0 +1,9 @@
+function(doc) {
+	if (doc.doc_type == 'User') {
+		for (var i = 0; i < doc.groups.length; i++) {
+			emit([doc.groups[i].name, doc.username], doc.groups[i].expires || null);
+		}
+	} else if (doc.doc_type == 'Membership') {
+		emit([doc.group, doc.user], null);
+	}
+}
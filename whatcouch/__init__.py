@@ -24,8 +24,23 @@ They can be found in the model.py file.
 """
 
 from whatcouch.adapters import GroupAdapter, PermissionAdapter
-from whatcouch.plugins import AuthenticatorPlugin, MetadataPlugin
+from whatcouch.plugins import AuthenticatorPlugin, MetadataPlugin, LazyUser
 from whatcouch.quickstart import setup_couch_auth
+from whatcouch.sharding import UserShards
+from whatcouch.claims import ClaimsContext
+from whatcouch.index import AuthzIndex
+from whatcouch.snapshot import Snapshot, dump_snapshot
+from whatcouch.breaker import CircuitBreaker
+from whatcouch.writebehind import WriteBehindQueue
+from whatcouch.throttle import LoginThrottle
+from whatcouch.audit import AuditLog
+from whatcouch.unitofwork import UnitOfWork
+from whatcouch.expiry import ExpirySweeper
+from whatcouch.bulkcheck import BulkChecker
+from whatcouch.holders import iter_permission_users, page_permission_users
 
-__all__ = ['GroupAdapter', 'PermissionAdapter', 'AuthenticatorPlugin', 'MetadataPlugin', 'setup_couch_auth']
+__all__ = ['GroupAdapter', 'PermissionAdapter', 'AuthenticatorPlugin', 'MetadataPlugin', 'setup_couch_auth',
+    'UserShards', 'ClaimsContext', 'LazyUser', 'AuthzIndex', 'Snapshot', 'dump_snapshot',
+    'CircuitBreaker', 'WriteBehindQueue', 'LoginThrottle', 'AuditLog',
+    'UnitOfWork', 'ExpirySweeper', 'BulkChecker', 'iter_permission_users', 'page_permission_users']
 
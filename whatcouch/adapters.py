@@ -15,31 +15,252 @@ the repoze.what documentation at <http://what.repoze.org/docs/1.0/>.
 The translations dict passed to the constructor of each adapter is used to map
 calls to the provided model using the wrapper classes.  See wrapper.py for
 documentation on the translations dict.
+
+User documents may optionally be partitioned across several databases.  See
+sharding.py for details.
+
+When a ClaimsContext is given the adapters answer _find_sections() from the
+claims bound by the metadata plugin and invalidate claims when they change
+memberships.  See claims.py for details.
+
+When an AuthzIndex is given and loaded, membership checks are answered from
+the index and the adapters keep it up to date as they change the database.
+A read-only Snapshot may be used in place of the index.  See index.py and
+snapshot.py for details.
+
+Each adapter may be given its own database instead of using the databases set
+on the document classes.  See binding.py for details.
+
+Names of users, groups and permissions may be listed a page at a time, with
+an optional prefix, from views emitting only names.  Each page is a single
+range query which resumes at the key following the previous page, so its cost
+does not depend on the number of documents.
+
+Section members may be streamed with iter_section_items(), which yields names
+as pages of view rows arrive instead of building the complete list.
+
+The views mapping sections to their members reduce with _count, so section
+sizes are read with reduce queries without transferring any documents.
+
+With edges enabled, memberships and grants are stored as separate link
+documents instead of being embedded in user and group documents, so changing
+them never rewrites a user or group.  See edges.py for details.
+
+When a CircuitBreaker is given the database calls made by the adapters run
+through it and reads fall back to their last good answers while CouchDB is
+slow or unavailable.  See breaker.py for details.
+
+With nesting enabled, groups may be nested in other groups.  Members of a
+group are then members of its ancestors and it inherits their permissions.
+The ancestors and inherited permissions are precomputed in the group
+documents.  See nesting.py for details.
+
+Memberships embedded in user documents may expire.  Expired memberships are
+ignored by _find_sections() and _item_is_included() and removed by an
+ExpirySweeper.  See expiry.py for details.
+
+With wildcards enabled, permissions granted with a trailing '*' segment,
+such as 'billing.*', grant every permission below their prefix.  Each group's
+grants are matched through a cached prefix trie.  _find_sections() adds the
+existing permissions granted by wildcards, so repoze.what's has_permission
+predicate honours them, and section listings and counts of a permission
+include the groups granted it by a wildcard.  See wildcard.py for details.
+
+Adding items to and removing items from sections is saved with bulk_edit(),
+so documents changed concurrently are fetched again and the change reapplied
+instead of being lost.  Conflicts, retries and documents which could still not
+be saved are counted in the metrics dict of each adapter.
 """
 
+import logging, threading
 from repoze.what.adapters import BaseSourceAdapter
+from whatcouch.breaker import guarded_read, guarded_call
+from whatcouch.binding import get_db, view, save, delete, bulk_write, bulk_edit
+from whatcouch.translations import merge_translations
+from whatcouch.edges import membership_id, grant_id, membership_doc, grant_doc, insert_edges, delete_edges
+from whatcouch.nesting import GroupTree
+from whatcouch.wildcard import TrieCache, covering_grants, wildcard_prefix
+from whatcouch.expiry import format_expiry, is_expired, active_groups
 
 __all__ = ['GroupAdapter', 'PermissionAdapter']
 
+log = logging.getLogger(__name__)
+
+def _add_edit(list_key, name_key, item):
+    """
+    Build an edit adding an embedded document to a list unless a document of
+    the same name is already present.
+    :param list_key: The attribute holding the list.
+    :param name_key: The name attribute of the embedded documents.
+    :param item: The document to add.
+    :return: A callable modifying a document and returning True if it changed.
+    """
+    name = getattr(item, name_key)
+    def edit(doc):
+        items = getattr(doc, list_key)
+        for existing in items:
+            if getattr(existing, name_key) == name:
+                return False
+        items.append(item)
+        return True
+    return edit
+
+def _remove_edit(list_key, name_key, name):
+    """
+    Build an edit removing the embedded documents of a name from a list.
+    :param list_key: The attribute holding the list.
+    :param name_key: The name attribute of the embedded documents.
+    :param name: The name of the documents to remove.
+    :return: A callable modifying a document and returning True if it changed.
+    """
+    def edit(doc):
+        items = getattr(doc, list_key)
+        changed = False
+        for i in range(len(items)-1, -1, -1):
+            if getattr(items[i], name_key) == name:
+                del items[i]
+                changed = True
+        return changed
+    return edit
+
+def _page_params(prefix, start, limit):
+    """
+    Build the view parameters for a page of names.  One extra row is requested
+    to find the start of the next page.
+    :param prefix: Optional prefix the names must start with.
+    :param start: Optional name to start the page at, as returned for the previous page.
+    :param limit: The maximum number of names in the page.
+    :return: A dict of view parameters.
+    """
+    params = {'limit': limit + 1}
+    if prefix:
+        params['startkey'] = prefix
+        params['endkey'] = prefix + u'\ufff0'
+    if start is not None and (not prefix or start > prefix):
+        params['startkey'] = start
+    return params
+
+def _iter_rows(db, view_name, key, page_size):
+    """
+    Stream the rows of a view for one key, fetching them a page at a time.
+    Each page resumes after the document ID of the last row of the previous
+    page, so only one page is held in memory.
+    :param db: The database to query.
+    :param view_name: The name of the view.
+    :param key: The key to get the rows of.
+    :param page_size: The number of rows to fetch per request.
+    :return: An iterator over the raw view rows.
+    """
+    params = {'startkey': key, 'endkey': key, 'limit': page_size + 1, 'reduce': False}
+    while True:
+        rows = list(db.view(view_name, **params))
+        for row in rows[:page_size]:
+            yield row
+        if len(rows) <= page_size:
+            return
+        params['startkey_docid'] = rows[page_size]['id']
+
+def _counts(rows, names):
+    """
+    Collect the counts returned by a grouped _count reduce query.
+    :param rows: The reduced rows.
+    :param names: The names of every section, so that empty sections are included.
+    :return: A dict mapping section names to counts.
+    """
+    counts = dict([ (name, 0) for name in names ])
+    for row in rows:
+        counts[row['key']] = counts.get(row['key'], 0) + row['value']
+    return counts
+
+def _page(names, limit):
+    """
+    Split the names returned for a page from the start of the next page.
+    :param names: The names returned by the view, at most one more than the limit.
+    :param limit: The maximum number of names in the page.
+    :return: A tuple of the list of names and the start of the next page, or None if this is the last page.
+    """
+    if len(names) > limit:
+        return names[:limit], names[limit]
+    return names, None
+
 class GroupAdapter(BaseSourceAdapter):
     """
     CouchDB group source adapter.
     """
 
-    def __init__(self, translations):
+    def __init__(self, translations, user_shards=None, claims=None, index=None, breaker=None, db=None,
+            edges=False, retries=3, backoff=0.05, nested=False):
         """
-        Constructor.  Configures the adapter with the given translations dict.
+        Constructor.  Configures the adapter with a copy of the given translations dict, with missing keys
+        taken from the default translations.
         :param translations: The translations to use when mapping requests against a model.
+        :param user_shards: Optional UserShards to partition user documents across.
+        :param claims: Optional ClaimsContext to answer group lookups from.
+        :param index: Optional AuthzIndex to answer membership checks from.
+        :param breaker: Optional CircuitBreaker to run database calls through.
+        :param db: Optional database to use instead of the databases set on the document classes.
+        :param edges: Whether memberships are stored as Membership documents instead of embedded in users.
+        :param retries: The number of times users whose save conflicts are fetched and changed again.
+        :param backoff: The delay in seconds before the first retry of a conflicting save.
+        :param nested: Whether groups may be nested in other groups.
         """
-        self.t11 = translations
+        self.t11 = merge_translations(translations)
+        self.db = db
+        self.edges = edges
+        self.retries = retries
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.metrics = dict([ (name, 0) for name in ('conflicts', 'retries', 'failures') ])
+        self.user_shards = user_shards
+        self.claims = claims
+        self.index = index
+        self.breaker = breaker
         self.User = self.t11['user_class']
         self.user_name_key = self.t11['user_name_key']
         self.user_groups_key = self.t11['user_groups_key']
         self.user_list_view = self.t11['user_list_view']
         self.user_by_group_view = self.t11['user_by_group_view']
+        self.user_names_view = self.t11['user_names_view']
         self.Group = self.t11['group_class']
         self.group_name_key = self.t11['group_name_key']
         self.group_list_view = self.t11['group_list_view']
+        self.group_names_view = self.t11['group_names_view']
+        self.membership_by_user_view = self.t11['membership_by_user_view']
+        self.membership_by_group_view = self.t11['membership_by_group_view']
+        self.group_parents_key = self.t11['group_parents_key']
+        self.group_expiry_key = self.t11['group_expiry_key']
+        self.membership_expiry_view = self.t11['membership_expiry_view']
+        self.tree = GroupTree(self.t11, db, retries, backoff, self._count) if nested else None
+
+    def _invalidate_claims(self):
+        """
+        Invalidate issued claims after a membership change.
+        """
+        if self.claims is not None:
+            self.claims.invalidate()
+
+    def _count(self, name, value):
+        """
+        Increment a metric.
+        """
+        with self.lock:
+            self.metrics[name] += value
+
+    def _use_index(self):
+        """
+        Check if lookups may be answered from the authorization index.
+        """
+        return self.index is not None and self.index.loaded
+
+    def _update_index(self, method, *args):
+        """
+        Apply a change to the authorization index if one is loaded.  Read-only
+        indexes such as snapshots are left alone.
+        :param method: The name of the AuthzIndex method to call.
+        :param args: The arguments to pass to the method.
+        """
+        if self._use_index() and not self.index.readonly:
+            getattr(self.index, method)(*args)
 
     def _get_user(self, name):
         """
@@ -47,22 +268,86 @@ class GroupAdapter(BaseSourceAdapter):
         :param name: The name of the user to get.
         :return: The user document with the given name or None if not found.
         """
-        users = self.User.view(self.user_list_view, key=name)
+        if self.user_shards is None:
+            users = view(self.User, self.db, self.user_list_view, key=name)
+        else:
+            users = self.user_shards.view(name, self.User, self.user_list_view, key=name)
         if len(users) > 0:
             return users.__iter__().next()
         return None
 
+    def _query_users(self, view_name, **params):
+        """
+        Query a user view.  When user shards are configured every shard is
+        queried in parallel and the results are merged.
+        :param view_name: The name of the view to query.
+        :param params: Additional view parameters.
+        :return: A list of user documents.
+        """
+        if self.user_shards is None:
+            return list(view(self.User, self.db, view_name, **params))
+        return self.user_shards.view_all(self.User, view_name, **params)
+
+    def _save_users(self, users):
+        """
+        Save user documents.  When user shards are configured each document is
+        routed to its shard.
+        :param users: A list of user documents to save.
+        :return: A list of the result rows of the documents which could not be saved.
+        """
+        if self.user_shards is None:
+            return bulk_write(get_db(self.User, self.db), users)
+        return self.user_shards.bulk_save(users, lambda user: getattr(user, self.user_name_key))
+
+    def _edit_users(self, users, edit):
+        """
+        Apply an edit to user documents and save the changed ones, retrying
+        users whose save conflicts.  When user shards are configured each
+        document is routed to its shard.
+        :param users: A list of user documents to edit.
+        :param edit: A callable modifying a user and returning True if it changed.
+        :return: A list of the names of the users which were changed and saved.
+        """
+        if self.user_shards is None:
+            saved, errors = bulk_edit(self.User, get_db(self.User, self.db), users, edit, self.retries,
+                self.backoff, self._count)
+        else:
+            saved, errors = self.user_shards.bulk_edit(self.User, users,
+                lambda user: getattr(user, self.user_name_key), edit, retries=self.retries,
+                backoff=self.backoff, count=self._count)
+        for error in errors:
+            log.warning('failed to save user %s: %s', error.get('id'), error.get('error'))
+        return [ getattr(user, self.user_name_key) for user in saved ]
+
     def _get_group(self, name):
         """
         Get a group by name.
         :param name: The name of the group to get.
         :return: The group document with the given name or None if not found.
         """
-        groups = self.Group.view(self.group_list_view, key=name)
+        groups = view(self.Group, self.db, self.group_list_view, key=name)
         if len(groups) > 0:
             return groups.__iter__().next()
         return None
 
+    def _edge_db(self):
+        """
+        Get the database holding Membership documents.
+        """
+        return get_db(self.Group, self.db)
+
+    def _existing_users(self, names):
+        """
+        Find which of several users exist with a single query.
+        :param names: A list of user names.
+        :return: A list of the names of the users which exist.
+        """
+        if self.user_shards is None:
+            rows = get_db(self.User, self.db).view(self.user_names_view, keys=list(names))
+        else:
+            rows = self.user_shards.view_all(None, self.user_names_view, keys=list(names))
+        return [ row['key'] for row in rows ]
+
     def _get_all_sections(self):
         """
         Get a dictionary containing all groups.  The keys will be the group names
@@ -70,20 +355,140 @@ class GroupAdapter(BaseSourceAdapter):
         :return: A dictionary of group to user name list mappings.
         """
         sections = {}
-        groups = self.Group.view(self.group_list_view)
-        for group in groups:
-            name = getattr(group, self.group_name_key)
+        for name in self._get_group_names():
             sections[name] = self._get_section_items(name)
         return sections
-            
+
+    @guarded_read
+    def _get_group_names(self):
+        """
+        Get the names of all groups.
+        :return: A list of group names.
+        """
+        groups = view(self.Group, self.db, self.group_list_view)
+        return [ getattr(group, self.group_name_key) for group in groups ]
+
+    def page_user_names(self, prefix=None, start=None, limit=50):
+        """
+        Get a page of user names in key order.
+        :param prefix: Optional prefix the names must start with.
+        :param start: Optional name to start at, as returned for the previous page.
+        :param limit: The maximum number of names to return.
+        :return: A tuple of the list of names and the start of the next page, or None if this is the last page.
+        """
+        return self._page_user_names(prefix, start, limit)
+
+    @guarded_read
+    def _page_user_names(self, prefix, start, limit):
+        """
+        Query a page of user names.  When user shards are configured each
+        shard is asked for a full page and the results are merged.
+        """
+        params = _page_params(prefix, start, limit)
+        if self.user_shards is None:
+            rows = get_db(self.User, self.db).view(self.user_names_view, **params)
+            names = [ row['key'] for row in rows ]
+        else:
+            names = sorted([ row['key'] for row in self.user_shards.view_all(None, self.user_names_view, **params) ])
+        return _page(names, limit)
+
+    def page_group_names(self, prefix=None, start=None, limit=50):
+        """
+        Get a page of group names in key order.
+        :param prefix: Optional prefix the names must start with.
+        :param start: Optional name to start at, as returned for the previous page.
+        :param limit: The maximum number of names to return.
+        :return: A tuple of the list of names and the start of the next page, or None if this is the last page.
+        """
+        return self._page_group_names(prefix, start, limit)
+
+    @guarded_read
+    def _page_group_names(self, prefix, start, limit):
+        """
+        Query a page of group names.
+        """
+        rows = get_db(self.Group, self.db).view(self.group_names_view, **_page_params(prefix, start, limit))
+        return _page([ row['key'] for row in rows ], limit)
+
+    @guarded_read
     def _get_section_items(self, section):
         """
         Get a list of user names for the given group.
         :param section: The name of the group to retrieve user names for.
         :return: A list of user names.  Will be empty of the group does not exist.
         """
-        users = self.User.view(self.user_by_group_view, key=section)
-        return [ getattr(user, self.user_name_key) for user in users ]
+        return list(self.iter_section_items(section))
+
+    def iter_section_items(self, section, page_size=1000):
+        """
+        Stream the user names of a group.  Rows are fetched a page at a time
+        and are not wrapped in documents.  When user shards are configured the
+        shards are read one after another.
+        :param section: The name of the group to retrieve user names for.
+        :param page_size: The number of rows to fetch per request.
+        :return: An iterator over user names.
+        """
+        if self.tree is not None:
+            nested = self.tree.descendants([section])
+            if nested:
+                seen = set()
+                for name in [section] + sorted(nested):
+                    for user in self._iter_direct_items(name, page_size):
+                        if user not in seen:
+                            seen.add(user)
+                            yield user
+                return
+        for user in self._iter_direct_items(section, page_size):
+            yield user
+
+    def _iter_direct_items(self, section, page_size):
+        """
+        Stream the names of the users who belong to a group directly.
+        """
+        if self.edges:
+            for row in _iter_rows(self._edge_db(), self.membership_by_group_view, section, page_size):
+                yield row['value']
+            return
+        if self.user_shards is None:
+            databases = [get_db(self.User, self.db)]
+        else:
+            databases = self.user_shards.databases
+        for db in databases:
+            for row in _iter_rows(db, self.user_by_group_view, section, page_size):
+                yield row['value'][self.user_name_key]
+
+    @guarded_read
+    def count_section_items(self, section):
+        """
+        Count the users in a group.  When the group has nested groups their
+        users are listed instead, since a user may belong to several of them.
+        :param section: The name of the group.
+        :return: The number of users in the group.
+        """
+        if self.tree is not None and self.tree.descendants([section]):
+            return len(set(self.iter_section_items(section)))
+        if self.edges:
+            rows = self._edge_db().view(self.membership_by_group_view, key=section)
+        elif self.user_shards is None:
+            rows = get_db(self.User, self.db).view(self.user_by_group_view, key=section)
+        else:
+            rows = self.user_shards.view_all(None, self.user_by_group_view, key=section)
+        return sum([ row['value'] for row in rows ])
+
+    @guarded_read
+    def count_all_section_items(self):
+        """
+        Count the users in every group.
+        :return: A dict mapping each group name to its number of users.
+        """
+        if self.edges:
+            rows = self._edge_db().view(self.membership_by_group_view, group=True)
+        elif self.user_shards is None:
+            rows = get_db(self.User, self.db).view(self.user_by_group_view, group=True)
+        else:
+            rows = self.user_shards.view_all(None, self.user_by_group_view, group=True)
+        names = [ row['key'] for row in get_db(self.Group, self.db).view(self.group_names_view) ]
+        return _counts(rows, names)
 
     def _find_sections(self, hint):
         """
@@ -91,15 +496,41 @@ class GroupAdapter(BaseSourceAdapter):
         :param hint: The credentials dict.
         :return: A list of group names associated with the user found in the credentials dict.
         """
+        if self.claims is not None and 'repoze.what.userid' in hint:
+            sections = self.claims.groups(hint['repoze.what.userid'])
+            if sections is not None:
+                return sections
+        if self._use_index() and 'repoze.what.userid' in hint:
+            sections = self.index.groups_of(hint['repoze.what.userid'])
+            if sections is not None:
+                return sections
         user = None
         sections = []
         if user in hint:
             user = hint['user']
+            sections = [ getattr(group, self.group_name_key) for group in user.groups ]
         elif 'repoze.what.userid' in hint:
-            name = hint['repoze.what.userid']
+            sections = self._find_user_sections(hint['repoze.what.userid'])
+        return sections
+
+    @guarded_read
+    def _find_user_sections(self, name):
+        """
+        Get the names of the groups a user belongs to from the database,
+        followed by their ancestors when groups are nested.  Expired
+        memberships are left out.
+        :param name: The name of the user.
+        :return: A list of group names.  Will be empty if the user does not exist.
+        """
+        if self.edges:
+            sections = [ row['value'] for row in self._edge_db().view(self.membership_by_user_view, key=name) ]
+        else:
             user = self._get_user(name)
-        if user is not None:
-            sections = [ getattr(group, self.group_name_key) for group in user.groups ]
+            if user is None:
+                return []
+            sections = active_groups(getattr(user, self.user_groups_key), self.group_name_key, self.group_expiry_key)
+        if self.tree is not None:
+            return self.tree.expand(sections)
         return sections
 
     def _item_is_included(self, section, item):
@@ -109,57 +540,317 @@ class GroupAdapter(BaseSourceAdapter):
         :param item: The name of the user to check.
         :return: True if the user is in the group, False otherwise.
         """
-        user = self._get_user(item)
-        if user is not None:
-            for group in user.groups:
-                if getattr(group, self.group_name_key) == section:
-                    return True
-        return False
+        if self._use_index():
+            included = self.index.is_member(item, section)
+            if included is not None:
+                return included
+        return section in self._find_user_sections(item)
 
+    @guarded_call
     def _include_items(self, section, items):
         """
         Add users to a group.
         :param section: The name of the group to add the users to.
         :param items: A list containing names of users to add to the group.
         """
+        if self.edges:
+            self._include_edges(section, items)
+            return
+        self._join(section, items, None)
+
+    @guarded_call
+    def include_items_until(self, section, items, expires):
+        """
+        Add users to a group until a given time.  Users who already belong to
+        the group have their membership expiry changed.
+        :param section: The name of the group to add the users to.
+        :param items: A list containing names of users to add to the group.
+        :param expires: The expiry time as a naive UTC datetime or a number of seconds since the epoch.
+        :raise ValueError: If memberships are stored as edge documents.
+        """
+        if self.edges:
+            raise ValueError('membership expiry is not supported with edge documents')
+        self._join(section, items, format_expiry(expires))
+
+    def _join(self, section, items, expires):
+        """
+        Add users to a group, setting the expiry of their memberships.
+        :param section: The name of the group to add the users to.
+        :param items: A list containing names of users to add to the group.
+        :param expires: The expiry timestamp or None for memberships which do not expire.
+        """
         group = self._get_group(section)
         if group is not None:
-            save_users = []
-            for item in items:
-                user = self._get_user(item)
-                if user is not None:
-                    getattr(user, self.user_groups_key).append(group)
-                    save_users.append(user)
-            self.User.bulk_save(save_users)
+            users = [ user for user in [ self._get_user(item) for item in items ] if user is not None ]
+            for name in self._edit_users(users, self._join_edit(group, expires)):
+                self._update_index('add_membership', name, section, expires)
+            self._invalidate_claims()
+
+    def _join_edit(self, group, expires):
+        """
+        Build an edit adding a group to a user, or changing the expiry of an
+        existing membership.
+        :param group: The group document.
+        :param expires: The expiry timestamp or None for a membership which does not expire.
+        :return: A callable modifying a user and returning True if it changed.
+        """
+        name = getattr(group, self.group_name_key)
+        def edit(user):
+            groups = getattr(user, self.user_groups_key)
+            for existing in groups:
+                if getattr(existing, self.group_name_key) == name:
+                    current = getattr(existing, self.group_expiry_key, None)
+                    if (format_expiry(current) if current else None) == expires:
+                        return False
+                    setattr(existing, self.group_expiry_key, expires)
+                    return True
+            entry = self.Group.wrap(group.to_json())
+            if expires is not None:
+                setattr(entry, self.group_expiry_key, expires)
+            groups.append(entry)
+            return True
+        return edit
+
+    @guarded_call
+    def _remove_expired(self, current, limit):
+        """
+        Remove one batch of expired memberships.  The due entries are read in
+        expiry order with one range query and the changed users are written
+        with one bulk request.
+        :param current: The current expiry timestamp.
+        :param limit: The maximum number of due entries to read.
+        :return: A tuple of the number of memberships removed and the number of due entries read.
+        """
+        params = {'endkey': current, 'limit': limit, 'include_docs': True}
+        if self.user_shards is None:
+            rows = list(get_db(self.User, self.db).view(self.membership_expiry_view, **params))
+        else:
+            rows = self.user_shards.view_all(None, self.membership_expiry_view, **params)
+        users = {}
+        for row in rows:
+            if row.get('doc') is not None:
+                users[row['id']] = self.User.wrap(row['doc'])
+        removed = {}
+        def edit(user):
+            name = getattr(user, self.user_name_key)
+            groups = getattr(user, self.user_groups_key)
+            removed[name] = []
+            for i in range(len(groups)-1, -1, -1):
+                if is_expired(getattr(groups[i], self.group_expiry_key, None), current):
+                    removed[name].append(getattr(groups[i], self.group_name_key))
+                    del groups[i]
+            return len(removed[name]) > 0
+        count = 0
+        names = self._edit_users(users.values(), edit)
+        for name in names:
+            for section in removed[name]:
+                self._update_index('remove_membership', name, section)
+                count += 1
+        if names:
+            self._invalidate_claims()
+        return count, len(rows)
 
+    @guarded_call
     def _exclude_items(self, section, items):
         """
         Remove users from a group.
         :param section: The name of the group to remove users from.
         :param items: A list containing names of users to remove from the group.
         """
-        save_users = []
-        for item in items:
-            user = self._get_user(item)
-            if user is not None:
-                add_user = False
-                groups = getattr(user, self.user_groups_key)
-                for i in range(len(groups)-1, -1, -1):
-                    if getattr(groups[i], self.group_name_key) == section:
-                        del groups[i]
-                        add_user = True
-                if add_user:
-                    save_users.append(user)
-        self.User.bulk_save(save_users)
+        if self.edges:
+            self._exclude_edges(section, items)
+            return
+        users = [ user for user in [ self._get_user(item) for item in items ] if user is not None ]
+        for name in self._edit_users(users, _remove_edit(self.user_groups_key, self.group_name_key, section)):
+            self._update_index('remove_membership', name, section)
+        self._invalidate_claims()
+
+    def _include_edges(self, section, items):
+        """
+        Add users to a group by inserting Membership documents.
+        :param section: The name of the group to add the users to.
+        :param items: A list containing names of users to add to the group.
+        """
+        if self._get_group(section) is None:
+            return
+        names = self._existing_users(items)
+        ids = dict([ (membership_id(name, section), name) for name in names ])
+        for doc_id in insert_edges(self._edge_db(), [ membership_doc(name, section) for name in names ], False):
+            self._update_index('add_membership', ids[doc_id], section)
+        self._invalidate_claims()
+
+    def _exclude_edges(self, section, items):
+        """
+        Remove users from a group by deleting Membership documents.
+        :param section: The name of the group to remove users from.
+        :param items: A list containing names of users to remove from the group.
+        """
+        ids = dict([ (membership_id(item, section), item) for item in items ])
+        for doc_id in delete_edges(self._edge_db(), ids.keys()):
+            self._update_index('remove_membership', ids[doc_id], section)
+        self._invalidate_claims()
+
+    def set_user_groups(self, user, groups):
+        """
+        Set the groups of a user, adding and removing only the memberships
+        which differ from the stored ones.  Groups which do not exist are
+        ignored.
+        :param user: The name of the user.
+        :param groups: The names of the groups the user should belong to.
+        :return: A tuple of the lists of group names added and removed, or None if the user does not exist.
+        """
+        return self.set_users_groups({user: groups}).get(user)
+
+    @guarded_call
+    def set_users_groups(self, targets):
+        """
+        Set the groups of many users.  The users, their current groups and the
+        target groups are each read with one multi-key query and all changed
+        users are written with one bulk request.
+        :param targets: A dict mapping user names to the names of the groups they should belong to.
+        :return: A dict mapping the name of each existing user to a tuple of the lists of group names added and removed.
+        """
+        targets = dict([ (name, set(groups)) for name, groups in targets.iteritems() ])
+        wanted = set()
+        for groups in targets.itervalues():
+            wanted |= groups
+        if self.edges:
+            changes = self._set_edges(targets, wanted)
+        else:
+            changes = self._set_embedded(targets, wanted)
+        for name, (added, removed) in changes.iteritems():
+            for section in added:
+                self._update_index('add_membership', name, section)
+            for section in removed:
+                self._update_index('remove_membership', name, section)
+        if [ change for change in changes.itervalues() if change[0] or change[1] ]:
+            self._invalidate_claims()
+        return changes
+
+    def _set_embedded(self, targets, wanted):
+        """
+        Set the groups of users by rewriting the groups embedded in the user
+        documents.  Users whose save conflicts are read again and the
+        difference is recomputed; users which could not be saved are reported
+        unchanged.
+        """
+        users = self._query_users(self.user_list_view, keys=targets.keys())
+        groups = {}
+        if wanted:
+            for group in view(self.Group, self.db, self.group_list_view, keys=list(wanted)):
+                groups[getattr(group, self.group_name_key)] = group
+        changes = {}
+        def edit(user):
+            name = getattr(user, self.user_name_key)
+            user_groups = getattr(user, self.user_groups_key)
+            current = set([ getattr(group, self.group_name_key) for group in user_groups ])
+            target = set([ group for group in targets[name] if group in groups ])
+            added = sorted(target - current)
+            removed = sorted(current - target)
+            changes[name] = (added, removed)
+            for i in range(len(user_groups)-1, -1, -1):
+                if getattr(user_groups[i], self.group_name_key) in removed:
+                    del user_groups[i]
+            for section in added:
+                user_groups.append(groups[section])
+            return len(added) > 0 or len(removed) > 0
+        saved = set(self._edit_users(users, edit))
+        return dict([ (name, change if name in saved else ([], [])) for name, change in changes.iteritems() ])
+
+    def _set_edges(self, targets, wanted):
+        """
+        Set the groups of users by inserting and deleting Membership documents.
+        """
+        db = self._edge_db()
+        names = self._existing_users(targets.keys())
+        groups = set()
+        if wanted:
+            groups = set([ row['key'] for row in db.view(self.group_names_view, keys=list(wanted)) ])
+        current = dict([ (name, set()) for name in names ])
+        if names:
+            for row in db.view(self.membership_by_user_view, keys=names):
+                current[row['key']].add(row['value'])
+        changes = {}
+        insert = []
+        remove = []
+        for name in names:
+            target = targets[name] & groups
+            added = sorted(target - current[name])
+            removed = sorted(current[name] - target)
+            changes[name] = (added, removed)
+            insert.extend([ membership_doc(name, section) for section in added ])
+            remove.extend([ membership_id(name, section) for section in removed ])
+        written = set(insert_edges(db, insert, False)) | set(delete_edges(db, remove))
+        if len(written) < len(insert) + len(remove):
+            log.warning('failed to write %i membership documents', len(insert) + len(remove) - len(written))
+        return dict([ (name, ([ section for section in added if membership_id(name, section) in written ],
+            [ section for section in removed if membership_id(name, section) in written ]))
+            for name, (added, removed) in changes.iteritems() ])
+
+    @guarded_call
+    def add_parent(self, section, parent):
+        """
+        Nest a group in a parent group.  Its members become members of the
+        parent and it inherits the parent's permissions.
+        :param section: The name of the group to nest.
+        :param parent: The name of the parent group.
+        :return: True if the group was nested, False if either group does not exist or it was already nested there.
+        :raise ValueError: If nesting is not enabled or the parent is nested in the group.
+        """
+        return self._change_parent(section, parent, True)
+
+    @guarded_call
+    def remove_parent(self, section, parent):
+        """
+        Stop nesting a group in a parent group.
+        :param section: The name of the nested group.
+        :param parent: The name of the parent group.
+        :return: True if the group was removed from the parent, False if it was not nested there.
+        :raise ValueError: If nesting is not enabled.
+        """
+        return self._change_parent(section, parent, False)
 
+    def _change_parent(self, section, parent, add):
+        """
+        Add or remove a parent of a group and update the ancestors of the
+        group and of every group nested in it.
+        """
+        if self.tree is None:
+            raise ValueError('nested groups are not enabled')
+        groups = self.tree.get_groups([section, parent])
+        if section not in groups or (add and parent not in groups):
+            return False
+        parents = list(getattr(groups[section], self.group_parents_key))
+        if add == (parent in parents):
+            return False
+        if add:
+            parents.append(parent)
+        else:
+            parents.remove(parent)
+        changed = self.tree.update([section], {section: parents})
+        self._update_ancestors(changed)
+        return section in changed
+
+    def _update_ancestors(self, changed):
+        """
+        Apply recomputed ancestors to the authorization index.
+        :param changed: A dict mapping group names to their lists of ancestor names.
+        """
+        for name, ancestors in changed.iteritems():
+            self._update_index('set_ancestors', name, ancestors)
+        if changed:
+            self._invalidate_claims()
+
+    @guarded_read
     def _section_exists(self, section):
         """
         Check if a group exists.
         :param section: The name of the group to check.
         :return: True if the group exists, False otherwise.
         """
-        return len(self.Group.view(self.group_list_view, key=section)) > 0
+        return len(view(self.Group, self.db, self.group_list_view, key=section)) > 0
 
+    @guarded_call
     def _create_section(self, section):
         """
         Create a new group.
@@ -167,57 +858,142 @@ class GroupAdapter(BaseSourceAdapter):
         """
         group = self.Group()
         setattr(group, self.group_name_key, section)
-        group.save()
+        save(group, self.db)
+        self._update_index('add_group', section)
 
+    @guarded_call
     def _edit_section(self, section, new_section):
         """
-        Edit a group name.
+        Edit a group name.  When groups are nested, the groups nested in it
+        have their parents and ancestors changed to the new name.
         :param section: The name of the group to change.
         :param new_section: The new name of the group.
         """
         group = self._get_group(section)
         if group is not None:
             setattr(group, self.group_name_key, new_section)
-            group.save()
+            save(group, self.db)
+            # Users keep the old name in their embedded groups, so the old
+            # memberships stay indexed under it.
+            self._update_index('add_group', new_section)
+            self._invalidate_claims()
+            if self.tree is not None:
+                self._rename_parent(section, new_section, group)
+
+    def _rename_parent(self, section, new_section, group):
+        """
+        Replace the old name of a renamed group in the parents and ancestors
+        of the groups nested in it.
+        :param section: The old name of the group.
+        :param new_section: The new name of the group.
+        :param group: The renamed group document.
+        """
+        parents = {}
+        for name, child in self.tree.descendants([section]).iteritems():
+            names = list(getattr(child, self.group_parents_key))
+            if section in names:
+                parents[name] = [ new_section if parent == section else parent for parent in names ]
+        changed = self.tree.update([section, new_section], parents)
+        changed.setdefault(new_section, list(getattr(group, self.tree.ancestors_key)))
+        self._update_ancestors(changed)
 
+    @guarded_call
     def _delete_section(self, section):
         """
         Delete the group.
         :param section: The name of the group to delete.
         """
         group = self._get_group(section)
-        if group is not None:
-            save_users = []
-            users = self.User.view(self.user_by_group_view, key=section)
-            for user in users:
-                add_user = False
-                groups = getattr(user, self.user_groups_key)
-                for i in range(len(groups)-1, -1, -1):
-                    if getattr(groups[i], self.group_name_key) == section:
-                        del groups[i]
-                        add_user = True
-                if add_user:
-                    save_users.append(user)
-            self.User.bulk_save(save_users)
-            group.delete()
+        if group is not None and self.edges:
+            ids = [ row['id'] for row in _iter_rows(self._edge_db(), self.membership_by_group_view, section, 1000) ]
+            delete_edges(self._edge_db(), ids)
+            delete(group, self.db)
+            self._update_index('remove_group', section)
+            self._invalidate_claims()
+        elif group is not None:
+            users = self._query_users(self.user_by_group_view, key=section, reduce=False)
+            self._edit_users(users, _remove_edit(self.user_groups_key, self.group_name_key, section))
+            delete(group, self.db)
+            self._update_index('remove_group', section)
+            self._invalidate_claims()
+        if group is not None and self.tree is not None:
+            self._update_ancestors(self.tree.update([section], deleted=[section]))
 
 class PermissionAdapter(BaseSourceAdapter):
 
-    def __init__(self, translations):
+    def __init__(self, translations, claims=None, index=None, breaker=None, db=None, edges=False, retries=3,
+            backoff=0.05, nested=False, wildcards=False):
         """
-        Constructor.  Configures the adapter with the given translations dict.
+        Constructor.  Configures the adapter with a copy of the given translations dict, with missing keys
+        taken from the default translations.
         :param translations: The translations to use when mapping requests against a model.
+        :param claims: Optional ClaimsContext to answer permission lookups from.
+        :param index: Optional AuthzIndex to answer membership checks from.
+        :param breaker: Optional CircuitBreaker to run database calls through.
+        :param db: Optional database to use instead of the databases set on the document classes.
+        :param edges: Whether grants are stored as Grant documents instead of embedded in groups.
+        :param retries: The number of times groups whose save conflicts are fetched and changed again.
+        :param backoff: The delay in seconds before the first retry of a conflicting save.
+        :param nested: Whether groups may be nested in other groups.
+        :param wildcards: Whether permissions ending in a '*' segment grant every permission below them.
         """
-        self.t11 = translations
+        self.t11 = merge_translations(translations)
+        self.db = db
+        self.edges = edges
+        self.retries = retries
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.metrics = dict([ (name, 0) for name in ('conflicts', 'retries', 'failures') ])
+        self.tries = TrieCache() if wildcards else None
+        self.claims = claims
+        self.index = index
+        self.breaker = breaker
         self.Group = self.t11['group_class']
         self.group_name_key = self.t11['group_name_key']
         self.group_perms_key = self.t11['group_perms_key']
         self.group_list_view = self.t11['group_list_view']
         self.group_by_perm_view = self.t11['group_by_perm_view']
+        self.group_names_view = self.t11['group_names_view']
         self.Permission = self.t11['perm_class']
         self.perm_name_key = self.t11['perm_name_key']
         self.perm_list_view = self.t11['perm_list_view']
         self.perm_by_group_view = self.t11['perm_by_group_view']
+        self.perm_names_view = self.t11['perm_names_view']
+        self.grant_by_group_view = self.t11['grant_by_group_view']
+        self.grant_by_perm_view = self.t11['grant_by_perm_view']
+        self.tree = GroupTree(self.t11, db, retries, backoff, self._count) if nested else None
+
+    def _invalidate_claims(self):
+        """
+        Invalidate issued claims and cached permission tries after a membership change.
+        """
+        if self.claims is not None:
+            self.claims.invalidate()
+        if self.tries is not None:
+            self.tries.invalidate()
+
+    def _count(self, name, value):
+        """
+        Increment a metric.
+        """
+        with self.lock:
+            self.metrics[name] += value
+
+    def _use_index(self):
+        """
+        Check if lookups may be answered from the authorization index.
+        """
+        return self.index is not None and self.index.loaded
+
+    def _update_index(self, method, *args):
+        """
+        Apply a change to the authorization index if one is loaded.  Read-only
+        indexes such as snapshots are left alone.
+        :param method: The name of the AuthzIndex method to call.
+        :param args: The arguments to pass to the method.
+        """
+        if self._use_index() and not self.index.readonly:
+            getattr(self.index, method)(*args)
 
     def _get_group(self, name):
         """
@@ -225,7 +1001,7 @@ class PermissionAdapter(BaseSourceAdapter):
         :param name: The name of the group to get.
         :return: The named group document or None if not found.
         """
-        groups = self.Group.view(self.group_list_view, key=name)
+        groups = view(self.Group, self.db, self.group_list_view, key=name)
         if len(groups) > 0:
             return groups.__iter__().next()
         return None
@@ -236,11 +1012,49 @@ class PermissionAdapter(BaseSourceAdapter):
         :param name: The name of the permission to get.
         :return: The named permission document or None if not found.
         """
-        perms = self.Permission.view(self.perm_list_view, key=name)
+        perms = view(self.Permission, self.db, self.perm_list_view, key=name)
         if len(perms) > 0:
             return perms.__iter__().next()
         return None
 
+    def _edit_groups(self, groups, edit):
+        """
+        Apply an edit to group documents and save the changed ones, retrying
+        groups whose save conflicts.
+        :param groups: A list of group documents to edit.
+        :param edit: A callable modifying a group and returning True if it changed.
+        :return: A list of the names of the groups which were changed and saved.
+        """
+        saved, errors = bulk_edit(self.Group, get_db(self.Group, self.db), groups, edit, self.retries,
+            self.backoff, self._count)
+        for error in errors:
+            log.warning('failed to save group %s: %s', error.get('id'), error.get('error'))
+        return [ getattr(group, self.group_name_key) for group in saved ]
+
+    def _refresh_inherited(self, names):
+        """
+        Recompute the permissions inherited by the groups nested in groups
+        whose permissions changed.
+        :param names: The names of the groups whose permissions changed.
+        """
+        if self.tree is not None and not self.edges and names:
+            self.tree.update(names)
+
+    def _edge_db(self):
+        """
+        Get the database holding Grant documents.
+        """
+        return get_db(self.Group, self.db)
+
+    def _existing_groups(self, names):
+        """
+        Find which of several groups exist with a single query.
+        :param names: A list of group names.
+        :return: A list of the names of the groups which exist.
+        """
+        rows = get_db(self.Group, self.db).view(self.group_names_view, keys=list(names))
+        return [ row['key'] for row in rows ]
+
     def _get_all_sections(self):
         """
         Get a dictionary containing all permissions.  The keys will be the permission
@@ -248,27 +1062,163 @@ class PermissionAdapter(BaseSourceAdapter):
         :return: A dictionary of permission to group name list mappings.
         """
         sections = {}
-        perms = self.Permission.view(self.perm_list_view)
-        for perm in perms:
-            name = getattr(perm, self.perm_name_key)
+        for name in self._get_perm_names():
             sections[name] = self._get_section_items(name)
         return sections
 
+    @guarded_read
+    def _get_perm_names(self):
+        """
+        Get the names of all permissions.
+        :return: A list of permission names.
+        """
+        perms = view(self.Permission, self.db, self.perm_list_view)
+        return [ getattr(perm, self.perm_name_key) for perm in perms ]
+
+    def page_permission_names(self, prefix=None, start=None, limit=50):
+        """
+        Get a page of permission names in key order.
+        :param prefix: Optional prefix the names must start with.
+        :param start: Optional name to start at, as returned for the previous page.
+        :param limit: The maximum number of names to return.
+        :return: A tuple of the list of names and the start of the next page, or None if this is the last page.
+        """
+        return self._page_permission_names(prefix, start, limit)
+
+    @guarded_read
+    def _page_permission_names(self, prefix, start, limit):
+        """
+        Query a page of permission names.
+        """
+        rows = get_db(self.Permission, self.db).view(self.perm_names_view, **_page_params(prefix, start, limit))
+        return _page([ row['key'] for row in rows ], limit)
+
+    @guarded_read
     def _get_section_items(self, section):
         """
         Get a list of group names for the given permission.
         :param section: The name of the permission to retrieve group names for.
         :return: A list of group names.  Will be empty of the permission does not exist.
         """
-        groups = self.Group.view(self.group_by_perm_view, key=section)
-        return [ getattr(group, self.group_name_key) for group in groups ]
+        return list(self.iter_section_items(section))
+
+    def iter_section_items(self, section, page_size=1000):
+        """
+        Stream the group names of a permission.  Rows are fetched a page at a
+        time and are not wrapped in documents.
+        :param section: The name of the permission to retrieve group names for.
+        :param page_size: The number of rows to fetch per request.
+        :return: An iterator over group names.
+        """
+        if self.tries is not None:
+            seen = set()
+            for name in covering_grants(section):
+                for group in self._iter_granted_items(name, page_size):
+                    if group not in seen:
+                        seen.add(group)
+                        yield group
+            return
+        for group in self._iter_granted_items(section, page_size):
+            yield group
+
+    def _iter_granted_items(self, section, page_size):
+        """
+        Stream the names of the groups a permission name is granted to directly.
+        """
+        if self.edges:
+            for row in _iter_rows(self._edge_db(), self.grant_by_perm_view, section, page_size):
+                yield row['value']
+            return
+        for row in _iter_rows(get_db(self.Group, self.db), self.group_by_perm_view, section, page_size):
+            yield row['value'][self.group_name_key]
+
+    @guarded_read
+    def count_section_items(self, section):
+        """
+        Count the groups holding a permission.  With wildcards the groups are
+        listed instead, since a group may hold a permission through several grants.
+        :param section: The name of the permission.
+        :return: The number of groups holding the permission.
+        """
+        if self.tries is not None:
+            return len(set(self.iter_section_items(section)))
+        if self.edges:
+            rows = self._edge_db().view(self.grant_by_perm_view, key=section)
+        else:
+            rows = get_db(self.Group, self.db).view(self.group_by_perm_view, key=section)
+        return sum([ row['value'] for row in rows ])
+
+    @guarded_read
+    def count_all_section_items(self):
+        """
+        Count the groups holding every permission.
+        :return: A dict mapping each permission name to its number of groups.
+        """
+        if self.edges:
+            rows = self._edge_db().view(self.grant_by_perm_view, group=True)
+        else:
+            rows = get_db(self.Group, self.db).view(self.group_by_perm_view, group=True)
+        names = [ row['key'] for row in get_db(self.Permission, self.db).view(self.perm_names_view) ]
+        return _counts(rows, names)
 
     def _find_sections(self, hint):
         """
-        Retrieve permissions containing a particular group.
+        Retrieve permissions containing a particular group.  With wildcards
+        the existing permissions granted by wildcard grants are included.
+        :param hint: The group name to retrieve permissions for.
+        """
+        sections = self._find_granted_sections(hint)
+        if self.tries is not None:
+            prefixes = [ prefix for prefix in map(wildcard_prefix, sections) if prefix is not None ]
+            if prefixes:
+                return sorted(set(sections) | set(self._expand_wildcards(tuple(sorted(prefixes)))))
+        return sections
+
+    @guarded_read
+    def _expand_wildcards(self, prefixes):
+        """
+        Get the names of the existing permissions below wildcard prefixes.
+        :param prefixes: The prefixes granted by wildcards.
+        :return: A list of permission names.
+        """
+        db = get_db(self.Permission, self.db)
+        if '' in prefixes:
+            return [ row['key'] for row in db.view(self.perm_names_view) ]
+        names = []
+        for prefix in prefixes:
+            names.extend([ row['key'] for row in db.view(self.perm_names_view, startkey=prefix,
+                endkey=prefix + u'\ufff0') ])
+        return names
+
+    def _find_granted_sections(self, hint):
+        """
+        Get the permission names granted to a group, with wildcard grants unexpanded.
         :param hint: The group name to retrieve permissions for.
         """
-        perms = self.Permission.view(self.perm_by_group_view, key=hint)
+        if self.claims is not None:
+            sections = self.claims.permissions(hint)
+            if sections is not None:
+                return sections
+        if self._use_index():
+            sections = self.index.permissions_of(hint)
+            if sections is not None:
+                return sections
+        return self._find_group_sections(hint)
+
+    @guarded_read
+    def _find_group_sections(self, name):
+        """
+        Get the names of the permissions a group holds from the database,
+        including those inherited when groups are nested.
+        :param name: The name of the group.
+        :return: A list of permission names.  Will be empty if the group does not exist.
+        """
+        if self.edges and self.tree is not None:
+            rows = self._edge_db().view(self.grant_by_group_view, keys=self.tree.expand([name]))
+            return list(set([ row['value'] for row in rows ]))
+        if self.edges:
+            return [ row['value'] for row in self._edge_db().view(self.grant_by_group_view, key=name) ]
+        perms = view(self.Permission, self.db, self.perm_by_group_view, key=name)
         return [ getattr(perm, self.perm_name_key) for perm in perms ]
 
     def _item_is_included(self, section, item):
@@ -278,57 +1228,190 @@ class PermissionAdapter(BaseSourceAdapter):
         :param item: The name of the group to check.
         :return: True if the group is in the permission, False otherwise.
         """
-        group = self._get_group(item)
-        if group is not None:
-            for perm in getattr(group, self.group_perms_key):
-                if getattr(perm, self.perm_name_key) == section:
-                    return True
-        return False
+        if self.tries is not None:
+            trie = self.tries.get(item)
+            if trie is None:
+                generation = self.tries.generation
+                trie = self.tries.put(item, self._find_granted_sections(item), generation)
+            return trie.matches(section)
+        if self._use_index():
+            included = self.index.is_granted(item, section)
+            if included is not None:
+                return included
+        return section in self._find_group_sections(item)
 
+    @guarded_call
     def _include_items(self, section, items):
         """
         Add groups to a permission.
         :param section: The name of the permission to add the groups to.
         :param items: A list containing names of groups to add to the permission.
         """
+        if self.edges:
+            self._include_edges(section, items)
+            return
         perm = self._get_perm(section)
         if perm is not None:
-            save_groups = []
-            for item in items:
-                group = self._get_group(item)
-                if group is not None:
-                    getattr(group, self.group_perms_key).append(perm)
-                    save_groups.append(group)
-            self.Group.bulk_save(save_groups)
+            groups = [ group for group in [ self._get_group(item) for item in items ] if group is not None ]
+            names = self._edit_groups(groups, _add_edit(self.group_perms_key, self.perm_name_key, perm))
+            for name in names:
+                self._update_index('grant', name, section)
+            self._refresh_inherited(names)
+            self._invalidate_claims()
 
+    @guarded_call
     def _exclude_items(self, section, items):
         """
         Remove groups from a permission.
         :param section: The name of the permission to remove groups from.
         :param items: A list containing names of groups to remove from the permission.
         """
-        save_groups = []
-        for item in items:
-            group = self._get_group(item)
-            if group is not None:
-                add_group = False
-                perms = getattr(group, self.group_perms_key)
-                for i in range(len(perms)-1, -1, -1):
-                    if getattr(perms[i], self.perm_name_key) == section:
-                        del perms[i]
-                        add_group = True
-                if add_group:
-                    save_groups.append(group)
-        self.Group.bulk_save(save_groups)
+        if self.edges:
+            self._exclude_edges(section, items)
+            return
+        groups = [ group for group in [ self._get_group(item) for item in items ] if group is not None ]
+        names = self._edit_groups(groups, _remove_edit(self.group_perms_key, self.perm_name_key, section))
+        for name in names:
+            self._update_index('revoke', name, section)
+        self._refresh_inherited(names)
+        self._invalidate_claims()
+
+    def _include_edges(self, section, items):
+        """
+        Add groups to a permission by inserting Grant documents.
+        :param section: The name of the permission to add the groups to.
+        :param items: A list containing names of groups to add to the permission.
+        """
+        if self._get_perm(section) is None:
+            return
+        names = self._existing_groups(items)
+        ids = dict([ (grant_id(name, section), name) for name in names ])
+        for doc_id in insert_edges(self._edge_db(), [ grant_doc(name, section) for name in names ], False):
+            self._update_index('grant', ids[doc_id], section)
+        self._invalidate_claims()
+
+    def _exclude_edges(self, section, items):
+        """
+        Remove groups from a permission by deleting Grant documents.
+        :param section: The name of the permission to remove groups from.
+        :param items: A list containing names of groups to remove from the permission.
+        """
+        ids = dict([ (grant_id(item, section), item) for item in items ])
+        for doc_id in delete_edges(self._edge_db(), ids.keys()):
+            self._update_index('revoke', ids[doc_id], section)
+        self._invalidate_claims()
 
+    def set_group_permissions(self, group, perms):
+        """
+        Set the permissions of a group, adding and removing only the grants
+        which differ from the stored ones.  Permissions which do not exist are
+        ignored.
+        :param group: The name of the group.
+        :param perms: The names of the permissions the group should hold.
+        :return: A tuple of the lists of permission names added and removed, or None if the group does not exist.
+        """
+        return self.set_groups_permissions({group: perms}).get(group)
+
+    @guarded_call
+    def set_groups_permissions(self, targets):
+        """
+        Set the permissions of many groups.  The groups, their current
+        permissions and the target permissions are each read with one
+        multi-key query and all changed groups are written with one bulk
+        request.
+        :param targets: A dict mapping group names to the names of the permissions they should hold.
+        :return: A dict mapping the name of each existing group to a tuple of the lists of permission names added and removed.
+        """
+        targets = dict([ (name, set(perms)) for name, perms in targets.iteritems() ])
+        wanted = set()
+        for perms in targets.itervalues():
+            wanted |= perms
+        if self.edges:
+            changes = self._set_edges(targets, wanted)
+        else:
+            changes = self._set_embedded(targets, wanted)
+        for name, (added, removed) in changes.iteritems():
+            for section in added:
+                self._update_index('grant', name, section)
+            for section in removed:
+                self._update_index('revoke', name, section)
+        changed = [ name for name, change in changes.iteritems() if change[0] or change[1] ]
+        self._refresh_inherited(changed)
+        if changed:
+            self._invalidate_claims()
+        return changes
+
+    def _set_embedded(self, targets, wanted):
+        """
+        Set the permissions of groups by rewriting the permissions embedded in
+        the group documents.  Groups whose save conflicts are read again and
+        the difference is recomputed; groups which could not be saved are
+        reported unchanged.
+        """
+        groups = view(self.Group, self.db, self.group_list_view, keys=targets.keys())
+        perms = {}
+        if wanted:
+            for perm in view(self.Permission, self.db, self.perm_list_view, keys=list(wanted)):
+                perms[getattr(perm, self.perm_name_key)] = perm
+        changes = {}
+        def edit(group):
+            name = getattr(group, self.group_name_key)
+            group_perms = getattr(group, self.group_perms_key)
+            current = set([ getattr(perm, self.perm_name_key) for perm in group_perms ])
+            target = set([ perm for perm in targets[name] if perm in perms ])
+            added = sorted(target - current)
+            removed = sorted(current - target)
+            changes[name] = (added, removed)
+            for i in range(len(group_perms)-1, -1, -1):
+                if getattr(group_perms[i], self.perm_name_key) in removed:
+                    del group_perms[i]
+            for section in added:
+                group_perms.append(perms[section])
+            return len(added) > 0 or len(removed) > 0
+        saved = set(self._edit_groups(list(groups), edit))
+        return dict([ (name, change if name in saved else ([], [])) for name, change in changes.iteritems() ])
+
+    def _set_edges(self, targets, wanted):
+        """
+        Set the permissions of groups by inserting and deleting Grant documents.
+        """
+        db = self._edge_db()
+        names = self._existing_groups(targets.keys())
+        perms = set()
+        if wanted:
+            perms = set([ row['key'] for row in get_db(self.Permission, self.db).view(self.perm_names_view,
+                keys=list(wanted)) ])
+        current = dict([ (name, set()) for name in names ])
+        if names:
+            for row in db.view(self.grant_by_group_view, keys=names):
+                current[row['key']].add(row['value'])
+        changes = {}
+        insert = []
+        remove = []
+        for name in names:
+            target = targets[name] & perms
+            added = sorted(target - current[name])
+            removed = sorted(current[name] - target)
+            changes[name] = (added, removed)
+            insert.extend([ grant_doc(name, section) for section in added ])
+            remove.extend([ grant_id(name, section) for section in removed ])
+        written = set(insert_edges(db, insert, False)) | set(delete_edges(db, remove))
+        if len(written) < len(insert) + len(remove):
+            log.warning('failed to write %i grant documents', len(insert) + len(remove) - len(written))
+        return dict([ (name, ([ section for section in added if grant_id(name, section) in written ],
+            [ section for section in removed if grant_id(name, section) in written ]))
+            for name, (added, removed) in changes.iteritems() ])
+
+    @guarded_read
     def _section_exists(self, section):
         """
         Check if a permission exists.
         :param section: The name of the permission to check.
         :return: True if the permission exists, False otherwise.
         """
-        return len(self.Permission.view(self.perm_list_view, key=section)) > 0
+        return len(view(self.Permission, self.db, self.perm_list_view, key=section)) > 0
 
+    @guarded_call
     def _create_section(self, section):
         """
         Create a new permission.
@@ -336,8 +1419,10 @@ class PermissionAdapter(BaseSourceAdapter):
         """
         perm = self.Permission()
         setattr(perm, self.perm_name_key, section)
-        perm.save()
+        save(perm, self.db)
+        self._update_index('add_permission', section)
 
+    @guarded_call
     def _edit_section(self, section, new_section):
         """
         Edit a permission name.
@@ -347,26 +1432,30 @@ class PermissionAdapter(BaseSourceAdapter):
         perm = self._get_perm(section)
         if perm is not None:
             setattr(perm, self.perm_name_key, new_section)
-            perm.save()
+            save(perm, self.db)
+            # Groups keep the old name in their embedded permissions, so the
+            # old grants stay indexed under it.
+            self._update_index('add_permission', new_section)
+            self._invalidate_claims()
 
+    @guarded_call
     def _delete_section(self, section):
         """
         Delete the permission.
         :param section: The name of the permission to delete.
         """
         perm = self._get_perm(section)
-        if perm is not None:
-            save_groups = []
-            groups = self.Group.view(self.group_by_perm_view, key=section)
-            for group in groups:
-                add_group = False
-                perms = getattr(group, self.group_perms_key)
-                for i in range(len(perms)-1, -1, -1):
-                    if getattr(perms[i], self.perm_name_key) == section:
-                        del perms[i]
-                        add_group = True
-                if add_group:
-                    save_groups.append(group)
-            self.Group.bulk_save(save_groups)
-            perm.delete()
+        if perm is not None and self.edges:
+            ids = [ row['id'] for row in _iter_rows(self._edge_db(), self.grant_by_perm_view, section, 1000) ]
+            delete_edges(self._edge_db(), ids)
+            delete(perm, self.db)
+            self._update_index('remove_permission', section)
+            self._invalidate_claims()
+        elif perm is not None:
+            groups = view(self.Group, self.db, self.group_by_perm_view, key=section, reduce=False)
+            self._refresh_inherited(self._edit_groups(groups,
+                _remove_edit(self.group_perms_key, self.perm_name_key, section)))
+            delete(perm, self.db)
+            self._update_index('remove_permission', section)
+            self._invalidate_claims()
 
@@ -0,0 +1,153 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+This module provides an audit log of authentication events.
+
+Events are dicts which are queued without blocking the request and written to
+an audit database by a background thread in bulk batches.  A batch is written
+once batch_size events are waiting or when the oldest waiting event is
+interval seconds old.
+
+The queue is bounded.  When it is full, the 'drop' policy discards the new
+event while the 'block' policy makes the caller wait up to block_timeout
+seconds for room, dropping the event only if none is made.  Events from a
+batch which cannot be written are discarded and counted.  Queued events are
+written when the log is closed, which happens at interpreter exit if it has
+not been done before.  Events recorded after that are dropped.
+
+The current queue depth is available from the depth property, and counters of
+enqueued, dropped, written and failed events along with the duration of the
+last and slowest flush are kept in the metrics dict.
+"""
+
+import time, atexit, logging, threading, Queue
+
+__all__ = ['AuditLog']
+
+log = logging.getLogger(__name__)
+
+class AuditLog(object):
+    """
+    Asynchronous batched writer of audit events.
+    """
+
+    def __init__(self, db, max_queue=10000, batch_size=500, interval=1, policy='drop', block_timeout=None):
+        """
+        Constructor.  Starts the writer thread.
+        :param db: The audit database.
+        :param max_queue: The maximum number of events waiting to be written.
+        :param batch_size: The maximum number of events written in one request.
+        :param interval: The maximum number of seconds an event waits before its batch is written.
+        :param policy: What to do when the queue is full, either 'drop' or 'block'.
+        :param block_timeout: The number of seconds to wait for room under the 'block' policy.  None waits indefinitely.
+        """
+        if policy not in ('drop', 'block'):
+            raise ValueError('unknown audit queue policy %r' % policy)
+        self.db = db
+        self.batch_size = batch_size
+        self.interval = interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.queue = Queue.Queue(max_queue)
+        self.lock = threading.Lock()
+        self.metrics = dict([ (name, 0) for name in
+            ('enqueued', 'dropped', 'written', 'failed', 'flushes', 'flush_latency', 'max_flush_latency') ])
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name='whatcouch-audit')
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    @property
+    def depth(self):
+        """
+        The number of events waiting to be written.
+        """
+        return self.queue.qsize()
+
+    def _count(self, name, value=1):
+        """
+        Increment a metric.
+        """
+        with self.lock:
+            self.metrics[name] += value
+
+    def record(self, event):
+        """
+        Queue an event to be written.
+        :param event: A dict describing the event.  A 'time' key is added if missing.
+        :return: True if the event was queued, False if it was dropped.
+        """
+        if self.stopped:
+            self._count('dropped')
+            return False
+        event.setdefault('time', time.time())
+        try:
+            if self.policy == 'block':
+                self.queue.put(event, True, self.block_timeout)
+            else:
+                self.queue.put_nowait(event)
+        except Queue.Full:
+            self._count('dropped')
+            return False
+        self._count('enqueued')
+        return True
+
+    def run(self):
+        """
+        Writer thread main loop.  Collects events into batches and writes them.
+        """
+        while True:
+            batch = [self.queue.get()]
+            if batch[0] is None:
+                return
+            deadline = time.time() + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                try:
+                    event = self.queue.get(remaining > 0, max(remaining, 0))
+                except Queue.Empty:
+                    break
+                if event is None:
+                    self._write(batch)
+                    return
+                batch.append(event)
+            self._write(batch)
+
+    def _write(self, batch):
+        """
+        Write a batch of events in one request.
+        :param batch: A list of event dicts.
+        """
+        start = time.time()
+        try:
+            self.db.bulk_save(batch)
+        except Exception:
+            log.exception('failed to write %i audit events', len(batch))
+            self._count('failed', len(batch))
+            return
+        latency = time.time() - start
+        with self.lock:
+            self.metrics['written'] += len(batch)
+            self.metrics['flushes'] += 1
+            self.metrics['flush_latency'] = latency
+            self.metrics['max_flush_latency'] = max(self.metrics['max_flush_latency'], latency)
+
+    def close(self):
+        """
+        Write the queued events and stop the writer thread.
+        """
+        with self.lock:
+            if self.stopped:
+                return
+            self.stopped = True
+        self.queue.put(None)
+        self.thread.join()
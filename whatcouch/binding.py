@@ -0,0 +1,153 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+This module binds document classes to databases.
+
+The adapters and plugins normally use the database set on each document class
+with set_db(), as done by init_model().  They may instead be given their own
+database, in which case every query and write goes to that database and the
+document classes are only used to wrap results.  This allows several tenants,
+each with its own database, to share one process, its connection pool and the
+document classes.
+
+Edits to existing documents may be saved with bulk_edit(), which applies an
+edit to every document, saves the changed ones in one request and retries the
+documents which conflict with a concurrent write.  Only the conflicting
+documents are fetched again, with one multi-key request per attempt, and the
+edit is reapplied to their current revisions.  Attempts are separated by an
+exponentially growing, jittered delay and bounded in number.
+"""
+
+import time, random
+
+try:
+    from couchdbkit.exceptions import BulkSaveError
+except ImportError:
+    BulkSaveError = None
+
+__all__ = ['get_db', 'view', 'save', 'delete', 'bulk_save', 'bulk_write', 'bulk_edit']
+
+def get_db(cls, db=None):
+    """
+    Get the database to use for a document class.
+    :param cls: The document class.
+    :param db: The bound database or None to use the class database.
+    :return: The database.
+    """
+    if db is None:
+        return cls.get_db()
+    return db
+
+def view(cls, db, view_name, **params):
+    """
+    Query a view, wrapping the results in a document class.
+    :param cls: The document class used to wrap the results.
+    :param db: The bound database or None to use the class database.
+    :param view_name: The name of the view to query.
+    :param params: Additional view parameters.
+    :return: The view results.
+    """
+    if db is None:
+        return cls.view(view_name, **params)
+    return db.view(view_name, schema=cls, **params)
+
+def save(doc, db=None):
+    """
+    Save a document.
+    :param doc: The document to save.
+    :param db: The bound database or None to use the class database.
+    """
+    if db is None:
+        doc.save()
+    else:
+        db.save_doc(doc)
+
+def delete(doc, db=None):
+    """
+    Delete a document.
+    :param doc: The document to delete.
+    :param db: The bound database or None to use the class database.
+    """
+    if db is None:
+        doc.delete()
+    else:
+        db.delete_doc(doc)
+
+def bulk_save(cls, docs, db=None):
+    """
+    Save several documents in a single request.
+    :param cls: The document class.
+    :param docs: The documents to save.
+    :param db: The bound database or None to use the class database.
+    """
+    get_db(cls, db).bulk_save(docs)
+
+def bulk_write(db, docs):
+    """
+    Save several documents in a single request and report the documents
+    which could not be saved.  Depending on the couchdbkit version failed
+    documents are either returned in the results or raised in a
+    BulkSaveError; both are handled.
+    :param db: The database.
+    :param docs: The documents to save.
+    :return: A list of the result rows with an 'error' key, each holding the document 'id'.
+    """
+    if not docs:
+        return []
+    try:
+        results = db.bulk_save(docs)
+    except Exception, e:
+        if BulkSaveError is None or not isinstance(e, BulkSaveError):
+            raise
+        results = e.errors
+    return [ result for result in results or [] if 'error' in result ]
+
+def bulk_edit(cls, db, docs, edit, retries=3, backoff=0.05, count=None):
+    """
+    Apply an edit to documents and save the changed ones in a single request.
+    Documents which conflict with a concurrent write are fetched again, the
+    edit is reapplied and they are saved again, up to a number of retries.
+    The edit must give the same result when applied to a newer revision, for
+    example by adding an item only if it is missing.
+    :param cls: The document class used to wrap fetched documents.
+    :param db: The database.
+    :param docs: The documents to edit.
+    :param edit: A callable modifying a document in place and returning True if it changed.
+    :param retries: The maximum number of times conflicting documents are fetched and saved again.
+    :param backoff: The delay in seconds before the first retry.  Each retry doubles it.
+    :param count: Optional callable taking a counter name and an amount, called for 'conflicts', 'retries' and 'failures'.
+    :return: A tuple of the list of saved documents and the list of the result rows of the documents which could not be saved.
+    """
+    if count is None:
+        count = lambda name, value: None
+    saved = []
+    errors = []
+    pending = [ doc for doc in docs if edit(doc) ]
+    attempt = 0
+    while pending:
+        failed = dict([ (result.get('id'), result) for result in bulk_write(db, pending) ])
+        saved.extend([ doc for doc in pending if doc['_id'] not in failed ])
+        conflicts = [ doc_id for doc_id, result in failed.iteritems() if result['error'] == 'conflict' ]
+        errors.extend([ result for result in failed.itervalues() if result['error'] != 'conflict' ])
+        if not conflicts:
+            break
+        count('conflicts', len(conflicts))
+        if attempt >= retries:
+            count('failures', len(conflicts))
+            errors.extend([ failed[doc_id] for doc_id in conflicts ])
+            break
+        time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+        attempt += 1
+        count('retries', 1)
+        rows = db.all_docs(keys=conflicts, include_docs=True)
+        pending = [ doc for doc in [ cls.wrap(row['doc']) for row in rows if row.get('doc') is not None ]
+            if edit(doc) ]
+    return saved, errors
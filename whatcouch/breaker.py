@@ -0,0 +1,364 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+This module provides a circuit breaker for the database calls made by the
+adapters and plugins.
+
+Every guarded call counts towards the breaker.  Errors which signal a mistake
+by the caller rather than a problem with CouchDB, ValueError, KeyError and
+TypeError by default, are raised without being counted.  After a number of
+consecutive failures the breaker opens and calls are rejected without touching CouchDB
+until the reset timeout has passed, after which a single trial call is let
+through.  A call which exceeds the latency budget counts as a failure.  Calls
+are then run on a small pool of worker threads so the caller can stop waiting;
+the call itself is left to finish in the background.
+
+Guarded methods must not call other guarded methods; with a latency budget
+the nested call could wait on a worker thread held by its caller.
+
+Reads keep the last good answer for each set of arguments.  When a read is
+rejected, fails or is too slow, the last good answer is returned instead and a
+background refresh is scheduled.  If there is no previous answer the error is
+raised.  Writes are never answered from the cache.
+
+Counters for calls, failures, timeouts, rejections, fallbacks and refreshes
+are available in the metrics dict.
+"""
+
+import sys, time, threading, Queue
+from collections import OrderedDict
+from functools import wraps
+
+__all__ = ['CircuitBreaker', 'CircuitOpenError', 'CallTimeoutError', 'guarded_read', 'guarded_call']
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a call is rejected because the breaker is open.
+    """
+
+class CallTimeoutError(Exception):
+    """
+    Raised when a call exceeds its latency budget.
+    """
+
+class Call(object):
+    """
+    A call submitted to the worker pool.
+    """
+
+    def __init__(self, func, args, kwargs, callback=None):
+        """
+        Constructor.
+        :param func: The callable to run.
+        :param args: The positional arguments to pass to the callable.
+        :param kwargs: The keyword arguments to pass to the callable.
+        :param callback: Optional callable invoked with the call after it completes.
+        """
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.callback = callback
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def run(self):
+        """
+        Run the call and record its result.
+        """
+        try:
+            self.value = self.func(*self.args, **self.kwargs)
+        except Exception:
+            self.error = sys.exc_info()
+        self.done.set()
+        if self.callback is not None:
+            self.callback(self)
+
+    def result(self):
+        """
+        Get the result of a completed call, re-raising its exception.
+        """
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.value
+
+class WorkerPool(object):
+    """
+    A fixed number of daemon threads running calls from a queue.
+    """
+
+    def __init__(self, size):
+        """
+        Constructor.  Starts the worker threads.
+        :param size: The number of worker threads.
+        """
+        self.queue = Queue.Queue()
+        for i in range(size):
+            thread = threading.Thread(target=self.work, name='whatcouch-breaker-%i' % i)
+            thread.daemon = True
+            thread.start()
+
+    def work(self):
+        """
+        Worker thread main loop.
+        """
+        while True:
+            self.queue.get().run()
+
+    def submit(self, call):
+        """
+        Queue a call to be run.
+        :param call: The call to run.
+        """
+        self.queue.put(call)
+
+def _freeze(value):
+    """
+    Convert an argument into a hashable cache key component.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted([ (k, _freeze(v)) for k, v in value.iteritems() ]))
+    if isinstance(value, (list, tuple)):
+        return tuple([ _freeze(v) for v in value ])
+    return value
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker with a last-known-good cache for reads.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, call_timeout=None, max_entries=10000, workers=4,
+            caller_errors=(ValueError, KeyError, TypeError)):
+        """
+        Constructor.
+        :param failure_threshold: The number of consecutive failures which opens the breaker.
+        :param reset_timeout: The number of seconds the breaker stays open before a trial call.
+        :param call_timeout: The latency budget of a call in seconds.  None waits for the call to complete.
+        :param max_entries: The maximum number of read results kept for fallback.
+        :param workers: The number of worker threads used to run calls when there is a latency budget.
+        :param caller_errors: The exception types raised for caller mistakes, which are not counted as failures.
+        """
+        self.caller_errors = caller_errors
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.call_timeout = call_timeout
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.cache = OrderedDict()
+        self.refreshing = set()
+        self.pool = WorkerPool(workers) if call_timeout is not None else None
+        self.metrics = dict([ (name, 0) for name in
+            ('calls', 'failures', 'timeouts', 'rejected', 'fallbacks', 'refreshes') ])
+
+    @property
+    def state(self):
+        """
+        The breaker state: 'closed', 'open' or 'half-open'.
+        """
+        if self.opened_at is None:
+            return 'closed'
+        if time.time() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def _count(self, name):
+        """
+        Increment a metric.
+        """
+        with self.lock:
+            self.metrics[name] += 1
+
+    def _allow(self):
+        """
+        Check if a call may be made, claiming the trial call when half-open.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.reset_timeout and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def _success(self):
+        """
+        Record a successful call, closing the breaker.
+        """
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def _release(self):
+        """
+        Record a call which neither succeeded nor failed, releasing the trial
+        call when half-open.
+        """
+        with self.lock:
+            self.trial = False
+
+    def _failure(self):
+        """
+        Record a failed call, opening the breaker once the threshold is reached.
+        """
+        with self.lock:
+            self.metrics['failures'] += 1
+            self.failures += 1
+            if self.trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+            self.trial = False
+
+    def _store(self, key, value):
+        """
+        Remember a good read result.
+        """
+        with self.lock:
+            self.cache.pop(key, None)
+            self.cache[key] = value
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+    def _invoke(self, func, args, kwargs, key=None):
+        """
+        Run a call within the latency budget.  When a read times out its result
+        is still stored once the call completes.
+        """
+        self._count('calls')
+        if self.pool is None:
+            return func(*args, **kwargs)
+        def complete(call):
+            if call.error is None and key is not None:
+                self._store(key, call.value)
+        call = Call(func, args, kwargs, complete)
+        self.pool.submit(call)
+        if not call.done.wait(self.call_timeout):
+            self._count('timeouts')
+            raise CallTimeoutError('call exceeded %s seconds' % self.call_timeout)
+        return call.result()
+
+    def _refresh(self, key, func, args, kwargs):
+        """
+        Refresh a cached read in the background.  Only one refresh per key runs
+        at a time.
+        """
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+        def refresh():
+            try:
+                if self._allow():
+                    self._count('refreshes')
+                    try:
+                        value = self._invoke(func, args, kwargs, key)
+                    except self.caller_errors:
+                        self._release()
+                    except Exception:
+                        self._failure()
+                    else:
+                        self._success()
+                        self._store(key, value)
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+        thread = threading.Thread(target=refresh)
+        thread.daemon = True
+        thread.start()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Make a call which must not be answered from the cache, such as a write.
+        :param func: The callable to run.
+        :param args: The positional arguments to pass to the callable.
+        :param kwargs: The keyword arguments to pass to the callable.
+        :return: The return value of the callable.
+        :raise CircuitOpenError: If the breaker is open.
+        """
+        if not self._allow():
+            self._count('rejected')
+            raise CircuitOpenError('circuit breaker is open')
+        try:
+            value = self._invoke(func, args, kwargs)
+        except self.caller_errors:
+            self._release()
+            raise
+        except Exception:
+            self._failure()
+            raise
+        self._success()
+        return value
+
+    def read(self, key, func, *args, **kwargs):
+        """
+        Make a read call, falling back to the last good result for the key when
+        the breaker is open or the call fails or times out.
+        :param key: A hashable key identifying the read.
+        :param func: The callable to run.
+        :param args: The positional arguments to pass to the callable.
+        :param kwargs: The keyword arguments to pass to the callable.
+        :return: The return value of the callable or the cached result.
+        """
+        key = _freeze(key)
+        if not self._allow():
+            self._count('rejected')
+            error = (CircuitOpenError, CircuitOpenError('circuit breaker is open'), None)
+        else:
+            try:
+                value = self._invoke(func, args, kwargs, key)
+            except self.caller_errors:
+                self._release()
+                raise
+            except Exception:
+                error = sys.exc_info()
+                self._failure()
+            else:
+                self._success()
+                self._store(key, value)
+                return value
+        with self.lock:
+            found = key in self.cache
+            value = self.cache.get(key)
+        if not found:
+            raise error[0], error[1], error[2]
+        self._count('fallbacks')
+        self._refresh(key, func, args, kwargs)
+        return value
+
+def guarded_read(method):
+    """
+    Decorate a method which reads from the database so that it runs through
+    the circuit breaker of its object, if it has one.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.breaker is None:
+            return method(self, *args, **kwargs)
+        key = (self.__class__.__name__, id(self), method.__name__) + args
+        if kwargs:
+            key += (_freeze(kwargs),)
+        return self.breaker.read(key, method, self, *args, **kwargs)
+    return wrapper
+
+def guarded_call(method):
+    """
+    Decorate a method which uses the database and must not be answered from
+    the cache, such as a write, so that it runs through the circuit breaker of
+    its object, if it has one.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.breaker is None:
+            return method(self, *args, **kwargs)
+        return self.breaker.call(method, self, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,165 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+This module provides bulk authorization checks for batch jobs.
+
+A BulkChecker takes an iterable of (user, permission) pairs and yields
+(user, permission, allowed) for each of them, in order.  Pairs are read in
+batches.  For each batch the groups of all the users involved are read with
+one multi-key query, and the permissions of the groups not seen before with
+one more, after which the pairs are evaluated in memory:
+
+    checker = BulkChecker(group_adapter, perm_adapter)
+    for user, perm, allowed in checker.check(pairs):
+        ...
+
+Memory is bounded by the batch size and by the number of groups whose
+permissions are kept between batches.  Pairs answered by a loaded
+authorization index are not queried at all.  Expired memberships, nested
+groups and wildcard grants are honoured as they are by the adapters.
+"""
+
+from collections import OrderedDict
+from itertools import islice
+from whatcouch.binding import get_db
+from whatcouch.expiry import active_groups
+from whatcouch.wildcard import PermissionTrie
+
+__all__ = ['BulkChecker']
+
+class BulkChecker(object):
+    """
+    Evaluates many (user, permission) pairs with batched queries.
+    """
+
+    def __init__(self, group_adapter, perm_adapter, batch_size=1000, max_groups=10000):
+        """
+        Constructor.
+        :param group_adapter: The GroupAdapter used to read memberships.
+        :param perm_adapter: The PermissionAdapter used to read grants.
+        :param batch_size: The number of pairs evaluated per batch.
+        :param max_groups: The maximum number of groups whose permissions are kept between batches.
+        """
+        self.group_adapter = group_adapter
+        self.perm_adapter = perm_adapter
+        self.batch_size = batch_size
+        self.max_groups = max_groups
+        self.group_perms = OrderedDict()
+        self.metrics = dict([ (name, 0) for name in ('pairs', 'batches', 'queries', 'indexed') ])
+
+    def check(self, pairs):
+        """
+        Check whether users hold permissions.
+        :param pairs: An iterable of (user name, permission name) tuples.
+        :return: A generator of (user name, permission name, allowed) tuples in the order of the pairs.
+        """
+        pairs = iter(pairs)
+        while True:
+            batch = list(islice(pairs, self.batch_size))
+            if not batch:
+                return
+            self.metrics['batches'] += 1
+            self.metrics['pairs'] += len(batch)
+            for result in self._check_batch(batch):
+                yield result
+
+    def _check_batch(self, batch):
+        """
+        Evaluate one batch of pairs.
+        :param batch: A list of (user name, permission name) tuples.
+        :return: A list of (user name, permission name, allowed) tuples.
+        """
+        results = [ (user, perm, self._indexed(user, perm)) for user, perm in batch ]
+        users = list(set([ user for user, perm, allowed in results if allowed is None ]))
+        if not users:
+            return results
+        user_groups = self._user_groups(users)
+        self._load_permissions(set([ group for groups in user_groups.itervalues() for group in groups ]))
+        granted = {}
+        for user, groups in user_groups.iteritems():
+            names = set()
+            for group in groups:
+                names.update(self.group_perms[group])
+            if self.perm_adapter.tries is not None:
+                granted[user] = PermissionTrie(names).matches
+            else:
+                granted[user] = names.__contains__
+        return [ (user, perm, allowed if allowed is not None else user in granted and granted[user](perm))
+            for user, perm, allowed in results ]
+
+    def _indexed(self, user, perm):
+        """
+        Answer a pair from the authorization index of the group adapter.
+        :param user: The name of the user.
+        :param perm: The name of the permission.
+        :return: True or False, or None if the pair must be read from the database.
+        """
+        if self.perm_adapter.tries is not None or not self.group_adapter._use_index():
+            return None
+        allowed = self.group_adapter.index.has_permission(user, perm)
+        if allowed is not None:
+            self.metrics['indexed'] += 1
+        return allowed
+
+    def _user_groups(self, users):
+        """
+        Get the groups of several users with a single query.  With edge
+        documents and nested groups the ancestors of the groups are added with
+        one more query, since grants are not inherited by the grant view.
+        :param users: A list of user names.
+        :return: A dict mapping the name of each user found to a list of group names.
+        """
+        adapter = self.group_adapter
+        self.metrics['queries'] += 1
+        user_groups = {}
+        if adapter.edges:
+            for row in adapter._edge_db().view(adapter.membership_by_user_view, keys=users):
+                user_groups.setdefault(row['key'], []).append(row['value'])
+            tree = self.perm_adapter.tree
+            if tree is not None and user_groups:
+                self.metrics['queries'] += 1
+                groups = list(set([ group for names in user_groups.itervalues() for group in names ]))
+                ancestors = dict([ (row['key'], row['value'])
+                    for row in get_db(tree.Group, tree.db).view(tree.ancestors_view, keys=groups) ])
+                for user, names in user_groups.iteritems():
+                    expanded = set(names)
+                    for group in names:
+                        expanded.update(ancestors.get(group, []))
+                    user_groups[user] = list(expanded)
+        else:
+            for user in adapter._query_users(adapter.user_list_view, keys=users):
+                user_groups[getattr(user, adapter.user_name_key)] = active_groups(
+                    getattr(user, adapter.user_groups_key), adapter.group_name_key, adapter.group_expiry_key)
+        return user_groups
+
+    def _load_permissions(self, groups):
+        """
+        Make sure the permissions of groups are cached, reading the missing
+        ones with a single query.
+        :param groups: A set of group names.
+        """
+        for group in groups:
+            if group in self.group_perms:
+                self.group_perms[group] = self.group_perms.pop(group)
+        missing = [ group for group in groups if group not in self.group_perms ]
+        if missing:
+            self.metrics['queries'] += 1
+            adapter = self.perm_adapter
+            perms = dict([ (group, []) for group in missing ])
+            if adapter.edges:
+                for row in adapter._edge_db().view(adapter.grant_by_group_view, keys=missing):
+                    perms[row['key']].append(row['value'])
+            else:
+                for row in get_db(adapter.Permission, adapter.db).view(adapter.perm_by_group_view, keys=missing):
+                    perms[row['key']].append(row['value'][adapter.perm_name_key])
+            self.group_perms.update(perms)
+        while len(self.group_perms) > max(self.max_groups, len(groups)):
+            self.group_perms.popitem(last=False)
@@ -0,0 +1,332 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+This module allows authorization data to be carried in the signed auth_tkt
+cookie so that steady-state requests need not read the user from CouchDB.
+
+When a user is loaded the metadata plugin encodes the names of the user's
+groups and each group's permissions, along with a version stamp and the issue
+time, into the identity 'tokens'.  The auth_tkt plugin signs these into the
+cookie when it remembers the identity.  On later requests the plugin decodes
+the tokens and binds them to the current thread, and the adapters answer
+_find_sections() from them instead of querying views.
+
+Claims are discarded and recomputed when their version no longer matches the
+context version, they are older than the configured maximum age or the
+earliest expiry of the memberships they were issued from has passed.  The
+adapters bump the version whenever they change memberships.  Without a
+database the version is per-process, so a change made by one process is not
+seen by the claims checked by another until they reach their maximum age.
+Given a database, the version is kept in a shared ClaimsVersion document
+which every process reads at most once per check interval, so a change made
+anywhere invalidates all claims within that interval.  The maximum age
+defaults to an hour; None disables it, which is only safe with a shared
+version.
+
+Keep in mind that browsers limit cookies to roughly 4KB.  Users with a large
+number of groups or permissions should not use claims.
+"""
+
+import time, logging, threading
+from urllib import quote, unquote
+from couchdbkit import Document, IntegerProperty
+from whatcouch.binding import get_db, bulk_edit
+
+__all__ = ['Claims', 'ClaimsContext', 'ClaimsVersion', 'encode_claims', 'decode_claims']
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_AGE = 3600
+VERSION_DOC_ID = 'whatcouch:claims-version'
+
+VERSION_PREFIX = 'wcv:'
+GROUP_PREFIX = 'wcg:'
+PERM_PREFIX = 'wcp:'
+
+def _quote(name):
+    """
+    Quote a name for use inside a token.
+    """
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    return quote(name, safe='')
+
+def _unquote(value):
+    """
+    Reverse _quote().
+    """
+    return unquote(value).decode('utf-8')
+
+def _split_tokens(tokens):
+    """
+    Normalize the tokens from an identity into a list of strings.
+    """
+    if not tokens:
+        return []
+    if isinstance(tokens, basestring):
+        return [ token for token in tokens.split(',') if token ]
+    return list(tokens)
+
+def _is_claim(token):
+    """
+    Check if a token was generated by encode_claims().
+    """
+    return token.startswith(VERSION_PREFIX) or token.startswith(GROUP_PREFIX) or token.startswith(PERM_PREFIX)
+
+class ClaimsVersion(Document):
+    """
+    The claims version shared by every process using a database.
+    """
+    version = IntegerProperty(default=0)
+
+class Claims(object):
+    """
+    The authorization data for a single user.
+    """
+
+    def __init__(self, version, issued, groups, permissions, expires=None):
+        """
+        Constructor.
+        :param version: The version stamp the claims were issued under.
+        :param issued: The time the claims were issued as seconds since the epoch.
+        :param groups: A list of group names the user belongs to.
+        :param permissions: A dict mapping group names to lists of permission names.
+        :param expires: The earliest membership expiry as seconds since the epoch, or None if no membership expires.
+        """
+        self.version = version
+        self.issued = issued
+        self.groups = list(groups)
+        self.permissions = permissions
+        self.expires = expires
+
+def encode_claims(claims):
+    """
+    Encode claims as a list of auth_tkt tokens.
+    :param claims: The claims to encode.
+    :return: A list of token strings.
+    """
+    if claims.expires is None:
+        tokens = ['%s%i:%i' % (VERSION_PREFIX, claims.version, claims.issued)]
+    else:
+        tokens = ['%s%i:%i:%i' % (VERSION_PREFIX, claims.version, claims.issued, claims.expires)]
+    for group in claims.groups:
+        tokens.append(GROUP_PREFIX + _quote(group))
+    for group, perms in claims.permissions.iteritems():
+        for perm in perms:
+            tokens.append('%s%s:%s' % (PERM_PREFIX, _quote(group), _quote(perm)))
+    return tokens
+
+def decode_claims(tokens):
+    """
+    Decode claims from auth_tkt tokens.  Tokens not generated by encode_claims()
+    are ignored.
+    :param tokens: A list of tokens or a comma separated token string.
+    :return: The decoded claims or None if the tokens contain no valid claims.
+    """
+    version = None
+    groups = []
+    permissions = {}
+    try:
+        for token in _split_tokens(tokens):
+            if token.startswith(VERSION_PREFIX):
+                values = [ int(value) for value in token[len(VERSION_PREFIX):].split(':') ]
+                if len(values) == 2:
+                    values.append(None)
+                version, issued, expires = values
+            elif token.startswith(GROUP_PREFIX):
+                group = _unquote(token[len(GROUP_PREFIX):])
+                groups.append(group)
+                permissions.setdefault(group, [])
+            elif token.startswith(PERM_PREFIX):
+                group, perm = token[len(PERM_PREFIX):].split(':')
+                permissions.setdefault(_unquote(group), []).append(_unquote(perm))
+    except ValueError:
+        return None
+    if version is None:
+        return None
+    return Claims(version, issued, groups, permissions, expires)
+
+class ClaimsContext(object):
+    """
+    Issues and validates claims and holds the claims for the request being
+    processed by the current thread.  A single context is shared by the
+    metadata plugin, which binds claims, and the adapters, which read them.
+    """
+
+    def __init__(self, version=0, max_age=DEFAULT_MAX_AGE, db=None, db_class=None, check_interval=5,
+            doc_id=VERSION_DOC_ID):
+        """
+        Constructor.
+        :param version: The initial version stamp.  Claims issued under another version are rejected.
+        :param max_age: The maximum age of claims in seconds.  Older claims are reissued.  None disables expiry.
+        :param db: Optional database holding the version shared with other processes.
+        :param db_class: Optional document class whose database holds the shared version when db is not given.
+        :param check_interval: How often in seconds to read the shared version.
+        :param doc_id: The ID of the ClaimsVersion document holding the shared version.
+        """
+        self.version = version
+        self.max_age = max_age
+        self.db = db
+        self.db_class = db_class
+        self.check_interval = check_interval
+        self.doc_id = doc_id
+        self.lock = threading.Lock()
+        self.shared = 0
+        self.checked = None
+        self.local = threading.local()
+
+    def _shared(self):
+        """
+        Check if the version is shared with other processes.
+        """
+        return self.db is not None or self.db_class is not None
+
+    def _db(self):
+        """
+        Get the database holding the shared version.
+        """
+        return get_db(self.db_class, self.db)
+
+    def _read_shared(self):
+        """
+        Read the shared version document.
+        :return: The ClaimsVersion document, new if it does not exist yet.
+        """
+        rows = self._db().all_docs(keys=[self.doc_id], include_docs=True)
+        for row in rows:
+            if row.get('doc') is not None:
+                return ClaimsVersion.wrap(row['doc'])
+        return ClaimsVersion.wrap({'_id': self.doc_id})
+
+    def current_version(self):
+        """
+        Get the version claims must carry.  The shared version is read again
+        once the check interval has passed; if it cannot be read the last
+        value read is used.
+        :return: The version stamp.
+        """
+        if not self._shared():
+            return self.version
+        now = time.time()
+        if self.checked is None or now - self.checked >= self.check_interval:
+            with self.lock:
+                self.checked = now
+            try:
+                shared = self._read_shared().version
+            except Exception:
+                log.warning('could not read the shared claims version', exc_info=True)
+            else:
+                with self.lock:
+                    self.shared = shared
+        return self.version + self.shared
+
+    def invalidate(self):
+        """
+        Reject all previously issued claims by bumping the version.  With a
+        database the shared version is bumped so that every process rejects
+        them.
+        """
+        if not self._shared():
+            self.version += 1
+            return
+        def edit(doc):
+            doc.version += 1
+            return True
+        try:
+            saved, errors = bulk_edit(ClaimsVersion, self._db(), [self._read_shared()], edit)
+        except Exception:
+            log.error('could not bump the shared claims version', exc_info=True)
+            return
+        if errors:
+            log.error('could not bump the shared claims version: %s', errors[0].get('reason'))
+            return
+        with self.lock:
+            self.shared = saved[0].version
+            self.checked = time.time()
+
+    def is_valid(self, claims):
+        """
+        Check if claims may be trusted.
+        :param claims: The claims to check.
+        :return: True if the claims are current, False otherwise.
+        """
+        if claims.version != self.current_version():
+            return False
+        now = time.time()
+        if self.max_age is not None and claims.issued + self.max_age < now:
+            return False
+        if claims.expires is not None and claims.expires <= now:
+            return False
+        return True
+
+    def from_identity(self, identity):
+        """
+        Get valid claims from an identity dict.
+        :param identity: The identity dict.
+        :return: The claims or None if the identity carries no valid claims.
+        """
+        claims = decode_claims(identity.get('tokens'))
+        if claims is not None and self.is_valid(claims):
+            return claims
+        return None
+
+    def issue(self, identity, groups, permissions, expires=None):
+        """
+        Issue new claims and store them in the identity tokens, replacing any
+        previous claims.  Tokens from other sources are preserved.
+        :param identity: The identity dict.
+        :param groups: A list of group names the user belongs to.
+        :param permissions: A dict mapping group names to lists of permission names.
+        :param expires: The earliest membership expiry as seconds since the epoch, or None if no membership expires.
+        :return: The new claims.
+        """
+        claims = Claims(self.current_version(), int(time.time()), groups, permissions, expires)
+        tokens = [ token for token in _split_tokens(identity.get('tokens')) if not _is_claim(token) ]
+        identity['tokens'] = tokens + encode_claims(claims)
+        return claims
+
+    def bind(self, userid, claims):
+        """
+        Bind claims to the current thread.
+        :param userid: The user the claims belong to.
+        :param claims: The claims.
+        """
+        self.local.userid = userid
+        self.local.claims = claims
+
+    def release(self):
+        """
+        Remove any claims bound to the current thread.
+        """
+        self.local.userid = None
+        self.local.claims = None
+
+    def groups(self, userid):
+        """
+        Get the groups of a user from the bound claims.
+        :param userid: The user to get groups for.
+        :return: A list of group names or None if no claims are bound for the user.
+        """
+        claims = getattr(self.local, 'claims', None)
+        if claims is None or self.local.userid != userid or not self.is_valid(claims):
+            return None
+        return list(claims.groups)
+
+    def permissions(self, group):
+        """
+        Get the permissions of a group from the bound claims.
+        :param group: The group to get permissions for.
+        :return: A list of permission names or None if the bound claims do not cover the group.
+        """
+        claims = getattr(self.local, 'claims', None)
+        if claims is None or group not in claims.permissions or not self.is_valid(claims):
+            return None
+        return list(claims.permissions[group])
@@ -0,0 +1,121 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+This module provides the edge storage mode for memberships.
+
+By default a user's groups are embedded in the user document and a group's
+permissions in the group document, so every membership change rewrites a
+whole document and concurrent changes to the same user or group conflict.
+
+In edge mode each user to group link is a small Membership document and each
+group to permission link a Grant document.  Their IDs are derived from the two
+names they link, so adding a link is an insert which at worst finds the link
+already present and removing one deletes a single small document.  The views
+membership_by_user, membership_by_group, grant_by_group and
+grant_by_permission emit the linked names.
+"""
+
+import urllib
+from whatcouch.binding import bulk_write
+
+__all__ = ['membership_id', 'grant_id', 'membership_doc', 'grant_doc', 'insert_edges', 'delete_edges']
+
+MEMBERSHIP_TYPE = 'Membership'
+GRANT_TYPE = 'Grant'
+
+def _quote(name):
+    """
+    Quote a name for use in a document ID.
+    """
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    return urllib.quote(name, safe='')
+
+def membership_id(user, group):
+    """
+    Get the ID of the Membership document linking a user to a group.
+    :param user: The name of the user.
+    :param group: The name of the group.
+    :return: The document ID.
+    """
+    return 'membership:%s:%s' % (_quote(user), _quote(group))
+
+def grant_id(group, perm):
+    """
+    Get the ID of the Grant document linking a group to a permission.
+    :param group: The name of the group.
+    :param perm: The name of the permission.
+    :return: The document ID.
+    """
+    return 'grant:%s:%s' % (_quote(group), _quote(perm))
+
+def membership_doc(user, group):
+    """
+    Build a Membership document.
+    :param user: The name of the user.
+    :param group: The name of the group.
+    :return: The document as a dict.
+    """
+    return {'_id': membership_id(user, group), 'doc_type': MEMBERSHIP_TYPE, 'user': user, 'group': group}
+
+def grant_doc(group, perm):
+    """
+    Build a Grant document.
+    :param group: The name of the group.
+    :param perm: The name of the permission.
+    :return: The document as a dict.
+    """
+    return {'_id': grant_id(group, perm), 'doc_type': GRANT_TYPE, 'group': group, 'permission': perm}
+
+def insert_edges(db, docs, strict=True, errors=None):
+    """
+    Insert edge documents.  Edges which already exist are left alone.
+    :param db: The database holding the edges.
+    :param docs: The edge documents to insert.
+    :param strict: Whether to raise if an edge could not be written.  Otherwise it is left out of the result.
+    :param errors: Optional list to append the error rows of edges which could not be written to.
+    :return: The IDs of the edges which exist after the call.
+    :raise IOError: If strict and an edge could not be written for a reason other than already existing.
+    """
+    if not docs:
+        return []
+    failed = set()
+    for error in bulk_write(db, docs):
+        if error['error'] != 'conflict':
+            if strict:
+                raise IOError('failed to insert edge %s: %s' % (error.get('id'), error.get('reason')))
+            failed.add(error.get('id'))
+            if errors is not None:
+                errors.append(error)
+    return [ doc['_id'] for doc in docs if doc['_id'] not in failed ]
+
+def delete_edges(db, ids, errors=None):
+    """
+    Delete edge documents.  Edges which do not exist are ignored.
+    :param db: The database holding the edges.
+    :param ids: The IDs of the edges to delete.
+    :param errors: Optional list to append the error rows of edges which could not be deleted to.
+    :return: The IDs of the edges which were deleted.
+    """
+    if not ids:
+        return []
+    docs = []
+    for row in db.all_docs(keys=list(ids)):
+        value = row.get('value')
+        if value is not None and not value.get('deleted'):
+            docs.append({'_id': row['id'], '_rev': value['rev'], '_deleted': True})
+    if not docs:
+        return []
+    results = bulk_write(db, docs)
+    if errors is not None:
+        errors.extend(results)
+    failed = set([ result.get('id') for result in results ])
+    return [ doc['_id'] for doc in docs if doc['_id'] not in failed ]
@@ -0,0 +1,179 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+This module provides time-bounded group memberships.
+
+A membership may be given an expiry time, stored on the group embedded in the
+user document as a UTC timestamp in the sortable form 'YYYY-MM-DDTHH:MM:SSZ'.
+The expiry is a dynamic property, which couchdbkit turns into a datetime when
+the document is read, so expiries are passed through format_expiry() before
+they are compared.
+
+The adapters, the metadata plugin and the authorization index ignore
+memberships whose expiry has passed using the user data they already hold, so
+no query is needed to honour an expiry.  Claims and snapshots carry the
+earliest expiry of the memberships they were built from; claims are reissued
+and snapshot lookups for the user fall back to the database once it passes.
+
+Expired memberships are removed from the user documents by an ExpirySweeper.
+The membership_by_expiry view emits every expiry timestamp, so the sweeper
+reads only the entries which are due with one range query per batch, in
+expiry order, and removes them with one bulk request per batch.  Removal goes
+through the group adapter, which keeps its index and claims up to date.
+
+Expiry applies to memberships embedded in user documents.  It is not
+supported with edge documents.
+"""
+
+import time, calendar, logging, threading, atexit
+
+__all__ = ['ExpirySweeper', 'format_expiry', 'expiry_time', 'is_expired', 'next_expiry', 'active_groups']
+
+log = logging.getLogger(__name__)
+
+EXPIRY_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+def format_expiry(when):
+    """
+    Format an expiry time.
+    :param when: A naive UTC datetime, a number of seconds since the epoch or an expiry timestamp.
+    :return: The expiry timestamp.
+    """
+    if isinstance(when, basestring):
+        return when
+    if isinstance(when, (int, long, float)):
+        return time.strftime(EXPIRY_FORMAT, time.gmtime(when))
+    return when.strftime(EXPIRY_FORMAT)
+
+def expiry_time(expiry):
+    """
+    Convert an expiry to seconds since the epoch.
+    :param expiry: The expiry as accepted by format_expiry().
+    :return: The number of seconds since the epoch.
+    """
+    return calendar.timegm(time.strptime(format_expiry(expiry), EXPIRY_FORMAT))
+
+def now():
+    """
+    Get the current time as an expiry timestamp.
+    """
+    return format_expiry(time.time())
+
+def is_expired(expiry, current=None):
+    """
+    Check if an expiry timestamp has passed.
+    :param expiry: The expiry as accepted by format_expiry(), or None for a membership which does not expire.
+    :param current: The current timestamp.  Defaults to now.
+    :return: True if the expiry has passed, False otherwise.
+    """
+    if not expiry:
+        return False
+    return format_expiry(expiry) <= (current or now())
+
+def next_expiry(expiries, current=None):
+    """
+    Get the earliest of a number of expiries which has not passed.
+    :param expiries: The expiries as accepted by format_expiry().  None entries are ignored.
+    :param current: The current timestamp.  Defaults to now.
+    :return: The earliest expiry timestamp or None if none is pending.
+    """
+    current = current or now()
+    pending = [ format_expiry(expiry) for expiry in expiries if expiry and not is_expired(expiry, current) ]
+    if pending:
+        return min(pending)
+    return None
+
+def active_groups(groups, name_key, expiry_key, current=None):
+    """
+    Get the names of the groups embedded in a user whose membership has not expired.
+    :param groups: The groups embedded in the user document.
+    :param name_key: The group attribute holding the group name.
+    :param expiry_key: The group attribute holding the membership expiry.
+    :param current: The current timestamp.  Defaults to now.
+    :return: A list of group names.
+    """
+    current = current or now()
+    return [ getattr(group, name_key) for group in groups
+        if not is_expired(getattr(group, expiry_key, None), current) ]
+
+class ExpirySweeper(object):
+    """
+    Periodically removes expired memberships.
+    """
+
+    def __init__(self, group_adapter, interval=60, batch_size=500, start=True):
+        """
+        Constructor.  Starts the sweeper thread.
+        :param group_adapter: The GroupAdapter to remove memberships through.
+        :param interval: The number of seconds between sweeps.
+        :param batch_size: The maximum number of due entries read and removed in one batch.
+        :param start: Whether to start the sweeper thread.  Without it sweep() must be called explicitly.
+        """
+        if group_adapter.edges:
+            raise ValueError('membership expiry is not supported with edge documents')
+        self.adapter = group_adapter
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.closed = False
+        self.metrics = dict([ (name, 0) for name in ('sweeps', 'batches', 'removed') ])
+        self.stopped = threading.Event()
+        self.thread = None
+        if start:
+            self.thread = threading.Thread(target=self.run, name='whatcouch-expiry-sweeper')
+            self.thread.daemon = True
+            self.thread.start()
+            atexit.register(self.close)
+
+    def run(self):
+        """
+        Sweeper thread main loop.
+        """
+        while not self.stopped.is_set():
+            self.stopped.wait(self.interval)
+            if self.stopped.is_set():
+                break
+            try:
+                self.sweep()
+            except Exception:
+                log.exception('membership expiry sweep failed')
+
+    def sweep(self, current=None):
+        """
+        Remove every membership which has expired.
+        :param current: The current timestamp.  Defaults to now.
+        :return: The number of memberships removed.
+        """
+        current = current or now()
+        removed = 0
+        while True:
+            batch_removed, due = self.adapter._remove_expired(current, self.batch_size)
+            with self.lock:
+                self.metrics['batches'] += 1
+                self.metrics['removed'] += batch_removed
+            removed += batch_removed
+            if due < self.batch_size or batch_removed == 0:
+                break
+        with self.lock:
+            self.metrics['sweeps'] += 1
+        return removed
+
+    def close(self):
+        """
+        Stop the sweeper thread.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,124 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+This module answers which users hold a permission.
+
+The groups holding the permission are read with one query, together with
+the groups granted a covering wildcard when wildcards are enabled and the
+groups nested in them when groups are nested.  The user_names_by_group view
+emits a [group name, user name] key for every membership, whether embedded in
+a user document or stored as a Membership document, so the users of each
+group are read in user name order.  The sorted streams of all the groups are
+merged, which yields every user once, in order, holding only one page of rows
+per group in memory:
+
+    for name in iter_permission_users(group_adapter, perm_adapter, u'edit'):
+        ...
+
+page_permission_users() returns the same names a page at a time, with the
+start of the next page, for results too large to read in one go.
+
+A CouchDB view cannot join a user to the grants of the groups it belongs to,
+because a user document holds only a copy of its groups made when it joined
+them.  Grants are therefore always read from the group documents.
+"""
+
+import heapq
+from whatcouch.binding import get_db
+from whatcouch.expiry import is_expired, now
+from whatcouch.wildcard import covering_grants
+
+__all__ = ['iter_permission_users', 'page_permission_users']
+
+def _holding_groups(perm_adapter, perm):
+    """
+    Get the groups holding a permission, directly, by wildcard or by
+    inheritance.
+    :param perm_adapter: The PermissionAdapter used to read grants.
+    :param perm: The name of the permission.
+    :return: A list of group names.
+    """
+    names = covering_grants(perm) if perm_adapter.tries is not None else [perm]
+    if perm_adapter.edges:
+        rows = perm_adapter._edge_db().view(perm_adapter.grant_by_perm_view, keys=names, reduce=False)
+        groups = set([ row['value'] for row in rows ])
+    else:
+        rows = get_db(perm_adapter.Group, perm_adapter.db).view(perm_adapter.group_by_perm_view, keys=names,
+            reduce=False)
+        groups = set([ row['value'][perm_adapter.group_name_key] for row in rows ])
+    if perm_adapter.tree is not None and groups:
+        groups.update(perm_adapter.tree.descendants(groups).keys())
+    return sorted(groups)
+
+def _iter_group_users(db, view_name, group, start, page_size):
+    """
+    Stream the users of a group in name order, a page at a time.
+    :param db: The database to query.
+    :param view_name: The name of the view keyed by [group name, user name].
+    :param group: The name of the group.
+    :param start: Optional user name to start at.
+    :param page_size: The number of rows to fetch per request.
+    :return: An iterator over (user name, expiry) tuples.
+    """
+    params = {'startkey': [group, start] if start is not None else [group], 'endkey': [group, {}],
+        'limit': page_size + 1}
+    while True:
+        rows = list(db.view(view_name, **params))
+        for row in rows[:page_size]:
+            yield row['key'][1], row['value']
+        if len(rows) <= page_size:
+            return
+        params['startkey'] = rows[page_size]['key']
+        params['startkey_docid'] = rows[page_size]['id']
+
+def iter_permission_users(group_adapter, perm_adapter, perm, start=None, page_size=1000):
+    """
+    Stream the distinct names of the users holding a permission, in order.
+    Expired memberships are left out.
+    :param group_adapter: The GroupAdapter used to read memberships.
+    :param perm_adapter: The PermissionAdapter used to read grants.
+    :param perm: The name of the permission.
+    :param start: Optional user name to start at.
+    :param page_size: The number of rows fetched per request for each group.
+    :return: An iterator over user names.
+    """
+    view_name = group_adapter.t11['user_names_by_group_view']
+    if group_adapter.edges:
+        databases = [group_adapter._edge_db()]
+    elif group_adapter.user_shards is None:
+        databases = [get_db(group_adapter.User, group_adapter.db)]
+    else:
+        databases = group_adapter.user_shards.databases
+    streams = [ _iter_group_users(db, view_name, group, start, page_size)
+        for group in _holding_groups(perm_adapter, perm) for db in databases ]
+    current = now()
+    last = None
+    for name, expires in heapq.merge(*streams):
+        if name != last and not is_expired(expires, current):
+            last = name
+            yield name
+
+def page_permission_users(group_adapter, perm_adapter, perm, start=None, limit=50):
+    """
+    Get a page of the distinct names of the users holding a permission.
+    :param group_adapter: The GroupAdapter used to read memberships.
+    :param perm_adapter: The PermissionAdapter used to read grants.
+    :param perm: The name of the permission.
+    :param start: Optional name to start at, as returned for the previous page.
+    :param limit: The maximum number of names to return.
+    :return: A tuple of the list of names and the start of the next page, or None if this is the last page.
+    """
+    names = []
+    for name in iter_permission_users(group_adapter, perm_adapter, perm, start, limit + 1):
+        names.append(name)
+        if len(names) > limit:
+            return names[:limit], names[limit]
+    return names, None
@@ -0,0 +1,471 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+This module provides an in-memory authorization index.  Each group and
+permission is assigned a bit.  Users map to a bitset of their groups, groups to
+a bitset of their permissions and permissions to a bitset of the groups
+holding them.  Checking whether a user holds a permission is then a single
+bitwise AND.
+
+The index is built from CouchDB with load() and kept up to date incrementally
+by the adapters it is passed to.  Changes made to the database without going
+through those adapters are not seen until the index is loaded again.  Lookups
+for users, groups or permissions the index does not know about return None so
+that callers can fall back to querying the database.
+
+Nested groups are indexed by keeping a bitset of the ancestors of each nested
+group.  Each user also has a precomputed closure bitset holding their groups
+and all the ancestors of those groups, which is recomputed when memberships or
+nesting change.  Members of a nested group are thus members of its ancestors
+and hold their permissions, and checks remain single bitwise operations.
+
+Memberships may carry an expiry timestamp.  The earliest expiry of each user
+is kept, so checks only look at individual expiries once it has passed.
+Lookups then leave out the groups of memberships which have expired, until
+they are removed from the index.
+"""
+
+import threading
+from whatcouch.binding import get_db, view
+from whatcouch.expiry import format_expiry, is_expired
+
+__all__ = ['AuthzIndex']
+
+class BitTable(object):
+    """
+    Assigns bits to names, reusing the bits of removed names.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.bits = {}
+        self.names = []
+        self.free = []
+
+    def get(self, name):
+        """
+        Get the bit of a name.
+        :param name: The name to look up.
+        :return: The bit mask for the name or None if it has no bit.
+        """
+        bit = self.bits.get(name)
+        if bit is None:
+            return None
+        return 1 << bit
+
+    def add(self, name):
+        """
+        Assign a bit to a name if it does not have one already.
+        :param name: The name to add.
+        :return: The bit mask for the name.
+        """
+        bit = self.bits.get(name)
+        if bit is None:
+            if self.free:
+                bit = self.free.pop()
+                self.names[bit] = name
+            else:
+                bit = len(self.names)
+                self.names.append(name)
+            self.bits[name] = bit
+        return 1 << bit
+
+    def remove(self, name):
+        """
+        Release the bit of a name.
+        :param name: The name to remove.
+        :return: The bit mask the name had or 0 if it had none.
+        """
+        bit = self.bits.pop(name, None)
+        if bit is None:
+            return 0
+        self.names[bit] = None
+        self.free.append(bit)
+        return 1 << bit
+
+    def decode(self, mask):
+        """
+        Get the names of the bits set in a mask.
+        :param mask: The bit mask to decode.
+        :return: A list of names.
+        """
+        names = []
+        bit = 0
+        while mask:
+            if mask & 1:
+                names.append(self.names[bit])
+            mask >>= 1
+            bit += 1
+        return names
+
+class AuthzIndex(object):
+    """
+    Bitset index of user, group and permission relationships.
+    """
+
+    readonly = False
+
+    def __init__(self):
+        """
+        Constructor.  The index is empty and unloaded until load() is called.
+        """
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.clear()
+
+    def clear(self):
+        """
+        Empty the index.
+        """
+        with self.lock:
+            self.groups = BitTable()
+            self.perms = BitTable()
+            self.user_groups = {}
+            self.user_closure = {}
+            self.user_next_expiry = {}
+            self.group_perms = {}
+            self.perm_groups = {}
+            self.group_ancestors = {}
+            self.user_expiries = {}
+
+    def load(self, group_adapter, perm_adapter):
+        """
+        Build the index from the database.
+        :param group_adapter: The GroupAdapter used to read users and groups.
+        :param perm_adapter: The PermissionAdapter used to read permissions.
+        """
+        t11 = group_adapter.t11
+        perms = view(perm_adapter.Permission, perm_adapter.db, t11['perm_list_view'])
+        groups = view(group_adapter.Group, group_adapter.db, t11['group_list_view'])
+        if group_adapter.edges:
+            if group_adapter.user_shards is None:
+                rows = get_db(group_adapter.User, group_adapter.db).view(t11['user_names_view'])
+            else:
+                rows = group_adapter.user_shards.view_all(None, t11['user_names_view'])
+            users = [ row['key'] for row in rows ]
+            memberships = get_db(group_adapter.Group, group_adapter.db).view(t11['membership_by_user_view'])
+        else:
+            users = group_adapter._query_users(t11['user_list_view'])
+        if perm_adapter.edges:
+            grants = get_db(perm_adapter.Group, perm_adapter.db).view(t11['grant_by_group_view'])
+        with self.lock:
+            self.clear()
+            for perm in perms:
+                self.add_permission(getattr(perm, t11['perm_name_key']))
+            for group in groups:
+                name = getattr(group, t11['group_name_key'])
+                self.add_group(name)
+                ancestors = getattr(group, t11.get('group_ancestors_key', 'ancestors'), None)
+                if ancestors:
+                    self.set_ancestors(name, ancestors)
+                if not perm_adapter.edges:
+                    for perm in getattr(group, t11['group_perms_key']):
+                        self.grant(name, getattr(perm, t11['perm_name_key']))
+            if perm_adapter.edges:
+                for row in grants:
+                    self.grant(row['key'], row['value'])
+            if group_adapter.edges:
+                for name in users:
+                    self.add_user(name)
+                for row in memberships:
+                    self.add_membership(row['key'], row['value'])
+            else:
+                for user in users:
+                    name = getattr(user, t11['user_name_key'])
+                    self.add_user(name)
+                    for group in getattr(user, t11['user_groups_key']):
+                        self.add_membership(name, getattr(group, t11['group_name_key']),
+                            getattr(group, t11.get('group_expiry_key', 'expires'), None))
+            self.loaded = True
+
+    def _expand(self, mask):
+        """
+        Add the ancestors of the groups in a bitset.
+        :param mask: A bitset of groups.
+        :return: The bitset with the ancestors of its groups added.
+        """
+        if not self.group_ancestors or not mask:
+            return mask
+        expanded = mask
+        for group in self.groups.decode(mask):
+            expanded |= self.group_ancestors.get(group, 0)
+        return expanded
+
+    def _close(self, user):
+        """
+        Recompute the closure bitset and earliest expiry of a user.  Must be
+        called with the lock held.
+        :param user: The name of the user.
+        """
+        self.user_closure[user] = self._expand(self.user_groups[user])
+        expiries = self.user_expiries.get(user)
+        if expiries:
+            self.user_next_expiry[user] = min(expiries.itervalues())
+        else:
+            self.user_next_expiry.pop(user, None)
+
+    def _close_all(self, bit):
+        """
+        Recompute the closure bitsets of the users whose closure includes a
+        group.  Must be called with the lock held.
+        :param bit: The bit of the group.
+        """
+        for user, mask in self.user_closure.iteritems():
+            if mask & bit:
+                self._close(user)
+
+    def _active(self, user):
+        """
+        Get the groups of a user's memberships which have not expired, with
+        their ancestors.
+        :param user: The name of the user.
+        :return: A bitset of groups or None if the user is not indexed.
+        """
+        mask = self.user_closure.get(user)
+        next_expiry = self.user_next_expiry.get(user)
+        if mask is None or next_expiry is None or not is_expired(next_expiry):
+            return mask
+        mask = self.user_groups[user]
+        for group, expires in self.user_expiries[user].items():
+            if is_expired(expires):
+                mask &= ~(self.groups.get(group) or 0)
+        return self._expand(mask)
+
+    def _perms(self, groups):
+        """
+        Get the permissions held by a bitset of groups.
+        :param groups: A bitset of groups.
+        :return: A bitset of permissions.
+        """
+        mask = 0
+        for group in self.groups.decode(groups):
+            mask |= self.group_perms.get(group, 0)
+        return mask
+
+    def groups_of(self, user):
+        """
+        Get the groups a user belongs to, including the ancestors of nested groups.
+        :param user: The name of the user.
+        :return: A list of group names or None if the user is not indexed.
+        """
+        mask = self._active(user)
+        if mask is None:
+            return None
+        return self.groups.decode(mask)
+
+    def permissions_of(self, group):
+        """
+        Get the permissions held by a group, including inherited permissions.
+        :param group: The name of the group.
+        :return: A list of permission names or None if the group is not indexed.
+        """
+        mask = self.group_perms.get(group)
+        if mask is None:
+            return None
+        if group in self.group_ancestors:
+            mask = self._perms(self._expand(self.groups.get(group)))
+        return self.perms.decode(mask)
+
+    def groups_with(self, perm):
+        """
+        Get the groups holding a permission.
+        :param perm: The name of the permission.
+        :return: A list of group names or None if the permission is not indexed.
+        """
+        mask = self.perm_groups.get(perm)
+        if mask is None:
+            return None
+        return self.groups.decode(mask)
+
+    def is_member(self, user, group):
+        """
+        Check if a user belongs to a group.
+        :param user: The name of the user.
+        :param group: The name of the group.
+        :return: True or False, or None if the user is not indexed.
+        """
+        mask = self._active(user)
+        if mask is None:
+            return None
+        bit = self.groups.get(group)
+        return bit is not None and mask & bit != 0
+
+    def is_granted(self, group, perm):
+        """
+        Check if a group holds a permission.
+        :param group: The name of the group.
+        :param perm: The name of the permission.
+        :return: True or False, or None if the group is not indexed.
+        """
+        if group not in self.group_perms:
+            return None
+        closure = self.groups.get(group) | self.group_ancestors.get(group, 0)
+        return closure & self.perm_groups.get(perm, 0) != 0
+
+    def has_permission(self, user, perm):
+        """
+        Check if a user holds a permission through any of their groups.
+        :param user: The name of the user.
+        :param perm: The name of the permission.
+        :return: True or False, or None if the user is not indexed.
+        """
+        mask = self._active(user)
+        if mask is None:
+            return None
+        return mask & self.perm_groups.get(perm, 0) != 0
+
+    def add_user(self, user):
+        """
+        Add a user with no groups.  Existing users are left unchanged.
+        :param user: The name of the user.
+        """
+        with self.lock:
+            self.user_groups.setdefault(user, 0)
+            self.user_closure.setdefault(user, 0)
+
+    def remove_user(self, user):
+        """
+        Remove a user.
+        :param user: The name of the user.
+        """
+        with self.lock:
+            self.user_groups.pop(user, None)
+            self.user_closure.pop(user, None)
+            self.user_expiries.pop(user, None)
+            self.user_next_expiry.pop(user, None)
+
+    def add_group(self, group):
+        """
+        Add a group with no permissions.
+        :param group: The name of the group.
+        """
+        with self.lock:
+            self.groups.add(group)
+            self.group_perms.setdefault(group, 0)
+
+    def remove_group(self, group):
+        """
+        Remove a group, its memberships and its permissions.
+        :param group: The name of the group.
+        """
+        with self.lock:
+            bit = self.groups.remove(group)
+            self.group_perms.pop(group, None)
+            self.group_ancestors.pop(group, None)
+            if bit:
+                for user, mask in self.user_groups.iteritems():
+                    self.user_groups[user] = mask & ~bit
+                for perm, mask in self.perm_groups.iteritems():
+                    self.perm_groups[perm] = mask & ~bit
+                for name, mask in self.group_ancestors.iteritems():
+                    self.group_ancestors[name] = mask & ~bit
+                for expiries in self.user_expiries.itervalues():
+                    expiries.pop(group, None)
+                for user, mask in self.user_closure.items():
+                    if mask & bit:
+                        self._close(user)
+
+    def add_permission(self, perm):
+        """
+        Add a permission held by no groups.
+        :param perm: The name of the permission.
+        """
+        with self.lock:
+            self.perms.add(perm)
+            self.perm_groups.setdefault(perm, 0)
+
+    def remove_permission(self, perm):
+        """
+        Remove a permission from the index and from every group.
+        :param perm: The name of the permission.
+        """
+        with self.lock:
+            bit = self.perms.remove(perm)
+            self.perm_groups.pop(perm, None)
+            if bit:
+                for group, mask in self.group_perms.iteritems():
+                    self.group_perms[group] = mask & ~bit
+
+    def add_membership(self, user, group, expires=None):
+        """
+        Add a user to a group, or change the expiry of an existing membership.
+        :param user: The name of the user.
+        :param group: The name of the group.
+        :param expires: The expiry timestamp or None for a membership which does not expire.
+        """
+        with self.lock:
+            self.add_group(group)
+            self.user_groups[user] = self.user_groups.get(user, 0) | self.groups.get(group)
+            if expires is not None:
+                self.user_expiries.setdefault(user, {})[group] = format_expiry(expires)
+            elif user in self.user_expiries:
+                self.user_expiries[user].pop(group, None)
+            self._close(user)
+
+    def remove_membership(self, user, group):
+        """
+        Remove a user from a group.
+        :param user: The name of the user.
+        :param group: The name of the group.
+        """
+        with self.lock:
+            bit = self.groups.get(group)
+            if bit is not None and user in self.user_groups:
+                self.user_groups[user] &= ~bit
+            if user in self.user_expiries:
+                self.user_expiries[user].pop(group, None)
+            if user in self.user_groups:
+                self._close(user)
+
+    def grant(self, group, perm):
+        """
+        Give a permission to a group.
+        :param group: The name of the group.
+        :param perm: The name of the permission.
+        """
+        with self.lock:
+            self.add_group(group)
+            self.add_permission(perm)
+            self.group_perms[group] |= self.perms.get(perm)
+            self.perm_groups[perm] |= self.groups.get(group)
+
+    def revoke(self, group, perm):
+        """
+        Take a permission away from a group.
+        :param group: The name of the group.
+        :param perm: The name of the permission.
+        """
+        with self.lock:
+            group_bit = self.groups.get(group)
+            perm_bit = self.perms.get(perm)
+            if group_bit is not None and perm_bit is not None:
+                self.group_perms[group] &= ~perm_bit
+                self.perm_groups[perm] &= ~group_bit
+
+    def set_ancestors(self, group, ancestors):
+        """
+        Set the ancestors of a nested group.
+        :param group: The name of the group.
+        :param ancestors: The names of all the groups it is nested in at any depth.
+        """
+        with self.lock:
+            self.add_group(group)
+            mask = 0
+            for ancestor in ancestors:
+                self.add_group(ancestor)
+                mask |= self.groups.get(ancestor)
+            if mask:
+                self.group_ancestors[group] = mask
+            else:
+                self.group_ancestors.pop(group, None)
+            self._close_all(self.groups.get(group))
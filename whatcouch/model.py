@@ -9,33 +9,382 @@
 # including, but not limited to, the implied warranties of merchantability and
 # fitness for a particular purpose are disclaimed.
 
-from couchdbkit import Document, StringProperty, SchemaListProperty
+import os, time, hmac, base64, hashlib
+from abc import ABCMeta, abstractmethod
+from couchdbkit import Document, StringProperty, StringListProperty, SchemaListProperty, DateTimeProperty, \
+    IntegerProperty
 import bcrypt
 
-__all__ = ['Permission', 'Group', 'User', 'init_model']
+try:
+    import scrypt as _scrypt
+except ImportError:
+    _scrypt = None
 
-def hashpw(password, salt=None):
+__all__ = ['Permission', 'Group', 'User', 'init_model', 'set_work_factor', 'calibrate',
+    'HashScheme', 'register_scheme', 'set_default_scheme', 'benchmark']
+
+def _bytes(value):
+    """
+    Encode a password or salt for hashing.
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+def _b64encode(data):
+    """
+    Encode bytes as unpadded base64 using '.' in place of '+', as used in
+    modular crypt format hashes.
+    """
+    return base64.b64encode(data).rstrip('=').replace('+', '.')
+
+def _b64decode(data):
+    """
+    Decode bytes encoded by _b64encode().
+    """
+    data = str(data).replace('.', '+')
+    return base64.b64decode(data + '=' * (-len(data) % 4))
+
+class HashScheme(object):
+    """
+    Abstract base class of the password hashing schemes.  It is not
+    instantiated itself; subclasses implement hash(), verify() and
+    get_rounds().  A scheme recognises its own hashes by prefix.  The cost of
+    new hashes is stored in rounds; None uses the scheme default.
     """
-    Hash a password using the optional salt.  If salt is not specified one
-    will be generated.  The hash, which includes the salt, is returned.
+    __metaclass__ = ABCMeta
+
+    name = None
+    prefixes = ()
+    default_rounds = None
+    min_rounds = None
+    max_rounds = None
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.rounds = None
+
+    def identify(self, hash):
+        """
+        Check if a hash was generated by this scheme.
+        :param hash: The stored hash.
+        :return: True if the hash belongs to this scheme, False otherwise.
+        """
+        return hash.startswith(self.prefixes)
+
+    def next_rounds(self, rounds):
+        """
+        Get the next higher cost to consider when calibrating.
+        :param rounds: The current cost.
+        :return: The next cost, roughly doubling the time taken.
+        """
+        return rounds + 1
+
+    @abstractmethod
+    def hash(self, password, rounds=None):
+        """
+        Hash a password with a new salt.
+        :param password: The password to hash.
+        :param rounds: The cost to use.  Defaults to the configured cost.
+        :return: The hash, including the scheme, cost and salt.
+        """
+
+    @abstractmethod
+    def verify(self, hash, password):
+        """
+        Check a password against a hash generated by this scheme.
+        :param hash: The stored hash.
+        :param password: The plaintext password.
+        :return: True if the password matches, False otherwise.
+        """
+
+    @abstractmethod
+    def get_rounds(self, hash):
+        """
+        Get the cost a hash was generated with.
+        :param hash: The stored hash.
+        :return: The cost or None if it cannot be determined.
+        """
+
+class BcryptScheme(HashScheme):
+    """
+    bcrypt hashes.  The cost is the base two logarithm of the number of rounds.
+    """
+
+    name = 'bcrypt'
+    prefixes = ('$2a$', '$2b$', '$2y$', '$2$')
+    default_rounds = 12
+    min_rounds = 4
+    max_rounds = 16
+
+    def hash(self, password, rounds=None, salt=None):
+        if salt is None:
+            rounds = rounds or self.rounds
+            salt = bcrypt.gensalt(rounds) if rounds is not None else bcrypt.gensalt()
+        return unicode(bcrypt.hashpw(password, salt))
+
+    def verify(self, hash, password):
+        salt = hash[:29]
+        return hmac.compare_digest(str(hash), str(self.hash(password, salt=salt)))
+
+    def get_rounds(self, hash):
+        try:
+            return int(hash.split('$')[2])
+        except (AttributeError, IndexError, ValueError):
+            return None
+
+class PBKDF2Scheme(HashScheme):
+    """
+    PBKDF2-HMAC-SHA256 hashes in the form $pbkdf2-sha256$rounds$salt$checksum.
+    The cost is the number of iterations.
+    """
+
+    name = 'pbkdf2-sha256'
+    prefixes = ('$pbkdf2-sha256$',)
+    default_rounds = 100000
+    min_rounds = 1000
+    max_rounds = 10000000
+
+    def next_rounds(self, rounds):
+        return rounds * 2
+
+    def _derive(self, password, salt, rounds):
+        return hashlib.pbkdf2_hmac('sha256', _bytes(password), salt, rounds)
+
+    def hash(self, password, rounds=None):
+        rounds = rounds or self.rounds or self.default_rounds
+        salt = os.urandom(16)
+        return u'$%s$%i$%s$%s' % (self.name, rounds, _b64encode(salt),
+            _b64encode(self._derive(password, salt, rounds)))
+
+    def verify(self, hash, password):
+        try:
+            rounds, salt, checksum = hash.split('$')[2:5]
+            rounds, salt, checksum = int(rounds), _b64decode(salt), _b64decode(checksum)
+        except (TypeError, ValueError):
+            return False
+        return hmac.compare_digest(checksum, self._derive(password, salt, rounds))
+
+    def get_rounds(self, hash):
+        try:
+            return int(hash.split('$')[2])
+        except (AttributeError, IndexError, ValueError):
+            return None
+
+class ScryptScheme(HashScheme):
+    """
+    scrypt hashes in the form $scrypt$ln=cost,r=8,p=1$salt$checksum.  The cost
+    is the base two logarithm of the CPU/memory cost N.  Available when
+    hashlib.scrypt or the scrypt package is.
+    """
+
+    name = 'scrypt'
+    prefixes = ('$scrypt$',)
+    default_rounds = 15
+    min_rounds = 10
+    max_rounds = 20
+    block_size = 8
+    parallelism = 1
+
+    def _derive(self, password, salt, rounds, r, p):
+        n = 1 << rounds
+        if hasattr(hashlib, 'scrypt'):
+            return hashlib.scrypt(_bytes(password), salt=salt, n=n, r=r, p=p,
+                maxmem=128 * r * (n + p + 2) + 1024 * 1024, dklen=32)
+        return _scrypt.hash(_bytes(password), salt, N=n, r=r, p=p, buflen=32)
+
+    def hash(self, password, rounds=None):
+        rounds = rounds or self.rounds or self.default_rounds
+        r, p = self.block_size, self.parallelism
+        salt = os.urandom(16)
+        return u'$scrypt$ln=%i,r=%i,p=%i$%s$%s' % (rounds, r, p, _b64encode(salt),
+            _b64encode(self._derive(password, salt, rounds, r, p)))
+
+    def _params(self, hash):
+        return dict([ (k, int(v)) for k, v in [ param.split('=') for param in hash.split('$')[2].split(',') ] ])
+
+    def verify(self, hash, password):
+        try:
+            params = self._params(hash)
+            salt, checksum = hash.split('$')[3:5]
+            salt, checksum = _b64decode(salt), _b64decode(checksum)
+            derived = self._derive(password, salt, params['ln'], params['r'], params['p'])
+        except (KeyError, TypeError, ValueError):
+            return False
+        return hmac.compare_digest(checksum, derived)
+
+    def get_rounds(self, hash):
+        try:
+            return self._params(hash)['ln']
+        except (AttributeError, IndexError, KeyError, ValueError):
+            return None
+
+"""The registered hashing schemes by name."""
+schemes = {}
+
+"""The name of the scheme used for new hashes."""
+default_scheme = 'bcrypt'
+
+def register_scheme(scheme):
+    """
+    Register a hashing scheme.  Hashes are matched against registered schemes
+    by prefix when verifying passwords.
+    :param scheme: A HashScheme instance.
+    """
+    schemes[scheme.name] = scheme
+
+register_scheme(BcryptScheme())
+register_scheme(PBKDF2Scheme())
+if hasattr(hashlib, 'scrypt') or _scrypt is not None:
+    register_scheme(ScryptScheme())
+
+def get_scheme(name=None):
+    """
+    Get a registered scheme by name.
+    :param name: The name of the scheme.  Defaults to the default scheme.
+    :return: The scheme.
+    :raise KeyError: If no such scheme is registered.
+    """
+    return schemes[name or default_scheme]
+
+def set_default_scheme(name):
+    """
+    Set the scheme used for new hashes.  Existing hashes of other schemes are
+    still verified and are upgraded when their users log in if the
+    authenticator is configured to do so.
+    :param name: The name of a registered scheme.
+    """
+    global default_scheme
+    get_scheme(name)
+    default_scheme = name
+
+def identify(hash):
+    """
+    Find the scheme which generated a hash.
+    :param hash: The stored hash.
+    :return: The scheme or None if no registered scheme recognises the hash.
+    """
+    if not hash:
+        return None
+    for scheme in schemes.itervalues():
+        if scheme.identify(hash):
+            return scheme
+    return None
+
+def set_work_factor(rounds, scheme=None):
+    """
+    Set the cost used when generating new hashes.  Existing hashes with
+    a different cost are upgraded when their users log in if the
+    authenticator is configured to do so.
+    :param rounds: The cost, or None for the scheme default.
+    :param scheme: The name of the scheme.  Defaults to the default scheme.
+    """
+    get_scheme(scheme).rounds = rounds
+
+def calibrate(target=0.25, minimum=None, maximum=None, scheme=None):
+    """
+    Find the highest cost which hashes a password within the target time on
+    this machine.  Each step of the cost roughly doubles the time taken.
+    :param target: The maximum time in seconds a hash should take.
+    :param minimum: The lowest cost to consider.  Defaults to the scheme minimum.
+    :param maximum: The highest cost to consider.  Defaults to the scheme maximum.
+    :param scheme: The name of the scheme.  Defaults to the default scheme.
+    :return: The chosen cost.
+    """
+    scheme = get_scheme(scheme)
+    rounds = minimum or scheme.min_rounds
+    maximum = maximum or scheme.max_rounds
+    while rounds < maximum:
+        next_rounds = min(scheme.next_rounds(rounds), maximum)
+        start = time.time()
+        scheme.hash('calibration', next_rounds)
+        if time.time() - start > target:
+            break
+        rounds = next_rounds
+    return rounds
+
+def benchmark(names=None, rounds=None, duration=1.0):
+    """
+    Measure password verifications per second on this machine.
+    :param names: The names of the schemes to measure.  Defaults to all registered schemes.
+    :param rounds: A list of costs to measure.  Defaults to the configured cost of each scheme.
+    :param duration: The minimum number of seconds to spend on each measurement.
+    :return: A list of (scheme name, cost, verifications per second) tuples.
+    """
+    results = []
+    for name in names or sorted(schemes):
+        scheme = get_scheme(name)
+        for cost in rounds or [scheme.rounds or scheme.default_rounds]:
+            hash = scheme.hash('benchmark', cost)
+            count = 0
+            start = time.time()
+            while True:
+                scheme.verify(hash, 'benchmark')
+                count += 1
+                elapsed = time.time() - start
+                if elapsed >= duration:
+                    break
+            results.append((name, cost, count / elapsed))
+    return results
+
+def get_rounds(hash):
+    """
+    Get the cost a hash was generated with.
+    :param hash: A password hash generated by hashpw().
+    :return: The cost or None if it cannot be determined.
+    """
+    scheme = identify(hash)
+    if scheme is None:
+        return None
+    return scheme.get_rounds(hash)
+
+def needs_rehash(hash, scheme=None, rounds=None):
+    """
+    Check if a hash was generated by a scheme other than the wanted scheme, or
+    with a cost other than the wanted cost.
+    :param hash: A password hash generated by hashpw().
+    :param scheme: The name of the wanted scheme.  Defaults to the default scheme.
+    :param rounds: The wanted cost.  Defaults to the work factor of the scheme.
+    :return: True if the hash should be regenerated, False otherwise.
+    """
+    wanted = get_scheme(scheme)
+    if identify(hash) is not wanted:
+        return True
+    if rounds is None:
+        rounds = wanted.rounds
+    if rounds is None:
+        return False
+    return wanted.get_rounds(hash) != rounds
+
+def hashpw(password, salt=None, scheme=None, rounds=None):
+    """
+    Hash a password.  A bcrypt salt may be given, otherwise a new salt is
+    generated using the given cost or the work factor of the scheme.  The
+    hash, which includes the scheme, cost and salt, is returned.
     :param password: The password to hash.
-    :param salt: The optional salt to use.
+    :param salt: The optional bcrypt salt to use.
+    :param scheme: The name of the scheme.  Defaults to the default scheme.
+    :param rounds: The cost.  Defaults to the work factor of the scheme.
     :return: The hashed password.
     """
-    if salt is None:
-        salt = bcrypt.gensalt()
-    return unicode(bcrypt.hashpw(password, salt))
+    if salt is not None:
+        return schemes['bcrypt'].hash(password, salt=salt)
+    return get_scheme(scheme).hash(password, rounds)
 
 def hashcmp(hash, password):
     """
-    Compare a hash to an un-hashed password.  Returns True if they match
-    or false otherwise.
+    Compare a hash to an un-hashed password.  The scheme is detected from the
+    hash.  Returns True if they match or false otherwise.
     :param hash A password hash generated by hashpw().
     :param password An unhashed password to compare against.
     :return: True if the password matches the hash, False if it does not.
     """
-    salt = hash[:29]
-    return hash == hashpw(password, salt)
+    scheme = identify(hash)
+    if scheme is None:
+        return False
+    return scheme.verify(hash, password)
 
 class Permission(Document):
     """
@@ -46,9 +395,15 @@ class Permission(Document):
 class Group(Document):
     """
     Group document.  Groups are assigned to users in a many-to-many relationship.
+    Groups may be nested in parent groups, whose members they are included in
+    and whose permissions they inherit.  The ancestors and inherited
+    permissions are precomputed by the adapters; see whatcouch.nesting.
     """
     name = StringProperty(required=True)
     permissions = SchemaListProperty(Permission)
+    parents = StringListProperty()
+    ancestors = StringListProperty()
+    inherited_permissions = SchemaListProperty(Permission)
 
 class User(Document):
     """
@@ -56,18 +411,23 @@ class User(Document):
     """
     username = StringProperty(required=True)
     password = StringProperty()
+    email = StringProperty()
     groups = SchemaListProperty(Group)
+    last_login = DateTimeProperty()
+    login_count = IntegerProperty(default=0)
 
     @staticmethod
-    def create(username, password, groups=[]):
+    def create(username, password, groups=[], scheme=None, rounds=None):
         """
         Convenience method for creating a new user.
         :param username: The username of the new user.
         :param password: The password of the new user.
         :param groups: The groups to assign to the new user.
+        :param scheme: The name of the hashing scheme.  Defaults to the default scheme.
+        :param rounds: The hashing cost.  Defaults to the work factor of the scheme.
         :return: The new user document.
         """
-        hash = hashpw(password)
+        hash = hashpw(password, scheme=scheme, rounds=rounds)
         return User(username=username, password=hash, groups=groups)
 
     def authenticate(self, password):
@@ -78,12 +438,35 @@ class User(Document):
         """
         return hashcmp(self.password, password)
 
-    def set_password(self, password):
+    def set_password(self, password, scheme=None, rounds=None):
         """
         Set the password.  Hashed the password before setting.
         :param password: The password to set in plaintext.
+        :param scheme: The name of the hashing scheme.  Defaults to the default scheme.
+        :param rounds: The hashing cost.  Defaults to the work factor of the scheme.
+        """
+        self.password = hashpw(password, scheme=scheme, rounds=rounds)
+
+    def needs_rehash(self, scheme=None, rounds=None):
+        """
+        Check if the password hash should be regenerated with the given scheme and cost.
+        :param scheme: The name of the wanted scheme.  Defaults to the default scheme.
+        :param rounds: The wanted cost.  Defaults to the work factor of the scheme.
+        :return: True if the hash is outdated, False otherwise.
+        """
+        return self.password is not None and needs_rehash(self.password, scheme, rounds)
+
+    def record_login(self, when, count=1):
+        """
+        Record logins.
+        :param when: The datetime of the latest login.
+        :param count: The number of logins to add to the login count.
+        :return: True if the document changed, False otherwise.
         """
-        self.password = hashpw(password)
+        if self.last_login is None or when > self.last_login:
+            self.last_login = when
+        self.login_count = (self.login_count or 0) + count
+        return count > 0
 
 def init_model(database):
     """
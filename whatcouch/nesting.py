@@ -0,0 +1,200 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+This module provides nested groups.
+
+A group may be nested in any number of parent groups.  Members of a group are
+members of all of its ancestors and the group inherits the permissions of its
+ancestors.  Rather than walking the hierarchy when checking authorization,
+every group document stores the precomputed names of all its ancestors and
+copies of the permissions it inherits.  The group_ancestors view then expands
+a user's groups with a single multi-key query and the permission_by_group view
+emits inherited permissions alongside direct ones, so checks cost the same
+however deep the hierarchy is.
+
+The stored closure is updated incrementally.  When the parents or permissions
+of some groups change only those groups and the groups nested in them, found
+with one query of the group_by_ancestor view, are recomputed, and the changed
+documents are saved with one bulk request.  Nesting a group in itself or in
+one of its descendants is rejected.
+
+Inherited permissions are copied from embedded permissions only.  When grants
+are stored as edge documents the permissions of a group's ancestors are read
+from the grant views instead; see edges.py.
+"""
+
+import logging
+from whatcouch.binding import get_db, view, bulk_edit
+from whatcouch.translations import merge_translations
+
+__all__ = ['GroupTree']
+
+log = logging.getLogger(__name__)
+
+class GroupTree(object):
+    """
+    Reads and maintains the group hierarchy.
+    """
+
+    def __init__(self, translations, db=None, retries=3, backoff=0.05, count=None):
+        """
+        Constructor.
+        :param translations: The translations used to map group documents.  Missing keys are taken from the defaults.
+        :param db: Optional database to use instead of the database set on the group class.
+        :param retries: The number of times groups whose save conflicts are fetched and changed again.
+        :param backoff: The delay in seconds before the first retry of a conflicting save.
+        :param count: Optional callable taking a metric name and an amount, passed to bulk_edit().
+        """
+        translations = merge_translations(translations)
+        self.db = db
+        self.retries = retries
+        self.backoff = backoff
+        self.count = count
+        self.Group = translations['group_class']
+        self.name_key = translations['group_name_key']
+        self.perms_key = translations['group_perms_key']
+        self.parents_key = translations['group_parents_key']
+        self.ancestors_key = translations['group_ancestors_key']
+        self.inherited_key = translations['group_inherited_key']
+        self.perm_name_key = translations['perm_name_key']
+        self.group_list_view = translations['group_list_view']
+        self.ancestors_view = translations['group_ancestors_view']
+        self.by_ancestor_view = translations['group_by_ancestor_view']
+
+    def get_groups(self, names):
+        """
+        Get several groups with a single query.
+        :param names: The names of the groups.
+        :return: A dict mapping the names of the groups found to their documents.
+        """
+        if not names:
+            return {}
+        groups = view(self.Group, self.db, self.group_list_view, keys=list(names))
+        return dict([ (getattr(group, self.name_key), group) for group in groups ])
+
+    def descendants(self, names):
+        """
+        Get the groups nested in any of several groups at any depth with a
+        single query.
+        :param names: The names of the groups.
+        :return: A dict mapping the names of the nested groups to their documents.
+        """
+        if not names:
+            return {}
+        groups = view(self.Group, self.db, self.by_ancestor_view, keys=list(names))
+        return dict([ (getattr(group, self.name_key), group) for group in groups ])
+
+    def expand(self, names):
+        """
+        Add the ancestors of several groups to their names with a single query.
+        :param names: The names of the groups.
+        :return: A list of the names followed by the names of their ancestors.
+        """
+        expanded = list(names)
+        if expanded:
+            seen = set(expanded)
+            for row in get_db(self.Group, self.db).view(self.ancestors_view, keys=expanded):
+                for name in row['value']:
+                    if name not in seen:
+                        seen.add(name)
+                        expanded.append(name)
+        return expanded
+
+    def update(self, roots, parents=None, deleted=()):
+        """
+        Recompute the ancestors and inherited permissions of groups and of
+        every group nested in them, optionally changing their parents first.
+        :param roots: The names of the groups whose parents or permissions changed.
+        :param parents: Optional dict mapping group names to their new lists of parent names.
+        :param deleted: The names of deleted groups, which are removed from the parents of the groups nested in them.
+        :return: A dict mapping the names of the groups which changed to their lists of ancestor names.
+        :raise ValueError: If the change would nest a group in itself.
+        """
+        parents = parents or {}
+        deleted = set(deleted)
+        groups = self.get_groups([ name for name in roots if name not in deleted ])
+        groups.update(self.descendants(roots))
+        for name in deleted:
+            groups.pop(name, None)
+        if not groups:
+            return {}
+        parents_of = {}
+        for name, group in groups.iteritems():
+            names = parents.get(name, getattr(group, self.parents_key))
+            parents_of[name] = [ parent for parent in names if parent not in deleted ]
+
+        outside = self.get_groups(set([ parent for names in parents_of.itervalues() for parent in names
+            if parent not in groups ]))
+        missing = set([ name for group in outside.itervalues() for name in getattr(group, self.ancestors_key)
+            if name not in groups and name not in outside and name not in deleted ])
+        outside.update(self.get_groups(missing))
+
+        ancestors = {}
+        def resolve(name, path):
+            if name in ancestors:
+                return ancestors[name]
+            if name in path:
+                raise ValueError('group %s cannot be nested in itself' % name)
+            path = path | set([name])
+            result = []
+            for parent in parents_of[name]:
+                if parent in groups:
+                    above = [parent] + resolve(parent, path)
+                elif parent in outside:
+                    above = [parent] + [ ancestor for ancestor in getattr(outside[parent], self.ancestors_key)
+                        if ancestor not in deleted ]
+                else:
+                    continue
+                for ancestor in above:
+                    if ancestor == name:
+                        raise ValueError('group %s cannot be nested in itself' % name)
+                    if ancestor not in result:
+                        result.append(ancestor)
+            ancestors[name] = result
+            return result
+        for name in groups:
+            resolve(name, set())
+
+        inherited = {}
+        for name, group in groups.iteritems():
+            seen = set([ getattr(perm, self.perm_name_key) for perm in getattr(group, self.perms_key) ])
+            inherited[name] = []
+            for ancestor in ancestors[name]:
+                source = groups.get(ancestor) or outside.get(ancestor)
+                if source is None:
+                    continue
+                for perm in getattr(source, self.perms_key):
+                    if getattr(perm, self.perm_name_key) not in seen:
+                        seen.add(getattr(perm, self.perm_name_key))
+                        inherited[name].append(perm)
+
+        def edit(group):
+            name = getattr(group, self.name_key)
+            if name not in ancestors:
+                return False
+            changed = False
+            if list(getattr(group, self.parents_key)) != parents_of[name]:
+                setattr(group, self.parents_key, parents_of[name])
+                changed = True
+            if list(getattr(group, self.ancestors_key)) != ancestors[name]:
+                setattr(group, self.ancestors_key, ancestors[name])
+                changed = True
+            current = [ getattr(perm, self.perm_name_key) for perm in getattr(group, self.inherited_key) ]
+            if current != [ getattr(perm, self.perm_name_key) for perm in inherited[name] ]:
+                setattr(group, self.inherited_key, inherited[name])
+                changed = True
+            return changed
+        saved, errors = bulk_edit(self.Group, get_db(self.Group, self.db), groups.values(), edit, self.retries,
+            self.backoff, self.count)
+        for error in errors:
+            log.warning('failed to save group %s: %s', error.get('id'), error.get('error'))
+        return dict([ (getattr(group, self.name_key), ancestors[getattr(group, self.name_key)])
+            for group in saved ])
@@ -11,12 +11,114 @@
 """
 This module contains repoze.who authenticator and metadata plugins.
 See the repoze.who documentation at <> for additional details.
+
+With normalize_logins the authenticator accepts a login in any letter case
+and alternate login keys such as an email address.  The login is normalised
+and resolved with a single query of a view emitting the normalised user names
+and alternate keys of every user.  An exact user name match is preferred,
+then a case-insensitive user name match, then the alternate keys in their
+configured order.  A login matching several users at the same rank is
+rejected.
 """
 
+from datetime import datetime
 from zope.interface import implements
 from repoze.who.interfaces import IAuthenticator, IMetadataProvider
+from whatcouch.breaker import CircuitOpenError, CallTimeoutError, guarded_read, guarded_call
+from whatcouch.binding import get_db, view
+from whatcouch.nesting import GroupTree
+from whatcouch.expiry import active_groups, next_expiry, expiry_time
+from whatcouch.translations import merge_translations
+
+__all__ = ['AuthenticatorPlugin', 'MetadataPlugin', 'LazyUser', 'normalize_login']
+
+"""The WSGI environ key of a dict holding the user documents loaded during the request."""
+ENVIRON_USERS_KEY = 'whatcouch.users'
+
+def normalize_login(login):
+    """
+    Normalise a login for case-insensitive lookups, as done by the login view.
+    :param login: The login.
+    :return: The login stripped of surrounding whitespace and lower-cased.
+    """
+    return login.strip().lower()
+
+def get_request_user(environ, loader, name):
+    """
+    Get a user by name, reusing a document already loaded for this request.
+    :param environ: WSGI environment.
+    :param loader: A callable which takes a user name and returns the user document or None.
+    :param name: The name of the user to get.
+    :return: The user document with the given name or None if not found.
+    """
+    users = environ.setdefault(ENVIRON_USERS_KEY, {})
+    if name not in users:
+        users[name] = loader(name)
+    return users[name]
+
+class LazyUser(object):
+    """
+    Proxy for a user document which is only loaded from CouchDB when one of
+    its attributes is first accessed.  The loaded document is stored in the
+    WSGI environ so that it is shared by everything handling the request.
+    A proxy for a user which does not exist evaluates to False.
+    """
+
+    def __init__(self, loader, name, environ):
+        """
+        Constructor.
+        :param loader: A callable which takes a user name and returns the user document or None.
+        :param name: The name of the user.
+        :param environ: WSGI environment.
+        """
+        object.__setattr__(self, '_lazy_loader', loader)
+        object.__setattr__(self, '_lazy_name', name)
+        object.__setattr__(self, '_lazy_environ', environ)
+
+    def _lazy_get(self):
+        """
+        Get the proxied document, loading it if necessary.
+        :return: The user document or None if the user does not exist.
+        """
+        return get_request_user(self._lazy_environ, self._lazy_loader, self._lazy_name)
+
+    def _lazy_require(self):
+        """
+        Get the proxied document, raising an AttributeError if it does not exist.
+        """
+        user = self._lazy_get()
+        if user is None:
+            raise AttributeError('user %r does not exist' % self._lazy_name)
+        return user
+
+    def __getattr__(self, name):
+        return getattr(self._lazy_require(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._lazy_require(), name, value)
+
+    def __getitem__(self, key):
+        return self._lazy_require()[key]
+
+    def __setitem__(self, key, value):
+        self._lazy_require()[key] = value
+
+    def __contains__(self, key):
+        return key in self._lazy_require()
+
+    def __nonzero__(self):
+        return self._lazy_get() is not None
+
+    def __eq__(self, other):
+        if isinstance(other, LazyUser):
+            other = other._lazy_get()
+        return self._lazy_get() == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
-__all__ = ['AuthenticatorPlugin', 'MetadataPlugin']
+    def __repr__(self):
+        return '<LazyUser %r>' % self._lazy_name
 
 class AuthenticatorPlugin:
     """
@@ -24,52 +126,333 @@ class AuthenticatorPlugin:
     """
     implements(IAuthenticator)
 
-    def __init__(self, translations):
+    def __init__(self, translations, user_shards=None, breaker=None, write_behind=None, throttle=None, audit=None,
+            db=None, normalize_logins=False, password_scheme=None, password_rounds=None):
         """
-        Constructor.  Configures the plugin with the given translations dict.
+        Constructor.  Configures the plugin with a copy of the given translations dict, with missing keys
+        taken from the default translations.
         :param translations: The translations to use when mapping requests against a model.
+        :param user_shards: Optional UserShards to partition user documents across.
+        :param breaker: Optional CircuitBreaker to run database calls through.
+        :param write_behind: Optional WriteBehindQueue used to record logins and upgrade outdated password hashes.
+        :param throttle: Optional LoginThrottle used to reject logins after too many failures.
+        :param audit: Optional AuditLog to record login attempts in.
+        :param db: Optional database to use instead of the databases set on the document classes.
+        :param normalize_logins: Whether logins are matched case-insensitively against user names and alternate login keys.
+        :param password_scheme: The hashing scheme outdated password hashes are upgraded to.  Defaults to the default scheme.
+        :param password_rounds: The cost outdated password hashes are upgraded to.  Defaults to the work factor of the scheme.
         """
-        self.t11 = translations
+        self.t11 = merge_translations(translations)
+        self.db = db
+        self.user_shards = user_shards
+        self.hash_options = dict([ (name, value) for name, value in (('scheme', password_scheme),
+            ('rounds', password_rounds)) if value is not None ])
+        self.breaker = breaker
+        self.normalize_logins = normalize_logins
+        self.write_behind = write_behind
+        self.throttle = throttle
+        self.audit = audit
         self.User = self.t11['user_class']
         self.user_name_key = self.t11['user_name_key']
+        self.user_password_key = self.t11['user_password_key']
         self.user_list_view = self.t11['user_list_view']
         self.user_auth_method = self.t11['user_auth_method']
+        self.user_rehash_method = self.t11['user_rehash_method']
+        self.user_password_method = self.t11['user_password_method']
+        self.user_login_method = self.t11['user_login_method']
+        self.user_login_view = self.t11['user_login_view']
+        self.user_login_keys = tuple(self.t11['user_login_keys'])
+
+    @guarded_call
+    def _get_user(self, name):
+        """
+        Get a user by name.
+        :param name: The name of the user to get.
+        :return: The user document with the given name or None if not found.
+        """
+        if self.user_shards is None:
+            users = view(self.User, self.db, self.user_list_view, key=name)
+        else:
+            users = self.user_shards.view(name, self.User, self.user_list_view, key=name)
+        if len(users) > 0:
+            return users.__iter__().next()
+        return None
+
+    @guarded_call
+    def _find_login(self, login):
+        """
+        Get a user by any accepted form of login with a single query.
+        :param login: The login entered by the user.
+        :return: The user document the login resolves to or None if it matches no user or several.
+        """
+        key = normalize_login(login)
+        if self.user_shards is None:
+            users = list(view(self.User, self.db, self.user_login_view, key=key))
+        else:
+            users = self.user_shards.view_all(self.User, self.user_login_view, key=key)
+        exact = [ user for user in users if getattr(user, self.user_name_key) == login ]
+        if len(exact) == 1:
+            return exact[0]
+        for attr in (self.user_name_key,) + self.user_login_keys:
+            matches = dict([ (user._id, user) for user in users
+                if normalize_login(getattr(user, attr, None) or u'') == key ])
+            if len(matches) == 1:
+                return matches.values()[0]
+            if matches:
+                return None
+        return None
 
     def authenticate(self, environ, identity):
         """
-        Authenticate an identity against a CouchDB User document.
+        Authenticate an identity against a CouchDB User document.  Throttled
+        attempts are rejected without looking up the user.  Every attempt is
+        recorded in the audit log if there is one.
         :param environ: WSGI environment.
         :param identity: Identity dict for the user.
         """
         if 'login' in identity and 'password' in identity:
-            users = self.User.view(self.user_list_view, key=identity['login'])
-            if len(users) > 0:
-                user = users.__iter__().next()
+            login = identity['login']
+            throttle_login = normalize_login(login) if self.normalize_logins else login
+            if self.throttle is not None and not self.throttle.allow(environ, throttle_login):
+                self._audit(environ, login, 'throttled')
+                return None
+            try:
+                if self.normalize_logins:
+                    user = self._find_login(login)
+                else:
+                    user = self._get_user(login)
+            except (CircuitOpenError, CallTimeoutError):
+                self._audit(environ, login, 'unavailable')
+                return None
+            if user is not None:
                 auth = getattr(user, self.user_auth_method)
                 if auth(identity['password']):
+                    self._rehash(user, identity['password'])
+                    self._record_login(user)
+                    if self.throttle is not None:
+                        self.throttle.success(environ, throttle_login)
+                    self._audit(environ, login, 'success')
                     return getattr(user, self.user_name_key)
+                self._audit(environ, login, 'bad_password')
+            else:
+                self._audit(environ, login, 'unknown_user')
+            if self.throttle is not None:
+                self.throttle.failure(environ, throttle_login)
         return None
 
+    def _audit(self, environ, login, result):
+        """
+        Record a login attempt in the audit log.
+        :param environ: WSGI environment.
+        :param login: The login name of the attempt.
+        :param result: The outcome: 'success', 'bad_password', 'unknown_user', 'throttled' or 'unavailable'.
+        """
+        if self.audit is None:
+            return
+        self.audit.record({'type': 'login', 'login': login, 'result': result, 'success': result == 'success',
+            'remote_addr': environ.get('REMOTE_ADDR')})
+
+    def _get_db(self, name):
+        """
+        Get the database a user is stored in.
+        :param name: The name of the user.
+        :return: The database.
+        """
+        if self.user_shards is None:
+            return get_db(self.User, self.db)
+        return self.user_shards.get_db(name)
+
+    def _rehash(self, user, password):
+        """
+        Queue an upgrade of the user's password hash if it is outdated.  The
+        new hash is computed and saved by the write-behind queue, and only if
+        the stored hash has not changed in the meantime.
+        :param user: The authenticated user document.
+        :param password: The plaintext password the user logged in with.
+        """
+        if self.write_behind is None or not getattr(user, self.user_rehash_method)(**self.hash_options):
+            return
+        old_hash = getattr(user, self.user_password_key)
+        def update(doc):
+            if getattr(doc, self.user_password_key) != old_hash:
+                return False
+            getattr(doc, self.user_password_method)(password, **self.hash_options)
+            return True
+        self.write_behind.submit(self._get_db(getattr(user, self.user_name_key)), user._id, update)
+
+    def _record_login(self, user):
+        """
+        Queue an update of the user's last login time and login count.
+        :param user: The authenticated user document.
+        """
+        if self.write_behind is None:
+            return
+        update = LoginUpdate(self.user_login_method, datetime.utcnow())
+        self.write_behind.submit(self._get_db(getattr(user, self.user_name_key)), user._id, update)
+
+class LoginUpdate(object):
+    """
+    Write-behind update recording logins on a user document.  Updates for the
+    same user merge into one.
+    """
+
+    def __init__(self, method, when, count=1):
+        """
+        Constructor.
+        :param method: The name of the method on the user document which records logins.
+        :param when: The datetime of the latest login.
+        :param count: The number of logins.
+        """
+        self.method = method
+        self.when = when
+        self.count = count
+
+    def __call__(self, doc):
+        return getattr(doc, self.method)(self.when, self.count)
+
+    def merge(self, update):
+        """
+        Combine with a later update.
+        :param update: The later update.
+        :return: The combined update or None if the update is not a LoginUpdate.
+        """
+        if not isinstance(update, LoginUpdate) or update.method != self.method:
+            return None
+        return LoginUpdate(self.method, max(self.when, update.when), self.count + update.count)
+
 class MetadataPlugin:
     implements(IMetadataProvider)
 
-    def __init__(self, translations):
+    def __init__(self, translations, user_shards=None, claims=None, lazy=False, breaker=None, db=None, edges=False,
+            nested=False):
         """
-        Constructor.  Configures the plugin with the given translations dict.
+        Constructor.  Configures the plugin with a copy of the given translations dict, with missing keys
+        taken from the default translations.
         :param translations: The translations to use when mapping requests against a model.
+        :param user_shards: Optional UserShards to partition user documents across.
+        :param claims: Optional ClaimsContext used to carry groups and permissions in the auth_tkt cookie.
+        :param lazy: Whether to add a LazyUser proxy instead of loading the user document immediately.
+        :param breaker: Optional CircuitBreaker to run database calls through.
+        :param db: Optional database to use instead of the databases set on the document classes.
+        :param edges: Whether memberships and grants are stored as separate documents.  See edges.py.
+        :param nested: Whether groups may be nested in other groups.  See nesting.py.
         """
-        self.t11 = translations
+        self.t11 = merge_translations(translations)
+        self.db = db
+        self.edges = edges
+        self.user_shards = user_shards
+        self.claims = claims
+        self.tree = GroupTree(self.t11, db) if nested else None
+        self.lazy = lazy
+        self.breaker = breaker
         self.User = self.t11['user_class']
         self.user_list_view = self.t11['user_list_view']
+        self.user_groups_key = self.t11['user_groups_key']
+        self.Group = self.t11['group_class']
+        self.group_name_key = self.t11['group_name_key']
+        self.group_expiry_key = self.t11['group_expiry_key']
+        self.Permission = self.t11['perm_class']
+        self.perm_name_key = self.t11['perm_name_key']
+        self.perm_by_group_view = self.t11['perm_by_group_view']
+        self.membership_by_user_view = self.t11['membership_by_user_view']
+        self.grant_by_group_view = self.t11['grant_by_group_view']
+
+    @guarded_read
+    def _get_user(self, name):
+        """
+        Get a user by name.
+        :param name: The name of the user to get.
+        :return: The user document with the given name or None if not found.
+        """
+        if self.user_shards is None:
+            users = view(self.User, self.db, self.user_list_view, key=name)
+        else:
+            users = self.user_shards.view(name, self.User, self.user_list_view, key=name)
+        if len(users) > 0:
+            return users.__iter__().next()
+        return None
+
+    @guarded_read
+    def _get_permissions(self, groups):
+        """
+        Get the permissions of several groups in a single query.
+        :param groups: A list of group names.
+        :return: A dict mapping each group name to a list of permission names.
+        """
+        permissions = dict([ (group, []) for group in groups ])
+        if len(groups) > 0 and self.edges:
+            for row in get_db(self.Group, self.db).view(self.grant_by_group_view, keys=groups):
+                permissions[row['key']].append(row['value'])
+        elif len(groups) > 0:
+            rows = get_db(self.Permission, self.db).view(self.perm_by_group_view, keys=groups)
+            for row in rows:
+                permissions[row['key']].append(row['value'][self.perm_name_key])
+        return permissions
+
+    @guarded_read
+    def _get_edge_groups(self, name):
+        """
+        Get the groups of a user from its Membership documents.
+        :param name: The name of the user.
+        :return: A list of group names.
+        """
+        return [ row['value'] for row in get_db(self.Group, self.db).view(self.membership_by_user_view, key=name) ]
+
+    @guarded_read
+    def _expand_groups(self, groups):
+        """
+        Add the ancestors of nested groups to a list of groups in a single query.
+        :param groups: A list of group names.
+        :return: A list of the group names followed by the names of their ancestors.
+        """
+        return self.tree.expand(groups)
+
+    def _issue_claims(self, identity, user):
+        """
+        Issue claims for a user and store them in the identity tokens.
+        :param identity: Identity dict for the user.
+        :param user: The user document.
+        :return: The issued claims.
+        """
+        expires = None
+        if self.edges:
+            groups = self._get_edge_groups(identity['repoze.who.userid'])
+        else:
+            embedded = getattr(user, self.user_groups_key)
+            groups = active_groups(embedded, self.group_name_key, self.group_expiry_key)
+            expires = next_expiry([ getattr(group, self.group_expiry_key, None) for group in embedded ])
+            if expires is not None:
+                expires = expiry_time(expires)
+        if self.tree is not None:
+            groups = self._expand_groups(groups)
+        return self.claims.issue(identity, groups, self._get_permissions(groups), expires)
 
     def add_metadata(self, environ, identity):
         """
         Add metadata to an identity dict from the associated CouchDB User document.
+        When claims are enabled and the identity carries valid claims no query
+        is made.  In that case the user document is only added when the plugin
+        is lazy.  A lazy plugin adds a LazyUser proxy whenever the user does not
+        have to be loaded to issue claims.
         :param environ: WSGI environment.
         :param identity: Identity dict for the user.
         """
+        if self.claims is not None:
+            self.claims.release()
         if 'repoze.who.userid' in identity:
-            users = self.User.view(self.user_list_view, key=identity['repoze.who.userid'])
-            if len(users) > 0:
-                identity['user'] = users.__iter__().next()
-
+            userid = identity['repoze.who.userid']
+            if self.claims is not None:
+                claims = self.claims.from_identity(identity)
+                if claims is not None:
+                    self.claims.bind(userid, claims)
+                    if self.lazy:
+                        identity['user'] = LazyUser(self._get_user, userid, environ)
+                    return
+            elif self.lazy:
+                identity['user'] = LazyUser(self._get_user, userid, environ)
+                return
+            user = get_request_user(environ, self._get_user, userid)
+            if user is not None:
+                identity['user'] = user
+                if self.claims is not None:
+                    self.claims.bind(userid, self._issue_claims(identity, user))
@@ -18,56 +18,22 @@ from repoze.who.plugins.friendlyform import FriendlyFormPlugin
 from repoze.what.middleware import setup_auth
 from whatcouch.adapters import GroupAdapter, PermissionAdapter
 from whatcouch.plugins import AuthenticatorPlugin, MetadataPlugin
-from whatcouch.model import User, Group, Permission
+from whatcouch.sharding import UserShards
+from whatcouch.claims import ClaimsContext, DEFAULT_MAX_AGE
+from whatcouch.model import User, Group, Permission, get_scheme
+from whatcouch.translations import default_translations, merge_translations
 
 __all__ = ['setup_couch_auth']
 
-"""
-Default translations.  These will be substituted for missing values
-in the translations dict that is passed to the quickstart function.
-
-The following table documents the supported key values in the translations
-dict and each key's purpose:
-
-user_class:             The class for User documents.  Not used by quickstart.
-user_name_key:          User attribute where the login name is stored.
-user_groups_key:        User attribute where the groups collection is stored.
-user_list_view:         The name of a view that maps user names to user documents.
-user_by_group_view:     The name of a view that maps group names to user documents.
-user_auth_method:       Method on the User document which should be used to authenticate the user.  Takes the password as an argument.
-group_class:            The class for Group documents.  Not used by quickstart.
-group_name_key:         Group attribute where the group name is stored.
-group_perms_key:        Group attribute where the permissions collection is stored.
-group_list_view:        The name of a view that maps group names to group documents.
-group_by_perm_view:     The name of a view that maps permission names to group documents.
-perm_class:             The class for Permission documents.  Not used by quickstart.
-perm_name_key:          Permission attribute where the permission name is stored.
-perm_list_view:         The name of a view that maps permission names to permission documents.
-perm_by_group_view:     The name of a view that maps group names to permission documents.
-"""
-default_translations = {
-    'user_class': None,
-    'user_name_key': 'username',
-    'user_groups_key': 'groups',
-    'user_list_view': 'whatcouch/user_list',
-    'user_by_group_view': 'whatcouch/user_by_group',
-    'user_auth_method': 'authenticate',
-    'group_class': None,    
-    'group_name_key': 'name',
-    'group_perms_key': 'permissions',
-    'group_list_view': 'whatcouch/group_list',
-    'group_by_perm_view': 'whatcouch/group_by_permission',
-    'perm_class': None,
-    'perm_name_key': 'name',
-    'perm_list_view': 'whatcouch/permission_list',
-    'perm_by_group_view': 'whatcouch/permission_by_group'}
-
 def setup_couch_auth(app, user_class=None, group_class=None, permission_class=None, 
         form_plugin=None, form_identities=True,
         cookie_secret='secret', cookie_name='authtkt', cookie_timeout=None, cookie_reissue_time=None,
         charset='utf-8', login_url='/login', login_handler='/login_handler', post_login_url=None,
         logout_handler='/logout_handler', post_logout_url=None, login_counter_name=None,
-        translations=None, **who_args):
+        translations=None, user_shards=None, cookie_claims=False, claims_version=0, claims_max_age=DEFAULT_MAX_AGE,
+        lazy_user=False, authz_index=None, breaker=None, password_rounds=None, write_behind=None,
+        password_scheme=None, login_throttle=None, audit=None, db=None, edges=False, nested=False,
+        wildcards=False, normalize_logins=False, **who_args):
     """
     Quickly configure repoze.who and repoze.what to use CouchDB for authentication and authorization.
     With the exception of app, all parameters are options.
@@ -89,13 +55,27 @@ def setup_couch_auth(app, user_class=None, group_class=None, permission_class=No
     :param post_logout_url: The URL to redirect to after logout.
     :param login_counter_name: The name to use for the login counter.
     :param translations: The translations used to map CouchDB documents inside the wrapper classes.
+    :param user_shards: A list of databases to partition user documents across.  Disabled by default.
+    :param cookie_claims: Whether to carry group and permission names in the authtkt cookie.
+    :param claims_version: The version stamp for cookie claims.  Change it to invalidate all issued claims.
+    :param claims_max_age: The number of seconds after which cookie claims are recomputed.  Defaults to an hour.
+    :param lazy_user: Whether the user document added to the identity is loaded only when first accessed.
+    :param authz_index: An AuthzIndex or Snapshot to answer membership checks from.  It is loaded if it has not been already.
+    :param breaker: A CircuitBreaker to run all database calls through.  Disabled by default.
+    :param password_rounds: The cost password hashes are upgraded to by this application.  See whatcouch.model.calibrate().
+    :param write_behind: A WriteBehindQueue used to record logins and upgrade outdated password hashes.
+    :param password_scheme: The hashing scheme password hashes are upgraded to by this application, e.g. 'bcrypt' or 'pbkdf2-sha256'.
+    :param login_throttle: A LoginThrottle used to reject logins after too many failures.  Disabled by default.
+    :param audit: An AuditLog to record login attempts in.  Disabled by default.
+    :param db: The database of this application.  Defaults to the databases set on the document classes.
+    :param edges: Whether memberships and grants are stored as separate documents.  See whatcouch.edges.
+    :param nested: Whether groups may be nested in other groups.  See whatcouch.nesting.
+    :param wildcards: Whether permissions ending in '.*' grant every permission below them.  See whatcouch.wildcard.
+    :param normalize_logins: Whether logins are matched case-insensitively against user names and alternate login keys.
     :param who_args: Additional configuration arguments to pass to repoze.who.
     :return: The modified WSGI application.
     """
-    t11 = default_translations
-    if translations is not None:
-        for k, v in translations.iteritems():
-            t11[k] = v
+    t11 = merge_translations(translations or {})
 
     t11['user_class'] = User if user_class is None else user_class
     t11['group_class'] = Group if group_class is None else group_class
@@ -104,10 +84,30 @@ def setup_couch_auth(app, user_class=None, group_class=None, permission_class=No
     if form_plugin is None:
         form_plugin = FriendlyFormPlugin(login_url, login_handler, post_login_url, logout_handler, post_logout_url,
             login_counter_name=login_counter_name, rememberer_name='cookie', charset=charset)
-    group_adapters = {'couch_auth': GroupAdapter(t11)}
-    perm_adapters = {'couch_auth': PermissionAdapter(t11)}
-    authenticator = ('couch_auth', AuthenticatorPlugin(t11))
-    metadata = ('couch_auth', MetadataPlugin(t11))
+    if password_scheme is not None:
+        get_scheme(password_scheme)
+
+    if user_shards is not None and not isinstance(user_shards, UserShards):
+        user_shards = UserShards(user_shards)
+
+    claims = None
+    if cookie_claims:
+        claims = ClaimsContext(claims_version, claims_max_age, db=db, db_class=t11['group_class'])
+
+    group_adapter = GroupAdapter(t11, user_shards=user_shards, claims=claims, index=authz_index, breaker=breaker,
+        db=db, edges=edges, nested=nested)
+    perm_adapter = PermissionAdapter(t11, claims=claims, index=authz_index, breaker=breaker, db=db, edges=edges,
+        nested=nested, wildcards=wildcards)
+    if authz_index is not None and not authz_index.loaded:
+        authz_index.load(group_adapter, perm_adapter)
+
+    group_adapters = {'couch_auth': group_adapter}
+    perm_adapters = {'couch_auth': perm_adapter}
+    authenticator = ('couch_auth', AuthenticatorPlugin(t11, user_shards=user_shards, breaker=breaker,
+        write_behind=write_behind, throttle=login_throttle, audit=audit, db=db,
+        normalize_logins=normalize_logins, password_scheme=password_scheme, password_rounds=password_rounds))
+    metadata = ('couch_auth', MetadataPlugin(t11, user_shards=user_shards, claims=claims, lazy=lazy_user,
+        breaker=breaker, db=db, edges=edges, nested=nested))
     identifier = ('cookie', AuthTktCookiePlugin(cookie_secret, cookie_name, timeout=cookie_timeout, reissue_time=cookie_reissue_time))
     challenger = ('form', form_plugin)
     
@@ -0,0 +1,182 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+This module provides hash partitioning of User documents across several
+databases.  Partitioning is opt-in; pass a UserShards object to the adapters
+and plugins (or a list of databases to setup_couch_auth) to enable it.
+
+Each user is stored in exactly one shard, chosen by hashing the user name.
+Lookups by name go directly to that shard.  Queries which span users, such as
+listing the members of a group, run against every shard in parallel and the
+results are merged.  Groups and permissions are not partitioned and remain in
+the database associated with their document classes.
+
+Every shard must have the whatcouch design documents loaded.
+"""
+
+import sys, hashlib, threading
+from whatcouch.binding import bulk_write, bulk_edit
+
+__all__ = ['UserShards', 'shard_index']
+
+def shard_index(name, count):
+    """
+    Compute the shard a user name belongs to.  An MD5 digest is used instead
+    of hash() so that the placement is identical in every process.
+    :param name: The user name to place.
+    :param count: The number of shards.
+    :return: The index of the shard in the range [0, count).
+    """
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    return int(hashlib.md5(name).hexdigest(), 16) % count
+
+def parallel(calls):
+    """
+    Run a list of callables concurrently, one thread per call.  The first
+    exception raised by any call is re-raised once all calls have finished.
+    :param calls: A list of callables taking no arguments.
+    :return: A list of the return values in the same order as the calls.
+    """
+    if len(calls) == 1:
+        return [calls[0]()]
+    results = [None] * len(calls)
+    errors = []
+    def run(index, call):
+        try:
+            results[index] = call()
+        except Exception:
+            errors.append(sys.exc_info())
+    threads = [ threading.Thread(target=run, args=(i, call)) for i, call in enumerate(calls) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return results
+
+class UserShards(object):
+    """
+    A set of databases across which User documents are partitioned.
+    """
+
+    def __init__(self, databases):
+        """
+        Constructor.  The order of the databases determines the placement of
+        users and must not change once users have been stored.
+        :param databases: A list of couchdbkit databases, one per shard.
+        """
+        self.databases = list(databases)
+        if len(self.databases) == 0:
+            raise ValueError('at least one shard database is required')
+
+    def __len__(self):
+        """
+        :return: The number of shards.
+        """
+        return len(self.databases)
+
+    def get_db(self, name):
+        """
+        Get the shard database a user is stored in.
+        :param name: The name of the user.
+        :return: The database for the user.
+        """
+        return self.databases[shard_index(name, len(self.databases))]
+
+    def view(self, name, cls, view_name, **params):
+        """
+        Query a view on the shard holding the named user.
+        :param name: The name of the user used to route the query.
+        :param cls: The document class used to wrap the results.
+        :param view_name: The name of the view to query.
+        :param params: Additional view parameters.
+        :return: The view results.
+        """
+        return self.get_db(name).view(view_name, schema=cls, **params)
+
+    def view_all(self, cls, view_name, **params):
+        """
+        Query a view on every shard in parallel and merge the results.
+        :param cls: The document class used to wrap the results.
+        :param view_name: The name of the view to query.
+        :param params: Additional view parameters.
+        :return: A list containing the results from every shard.
+        """
+        calls = [ lambda db=db: list(db.view(view_name, schema=cls, **params)) for db in self.databases ]
+        merged = []
+        for results in parallel(calls):
+            merged.extend(results)
+        return merged
+
+    def save(self, doc, name):
+        """
+        Save a document to the shard of the named user.
+        :param doc: The document to save.
+        :param name: The name of the user used to route the document.
+        """
+        self.get_db(name).save_doc(doc)
+
+    def delete(self, doc, name):
+        """
+        Delete a document from the shard of the named user.
+        :param doc: The document to delete.
+        :param name: The name of the user used to route the document.
+        """
+        self.get_db(name).delete_doc(doc)
+
+    def bulk_save(self, docs, name_func):
+        """
+        Save documents to their shards.  Documents are grouped by shard and
+        each shard receives a single bulk request; shards are written in
+        parallel.
+        :param docs: The documents to save.
+        :param name_func: A callable returning the user name of a document.
+        :return: A list of the result rows of the documents which could not be saved.
+        """
+        batches = {}
+        for doc in docs:
+            index = shard_index(name_func(doc), len(self.databases))
+            batches.setdefault(index, []).append(doc)
+        calls = [ lambda index=index, batch=batch: bulk_write(self.databases[index], batch)
+            for index, batch in batches.iteritems() ]
+        errors = []
+        if calls:
+            for results in parallel(calls):
+                errors.extend(results)
+        return errors
+
+    def bulk_edit(self, cls, docs, name_func, edit, **params):
+        """
+        Edit documents and save them to their shards, retrying conflicts.
+        Each shard is edited with binding.bulk_edit() and shards are written
+        in parallel.
+        :param cls: The document class used to wrap fetched documents.
+        :param docs: The documents to edit.
+        :param name_func: A callable returning the user name of a document.
+        :param edit: A callable modifying a document in place and returning True if it changed.
+        :param params: Additional arguments passed to binding.bulk_edit().
+        :return: A tuple of the list of saved documents and the list of the result rows of the documents which could not be saved.
+        """
+        batches = {}
+        for doc in docs:
+            index = shard_index(name_func(doc), len(self.databases))
+            batches.setdefault(index, []).append(doc)
+        calls = [ lambda index=index, batch=batch: bulk_edit(cls, self.databases[index], batch, edit, **params)
+            for index, batch in batches.iteritems() ]
+        saved = []
+        errors = []
+        if calls:
+            for shard_saved, shard_errors in parallel(calls):
+                saved.extend(shard_saved)
+                errors.extend(shard_errors)
+        return saved, errors
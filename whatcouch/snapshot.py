@@ -0,0 +1,429 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+This module provides on-disk authorization snapshots.  A snapshot holds the
+complete user, group and permission mapping in a compact binary file which
+worker processes memory-map read-only.  The operating system shares the
+mapped pages between processes, so many workers serve authorization from one
+copy of the data without warming their own caches from CouchDB.
+
+Snapshots are written with dump_snapshot() or write_snapshot().  The file is
+written to a temporary name and renamed into place so readers never see a
+partial file.  A Snapshot reader periodically checks the path and maps the new
+file when it is replaced; lookups already in progress finish against the old
+mapping.
+
+Snapshot readers provide the lookup methods of AuthzIndex and may be passed to
+the adapters in its place.  They are read-only: changes made through the
+adapters are seen once a new snapshot has been written.  Each user record
+carries the earliest pending expiry of the user's memberships; once it has
+passed, lookups for the user return None so the adapters fall back to the
+database until a newer snapshot is mapped.
+
+File layout, all integers big-endian:
+
+    header   magic 'WCAS', format version, generation and the counts and
+             offsets of the sections below
+    groups   one record per group sorted by name: name offset, name length
+             and a bitset of the group's permissions
+    perms    one record per permission sorted by name: name offset, name
+             length and a bitset of the groups holding it
+    users    one record per user sorted by name: name offset, name length, a
+             bitset of the user's groups and the earliest membership expiry
+             in seconds since the epoch, 0 if none
+    strings  the UTF-8 encoded names
+
+Bit i of a group bitset refers to the i-th group record and bit j of a
+permission bitset to the j-th permission record.  Fixed-size records allow
+names to be found by binary search directly in the mapping.
+"""
+
+import os, mmap, time, struct, binascii, threading
+from whatcouch.index import AuthzIndex
+from whatcouch.expiry import next_expiry, expiry_time
+
+__all__ = ['Snapshot', 'write_snapshot', 'dump_snapshot']
+
+MAGIC = 'WCAS'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('>4sHHQIIIIIII')
+NAME = struct.Struct('>II')
+EXPIRY = struct.Struct('>Q')
+
+def _encode(name):
+    """
+    Encode a name for storage.
+    """
+    if isinstance(name, unicode):
+        return name.encode('utf-8')
+    return name
+
+def _pack_mask(mask, width):
+    """
+    Pack an integer bitset into a fixed number of bytes.
+    """
+    if width == 0:
+        return ''
+    return binascii.unhexlify('%0*x' % (width * 2, mask))
+
+def _unpack_mask(data):
+    """
+    Unpack a bitset packed by _pack_mask().
+    """
+    if not data:
+        return 0
+    return int(binascii.hexlify(data), 16)
+
+def _bits(names):
+    """
+    Map names to their bits in sorted order.
+    """
+    return dict([ (name, 1 << i) for i, name in enumerate(names) ])
+
+def write_snapshot(path, index, generation=None):
+    """
+    Write the contents of a loaded AuthzIndex to a snapshot file.  The file is
+    replaced atomically.
+    :param path: The path of the snapshot file.
+    :param index: The AuthzIndex to write.
+    :param generation: The generation stamp of the snapshot.  Defaults to the current time in milliseconds.
+    """
+    if generation is None:
+        generation = int(time.time() * 1000)
+    with index.lock:
+        groups = sorted([ _encode(name) for name in index.group_perms ])
+        perms = sorted([ _encode(name) for name in index.perm_groups ])
+        users = sorted([ (_encode(name), index.groups_of(name), next_expiry(index.user_expiries.get(name, {}).values()))
+            for name in index.user_groups ])
+        group_perms = dict([ (_encode(name), index.permissions_of(name)) for name in index.group_perms ])
+    group_bits = _bits(groups)
+    perm_bits = _bits(perms)
+    group_width = (len(groups) + 7) // 8
+    perm_width = (len(perms) + 7) // 8
+
+    strings = []
+    string_offsets = {}
+    string_size = [0]
+    def add_string(name):
+        if name not in string_offsets:
+            string_offsets[name] = string_size[0]
+            strings.append(name)
+            string_size[0] += len(name)
+        return NAME.pack(string_offsets[name], len(name))
+
+    perm_groups = dict([ (name, 0) for name in perms ])
+    group_records = []
+    for name in groups:
+        mask = 0
+        for perm in group_perms[name]:
+            perm = _encode(perm)
+            mask |= perm_bits[perm]
+            perm_groups[perm] |= group_bits[name]
+        group_records.append(add_string(name) + _pack_mask(mask, perm_width))
+    perm_records = [ add_string(name) + _pack_mask(perm_groups[name], group_width) for name in perms ]
+    user_records = []
+    for name, user_groups, expires in users:
+        mask = 0
+        for group in user_groups:
+            mask |= group_bits.get(_encode(group), 0)
+        expires = expires and expiry_time(expires) or 0
+        user_records.append(add_string(name) + _pack_mask(mask, group_width) + EXPIRY.pack(expires))
+
+    groups_offset = HEADER.size
+    perms_offset = groups_offset + len(groups) * (NAME.size + perm_width)
+    users_offset = perms_offset + len(perms) * (NAME.size + group_width)
+    strings_offset = users_offset + len(users) * (NAME.size + group_width + EXPIRY.size)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, generation, len(groups), len(perms), len(users),
+        groups_offset, perms_offset, users_offset, strings_offset)
+
+    temp_path = '%s.%i.tmp' % (path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        f.write(''.join(group_records))
+        f.write(''.join(perm_records))
+        f.write(''.join(user_records))
+        f.write(''.join(strings))
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(temp_path, path)
+
+def dump_snapshot(path, group_adapter, perm_adapter, generation=None):
+    """
+    Read the full authorization mapping from the database views and write it
+    to a snapshot file.
+    :param path: The path of the snapshot file.
+    :param group_adapter: The GroupAdapter used to read users and groups.
+    :param perm_adapter: The PermissionAdapter used to read permissions.
+    :param generation: The generation stamp of the snapshot.  Defaults to the current time in milliseconds.
+    """
+    index = AuthzIndex()
+    index.load(group_adapter, perm_adapter)
+    write_snapshot(path, index, generation)
+
+class SnapshotTable(object):
+    """
+    A section of fixed-size name records in a mapped snapshot.
+    """
+
+    def __init__(self, data, offset, count, width, strings_offset, expiring=False):
+        """
+        Constructor.
+        :param data: The mapped snapshot.
+        :param offset: The offset of the first record.
+        :param count: The number of records.
+        :param width: The width in bytes of the bitset stored in each record.
+        :param strings_offset: The offset of the strings section.
+        :param expiring: Whether each record ends with an expiry.
+        """
+        self.data = data
+        self.offset = offset
+        self.count = count
+        self.width = width
+        self.expiring = expiring
+        self.size = NAME.size + width + (expiring and EXPIRY.size or 0)
+        self.strings_offset = strings_offset
+
+    def name(self, i):
+        """
+        Get the name of a record.
+        :param i: The record number.
+        :return: The encoded name.
+        """
+        offset, length = NAME.unpack_from(self.data, self.offset + i * self.size)
+        start = self.strings_offset + offset
+        return self.data[start:start + length]
+
+    def mask(self, i):
+        """
+        Get the bitset of a record.
+        :param i: The record number.
+        :return: The bitset as an integer.
+        """
+        start = self.offset + i * self.size + NAME.size
+        return _unpack_mask(self.data[start:start + self.width])
+
+    def expires(self, i):
+        """
+        Get the expiry of a record.
+        :param i: The record number.
+        :return: The expiry in seconds since the epoch or None if the record does not expire.
+        """
+        if not self.expiring:
+            return None
+        return EXPIRY.unpack_from(self.data, self.offset + i * self.size + NAME.size + self.width)[0] or None
+
+    def find(self, name):
+        """
+        Find a record by name using binary search.
+        :param name: The name to find.
+        :return: The record number or None if not found.
+        """
+        name = _encode(name)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            found = self.name(middle)
+            if found < name:
+                low = middle + 1
+            elif found > name:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def decode(self, mask):
+        """
+        Get the names of the records whose bits are set in a mask.
+        :param mask: The bitset to decode.
+        :return: A list of names.
+        """
+        names = []
+        i = 0
+        while mask:
+            if mask & 1:
+                names.append(self.name(i).decode('utf-8'))
+            mask >>= 1
+            i += 1
+        return names
+
+class SnapshotData(object):
+    """
+    A single mapped snapshot file.
+    """
+
+    def __init__(self, path):
+        """
+        Constructor.  Maps the file read-only and validates the header.
+        :param path: The path of the snapshot file.
+        """
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.key = (stat.st_ino, stat.st_mtime, stat.st_size)
+        magic, version, reserved, self.generation, groups, perms, users, groups_offset, perms_offset, \
+            users_offset, strings_offset = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not an authorization snapshot' % path)
+        if version not in (1, FORMAT_VERSION):
+            raise ValueError('unsupported snapshot format version %i' % version)
+        group_width = (groups + 7) // 8
+        perm_width = (perms + 7) // 8
+        self.groups = SnapshotTable(self.data, groups_offset, groups, perm_width, strings_offset)
+        self.perms = SnapshotTable(self.data, perms_offset, perms, group_width, strings_offset)
+        self.users = SnapshotTable(self.data, users_offset, users, group_width, strings_offset, version >= 2)
+
+class Snapshot(object):
+    """
+    Read-only authorization lookups against a memory-mapped snapshot file.
+    """
+
+    loaded = True
+    readonly = True
+
+    def __init__(self, path, check_interval=5):
+        """
+        Constructor.  Maps the snapshot file.
+        :param path: The path of the snapshot file.
+        :param check_interval: How often in seconds to check whether the file has been replaced.
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.current = SnapshotData(path)
+        self.checked = time.time()
+
+    @property
+    def generation(self):
+        """
+        The generation stamp of the mapped snapshot.
+        """
+        return self.current.generation
+
+    def refresh(self, force=False):
+        """
+        Map the snapshot file again if it has been replaced.  Errors reading
+        the new file leave the current mapping in place.
+        :param force: Check immediately instead of waiting for the check interval.
+        :return: True if a new snapshot was mapped, False otherwise.
+        """
+        now = time.time()
+        if not force and now - self.checked < self.check_interval:
+            return False
+        with self.lock:
+            self.checked = now
+            try:
+                stat = os.stat(self.path)
+                if (stat.st_ino, stat.st_mtime, stat.st_size) == self.current.key:
+                    return False
+                self.current = SnapshotData(self.path)
+            except (OSError, IOError, ValueError):
+                return False
+        return True
+
+    def _data(self):
+        """
+        Get the current snapshot, refreshing it if due.
+        """
+        self.refresh()
+        return self.current
+
+    def _find_user(self, data, user):
+        """
+        Find the record of a user whose memberships are all current.
+        :param data: The current snapshot.
+        :param user: The name of the user.
+        :return: The record number or None if the user is not in the snapshot or a membership has expired.
+        """
+        i = data.users.find(user)
+        if i is None:
+            return None
+        expires = data.users.expires(i)
+        if expires is not None and expires <= time.time():
+            return None
+        return i
+
+    def groups_of(self, user):
+        """
+        Get the groups a user belongs to.
+        :param user: The name of the user.
+        :return: A list of group names or None if the user is not in the snapshot or a membership has expired.
+        """
+        data = self._data()
+        i = self._find_user(data, user)
+        if i is None:
+            return None
+        return data.groups.decode(data.users.mask(i))
+
+    def permissions_of(self, group):
+        """
+        Get the permissions held by a group.
+        :param group: The name of the group.
+        :return: A list of permission names or None if the group is not in the snapshot.
+        """
+        data = self._data()
+        i = data.groups.find(group)
+        if i is None:
+            return None
+        return data.perms.decode(data.groups.mask(i))
+
+    def groups_with(self, perm):
+        """
+        Get the groups holding a permission.
+        :param perm: The name of the permission.
+        :return: A list of group names or None if the permission is not in the snapshot.
+        """
+        data = self._data()
+        i = data.perms.find(perm)
+        if i is None:
+            return None
+        return data.groups.decode(data.perms.mask(i))
+
+    def is_member(self, user, group):
+        """
+        Check if a user belongs to a group.
+        :param user: The name of the user.
+        :param group: The name of the group.
+        :return: True or False, or None if the user is not in the snapshot or a membership has expired.
+        """
+        data = self._data()
+        i = self._find_user(data, user)
+        if i is None:
+            return None
+        j = data.groups.find(group)
+        return j is not None and data.users.mask(i) & (1 << j) != 0
+
+    def is_granted(self, group, perm):
+        """
+        Check if a group holds a permission.
+        :param group: The name of the group.
+        :param perm: The name of the permission.
+        :return: True or False, or None if the group is not in the snapshot.
+        """
+        data = self._data()
+        i = data.groups.find(group)
+        if i is None:
+            return None
+        j = data.perms.find(perm)
+        return j is not None and data.groups.mask(i) & (1 << j) != 0
+
+    def has_permission(self, user, perm):
+        """
+        Check if a user holds a permission through any of their groups.
+        :param user: The name of the user.
+        :param perm: The name of the permission.
+        :return: True or False, or None if the user is not in the snapshot or a membership has expired.
+        """
+        data = self._data()
+        i = self._find_user(data, user)
+        if i is None:
+            return None
+        j = data.perms.find(perm)
+        return j is not None and data.users.mask(i) & data.perms.mask(j) != 0
@@ -0,0 +1,61 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+from couchdbkit.loaders import FileSystemDocsLoader
+from whatcouch.test import Config
+from whatcouch.adapters import GroupAdapter, PermissionAdapter
+
+class TestBoundDatabase:
+    """
+    Test adapters bound to their own database.
+    """
+
+    @staticmethod
+    def setup_class():
+        """
+        Create a second database and adapters bound to it.
+        """
+        Config.tenant_db = Config.server.create_db('whatcouch_tests_tenant')
+        FileSystemDocsLoader(Config.design_path).sync(Config.tenant_db)
+        Config.tenant_groups = GroupAdapter(Config.t11, db=Config.tenant_db)
+        Config.tenant_perms = PermissionAdapter(Config.t11, db=Config.tenant_db)
+
+    @staticmethod
+    def teardown_class():
+        """
+        Delete the second database and the adapters.
+        """
+        Config.server.delete_db('whatcouch_tests_tenant')
+        del Config.tenant_db
+        del Config.tenant_groups
+        del Config.tenant_perms
+
+    def test_translations_copied(self):
+        """
+        Test the adapters keep their own copy of the translations.
+        """
+        assert Config.tenant_groups.t11 == Config.t11
+        assert Config.tenant_groups.t11 is not Config.t11
+
+    def test_isolated(self):
+        """
+        Test that sections created through a bound adapter live in its database only.
+        """
+        shared_groups = GroupAdapter(Config.t11)
+        Config.tenant_groups._create_section(u'tenantgroup')
+        Config.tenant_perms._create_section(u'tenantperm')
+        Config.tenant_perms._include_items(u'tenantperm', [u'tenantgroup'])
+        assert Config.tenant_groups._section_exists(u'tenantgroup')
+        assert not shared_groups._section_exists(u'tenantgroup')
+        assert Config.tenant_perms._item_is_included(u'tenantperm', u'tenantgroup')
+        Config.tenant_perms._delete_section(u'tenantperm')
+        Config.tenant_groups._delete_section(u'tenantgroup')
+        assert not Config.tenant_groups._section_exists(u'tenantgroup')
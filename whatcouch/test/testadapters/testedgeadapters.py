@@ -0,0 +1,102 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+from couchdbkit.resource import ResourceNotFound
+from whatcouch.test import Config
+from whatcouch.adapters import GroupAdapter, PermissionAdapter
+from whatcouch.edges import membership_id, grant_id
+from whatcouch.model import User, Group, Permission
+
+class TestEdgeAdapters:
+    """
+    Test the adapters storing memberships and grants as edge documents.
+    """
+
+    @staticmethod
+    def setup_class():
+        """
+        Create the adapters and the users, groups and permissions to link.
+        """
+        Config.group_adapter = GroupAdapter(Config.t11, edges=True)
+        Config.perm_adapter = PermissionAdapter(Config.t11, edges=True)
+        Config.docs = [User(username=u'eu1'), User(username=u'eu2'), Group(name=u'eg1'), Permission(name=u'ep1')]
+        for doc in Config.docs:
+            doc.save()
+
+    @staticmethod
+    def teardown_class():
+        """
+        Delete the documents and the adapters.
+        """
+        for doc in Config.docs:
+            try:
+                doc.delete()
+            except ResourceNotFound:
+                pass
+        del Config.docs
+        del Config.group_adapter
+        del Config.perm_adapter
+
+    def test_ids(self):
+        """
+        Test edge IDs are deterministic and unambiguous.
+        """
+        assert membership_id(u'a:b', u'c') != membership_id(u'a', u'b:c')
+        assert grant_id(u'g', u'p') == grant_id(u'g', u'p')
+
+    def test_memberships(self):
+        """
+        Test adding and removing users from a group through edges.
+        """
+        adapter = Config.group_adapter
+        adapter._include_items(u'eg1', [u'eu1', u'eu2', u'nouser'])
+        adapter._include_items(u'eg1', [u'eu1'])
+        assert sorted(adapter._get_section_items(u'eg1')) == [u'eu1', u'eu2']
+        assert adapter.count_section_items(u'eg1') == 2
+
+        assert adapter._item_is_included(u'eg1', u'eu2')
+        adapter._exclude_items(u'eg1', [u'eu2', u'nouser'])
+        assert adapter._get_section_items(u'eg1') == [u'eu1']
+        assert User.get(Config.docs[0]._id).groups == []
+
+    def test_grants(self):
+        """
+        Test granting and revoking a permission through edges.
+        """
+        adapter = Config.perm_adapter
+        adapter._include_items(u'ep1', [u'eg1', u'nogroup'])
+        assert adapter._get_section_items(u'ep1') == [u'eg1']
+        assert adapter._find_sections(u'eg1') == [u'ep1']
+        assert adapter.count_all_section_items()[u'ep1'] == 1
+        adapter._exclude_items(u'ep1', [u'eg1'])
+        assert not adapter._item_is_included(u'ep1', u'eg1')
+
+    def test_delete_section(self):
+        """
+        Test deleting a group deletes its edges.
+        """
+        adapter = Config.group_adapter
+        adapter._create_section(u'eg2')
+        adapter._include_items(u'eg2', [u'eu1'])
+        adapter._delete_section(u'eg2')
+
+    def test_set_user_groups(self):
+        """
+        Test setting the groups of a user applies only the difference.
+        """
+        adapter = Config.group_adapter
+        adapter._create_section(u'eg3')
+        try:
+            assert adapter.set_user_groups(u'eu2', [u'eg3', u'nogroup']) == ([u'eg3'], [])
+            assert adapter.set_user_groups(u'eu2', [u'eg3']) == ([], [])
+            assert adapter.set_users_groups({u'eu2': [], u'nouser': [u'eg3']}) == {u'eu2': ([], [u'eg3'])}
+        finally:
+            adapter._delete_section(u'eg3')
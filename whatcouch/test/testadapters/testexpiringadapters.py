@@ -0,0 +1,79 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+from couchdbkit.resource import ResourceNotFound
+from whatcouch.test import Config
+from whatcouch.adapters import GroupAdapter
+from whatcouch.expiry import ExpirySweeper
+from whatcouch.model import User, Group
+
+class TestExpiringAdapters:
+    """
+    Test time-bounded memberships through the group adapter.
+    """
+
+    @staticmethod
+    def setup_class():
+        """
+        Create two users and a group.
+        """
+        g1 = Group(name=u'xg1')
+        g1.save()
+        u1 = User(username=u'xu1')
+        u1.save()
+        u2 = User(username=u'xu2')
+        u2.save()
+        Config.docs = [u1, u2, g1]
+        Config.group_adapter = GroupAdapter(Config.t11)
+
+    @staticmethod
+    def teardown_class():
+        """
+        Delete the documents and the adapter.
+        """
+        for doc in Config.docs:
+            try:
+                doc.delete()
+            except ResourceNotFound:
+                pass
+        del Config.docs
+        del Config.group_adapter
+
+    def test_include_items_until(self):
+        """
+        Test expired memberships are ignored and removed by the sweeper.
+        """
+        Config.group_adapter.include_items_until(u'xg1', [u'xu1'], 0)
+        Config.group_adapter.include_items_until(u'xg1', [u'xu2'], 4102444800)
+        assert not Config.group_adapter._item_is_included(u'xg1', u'xu1')
+        assert Config.group_adapter._item_is_included(u'xg1', u'xu2')
+        assert Config.group_adapter._find_sections({'repoze.what.userid': u'xu1'}) == []
+        sweeper = ExpirySweeper(Config.group_adapter, start=False)
+        assert sweeper.sweep() == 1
+        assert len(Config.group_adapter._get_user(u'xu1').groups) == 0
+        assert len(Config.group_adapter._get_user(u'xu2').groups) == 1
+        Config.group_adapter._include_items(u'xg1', [u'xu2'])
+        assert getattr(Config.group_adapter._get_user(u'xu2').groups[0], 'expires', None) is None
+
+    def test_reload(self):
+        """
+        Test expiries read back from the database are compared correctly.
+        """
+        Config.group_adapter.include_items_until(u'xg1', [u'xu1'], 4102444800)
+        user = Config.group_adapter._get_user(u'xu1')
+        assert Config.group_adapter._find_user_sections(u'xu1') == [u'xg1']
+        assert Config.group_adapter._item_is_included(u'xg1', u'xu1')
+        Config.group_adapter.include_items_until(u'xg1', [u'xu1'], 4102444800)
+        assert Config.group_adapter._get_user(u'xu1')._doc['_rev'] == user._doc['_rev']
+        Config.group_adapter.include_items_until(u'xg1', [u'xu1'], 0)
+        assert Config.group_adapter._get_user(u'xu1')._doc['_rev'] != user._doc['_rev']
+        assert Config.group_adapter._find_user_sections(u'xu1') == []
+        Config.group_adapter._exclude_items(u'xg1', [u'xu1'])
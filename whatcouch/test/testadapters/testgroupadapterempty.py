@@ -92,3 +92,13 @@ class TestGroupAdapterEmpty:
             print e
             assert False
 
+
+    def test_partial_translations(self):
+        """
+        Test the adapter fills in translation keys missing from the given dict.
+        """
+        keys = ('user_class', 'user_name_key', 'user_groups_key', 'user_list_view', 'user_by_group_view',
+            'group_class', 'group_name_key', 'group_list_view')
+        adapter = GroupAdapter(dict([ (key, Config.t11[key]) for key in keys ]))
+        assert adapter.group_expiry_key == 'expires'
+        assert adapter._find_sections({'repoze.what.userid': 'nouser'}) == []
@@ -88,6 +88,31 @@ class TestGroupAdapterPopulated:
         user = Config.adapter._get_user(username)
         assert user is None
 
+    def test_page_user_names(self):
+        """
+        Test GroupAdapter.page_user_names() pages through the user names.
+        """
+        names, start = Config.adapter.page_user_names(limit=2)
+        assert names == [u'u1', u'u2']
+        assert start == u'u3'
+        names, start = Config.adapter.page_user_names(start=start, limit=2)
+        assert names == [u'u3']
+        assert start is None
+
+    def test_page_user_names__prefix(self):
+        """
+        Test GroupAdapter.page_user_names() with a prefix.
+        """
+        assert Config.adapter.page_user_names(prefix=u'u2') == ([u'u2'], None)
+        assert Config.adapter.page_user_names(prefix=u'x') == ([], None)
+
+    def test_page_group_names(self):
+        """
+        Test GroupAdapter.page_group_names() pages through the group names.
+        """
+        assert Config.adapter.page_group_names(prefix=u'g', limit=1) == ([u'g1'], u'g2')
+        assert Config.adapter.page_group_names(prefix=u'g', start=u'g2', limit=5) == ([u'g2', u'g3'], None)
+
     def test_get_group__found(self):
         """
         Test GroupAdapter._get_group() for an existing group.
@@ -143,6 +168,28 @@ class TestGroupAdapterPopulated:
         """
         self._get_section_items('g1')
 
+    def test_iter_section_items__paged(self):
+        """
+        Test GroupAdapter.iter_section_items() across several pages for a group with multiple users.
+        """
+        items = list(Config.adapter.iter_section_items('g1', page_size=1))
+        assert sorted(items) == sorted(Config.sections['g1'])
+
+    def test_count_section_items(self):
+        """
+        Test GroupAdapter.count_section_items() returns the number of users.
+        """
+        assert Config.adapter.count_section_items('g1') == len(Config.sections['g1'])
+        assert Config.adapter.count_section_items('nosection') == 0
+
+    def test_count_all_section_items(self):
+        """
+        Test GroupAdapter.count_all_section_items() includes empty sections.
+        """
+        counts = Config.adapter.count_all_section_items()
+        for section, items in Config.sections.items():
+            assert counts[section] == len(items)
+
     def test_get_section_items__onefound(self):
         """
         Test GroupAdapter._get_section_items() for a group with one user.
@@ -363,6 +410,22 @@ class TestGroupAdapterPopulated:
         assert new_group.name == new_section
         new_group.delete()
 
+    def test_set_user_groups(self):
+        """
+        Test GroupAdapter.set_user_groups() applies only the difference.
+        """
+        assert Config.adapter.set_user_groups(u'u3', [u'g3', u'nogroup']) == ([u'g3'], [])
+        assert Config.adapter._find_sections({'repoze.what.userid': u'u3'}) == [u'g3']
+        assert Config.adapter.set_user_groups(u'u3', []) == ([], [u'g3'])
+        assert Config.adapter.set_user_groups(u'nouser', [u'g3']) is None
+
+    def test_set_users_groups(self):
+        """
+        Test GroupAdapter.set_users_groups() for several users at once.
+        """
+        changes = Config.adapter.set_users_groups({u'u1': [u'g1', u'g2'], u'u2': [u'g1'], u'u3': []})
+        assert changes == {u'u1': ([], []), u'u2': ([], []), u'u3': ([], [])}
+
     def test_delete_section(self):
         """
         Test GroupAdapter._delete_section().
@@ -0,0 +1,114 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+from couchdbkit.resource import ResourceNotFound
+from whatcouch.test import Config
+from whatcouch.adapters import GroupAdapter, PermissionAdapter
+from whatcouch.index import AuthzIndex
+from whatcouch.model import User, Group, Permission
+
+class TestIndexedAdapters:
+    """
+    Test the adapters with a shared authorization index.
+    """
+
+    @staticmethod
+    def setup_class():
+        """
+        Populate the database and load the index from it.
+        """
+        p1 = Permission(name='ip1')
+        p1.save()
+        g1 = Group(name='ig1')
+        g1.permissions.append(p1)
+        g1.save()
+        u1 = User(username='iu1')
+        u1.groups.append(g1)
+        u1.save()
+        Config.docs = [u1, g1, p1]
+        Config.index = AuthzIndex()
+        Config.group_adapter = GroupAdapter(Config.t11, index=Config.index)
+        Config.perm_adapter = PermissionAdapter(Config.t11, index=Config.index)
+        Config.index.load(Config.group_adapter, Config.perm_adapter)
+
+    @staticmethod
+    def teardown_class():
+        """
+        Delete the documents and the adapters.
+        """
+        for doc in Config.docs:
+            try:
+                doc.delete()
+            except ResourceNotFound:
+                pass
+        del Config.docs
+        del Config.index
+        del Config.group_adapter
+        del Config.perm_adapter
+
+    def test_load(self):
+        """
+        Test that the index reflects the database after loading.
+        """
+        assert Config.index.loaded
+        assert Config.index.has_permission(u'iu1', u'ip1')
+
+    def test_find_sections(self):
+        """
+        Test both adapters answer _find_sections() from the index.
+        """
+        assert Config.group_adapter._find_sections({'repoze.what.userid': u'iu1'}) == [u'ig1']
+        assert Config.perm_adapter._find_sections(u'ig1') == [u'ip1']
+
+    def test_include_exclude_items(self):
+        """
+        Test the index follows membership changes made through the adapters.
+        """
+        Config.group_adapter._create_section(u'ig2')
+        Config.group_adapter._include_items(u'ig2', [u'iu1'])
+        assert Config.index.is_member(u'iu1', u'ig2')
+        assert Config.group_adapter._item_is_included(u'ig2', u'iu1')
+        Config.group_adapter._delete_section(u'ig2')
+        assert not Config.index.is_member(u'iu1', u'ig2')
+
+    def test_grant_revoke(self):
+        """
+        Test the index follows permission changes made through the adapters.
+        """
+        Config.perm_adapter._create_section(u'ip2')
+        Config.perm_adapter._include_items(u'ip2', [u'ig1'])
+        assert Config.index.has_permission(u'iu1', u'ip2')
+        Config.perm_adapter._exclude_items(u'ip2', [u'ig1'])
+        assert not Config.perm_adapter._item_is_included(u'ip2', u'ig1')
+        Config.perm_adapter._delete_section(u'ip2')
+
+    def test_set_users_groups__conflict(self):
+        """
+        Test a user changed concurrently is read again and the index follows
+        the groups actually saved.
+        """
+        adapter = Config.group_adapter
+        Config.group_adapter._create_section(u'ig3')
+        stale = adapter._get_user(u'iu1')
+        current = adapter._get_user(u'iu1')
+        current.login_count = 7
+        current.save()
+        query_users = adapter._query_users
+        adapter._query_users = lambda view_name, **params: [stale]
+        try:
+            assert adapter.set_user_groups(u'iu1', [u'ig1', u'ig3']) == ([u'ig3'], [])
+        finally:
+            adapter._query_users = query_users
+        user = adapter._get_user(u'iu1')
+        assert user.login_count == 7
+        assert sorted([ group.name for group in user.groups ]) == [u'ig1', u'ig3']
+        assert Config.index.is_member(u'iu1', u'ig3')
+        adapter._delete_section(u'ig3')
@@ -0,0 +1,100 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+from whatcouch.test import Config
+from whatcouch.adapters import GroupAdapter, PermissionAdapter
+from whatcouch.model import User, Group, Permission
+
+class TestNestedAdapters:
+    """
+    Test the adapters with nested groups.
+    """
+
+    @staticmethod
+    def setup_class():
+        """
+        Create a user in a group and a permission granted to a second group.
+        """
+        p1 = Permission(name=u'np1')
+        p1.save()
+        g1 = Group(name=u'ng1')
+        g1.save()
+        g2 = Group(name=u'ng2')
+        g2.permissions.append(p1)
+        g2.save()
+        u1 = User(username=u'nu1')
+        u1.groups.append(g1)
+        u1.save()
+        Config.group_adapter = GroupAdapter(Config.t11, nested=True)
+        Config.perm_adapter = PermissionAdapter(Config.t11, nested=True)
+
+    @staticmethod
+    def teardown_class():
+        """
+        Delete the documents and the adapters.
+        """
+        for name in (u'ng1', u'ng2', u'ng3'):
+            if Config.group_adapter._section_exists(name):
+                Config.group_adapter._delete_section(name)
+        Config.group_adapter._get_user(u'nu1').delete()
+        Config.perm_adapter._delete_section(u'np1')
+        del Config.group_adapter
+        del Config.perm_adapter
+
+    def test_nesting(self):
+        """
+        Test a nested group's members belong to the parent and inherit its permissions.
+        """
+        assert Config.group_adapter.add_parent(u'ng1', u'ng2')
+        assert not Config.group_adapter.add_parent(u'ng1', u'ng2')
+        assert Config.group_adapter._item_is_included(u'ng2', u'nu1')
+        assert Config.perm_adapter._item_is_included(u'np1', u'ng1')
+        assert Config.group_adapter.remove_parent(u'ng1', u'ng2')
+        assert not Config.group_adapter._item_is_included(u'ng2', u'nu1')
+        assert not Config.perm_adapter._item_is_included(u'np1', u'ng1')
+
+    def test_section_items(self):
+        """
+        Test listings and counts of a parent group include the members of nested groups.
+        """
+        Config.group_adapter.add_parent(u'ng1', u'ng2')
+        assert Config.group_adapter._get_section_items(u'ng2') == [u'nu1']
+        assert Config.group_adapter.count_section_items(u'ng2') == 1
+        Config.group_adapter.remove_parent(u'ng1', u'ng2')
+        assert Config.group_adapter._get_section_items(u'ng2') == []
+        assert Config.group_adapter.count_section_items(u'ng2') == 0
+
+    def test_rename_parent(self):
+        """
+        Test renaming a parent group keeps its nested groups and their inherited permissions.
+        """
+        Config.group_adapter.add_parent(u'ng1', u'ng2')
+        Config.group_adapter._edit_section(u'ng2', u'ng3')
+        child = Config.group_adapter._get_group(u'ng1')
+        assert list(child.parents) == [u'ng3']
+        assert list(child.ancestors) == [u'ng3']
+        assert Config.perm_adapter._item_is_included(u'np1', u'ng1')
+        assert Config.group_adapter._item_is_included(u'ng3', u'nu1')
+        Config.group_adapter.remove_parent(u'ng1', u'ng3')
+        Config.group_adapter._edit_section(u'ng3', u'ng2')
+
+    def test_cycle(self):
+        """
+        Test a group cannot be nested in its own descendant.
+        """
+        Config.group_adapter.add_parent(u'ng1', u'ng2')
+        try:
+            Config.group_adapter.add_parent(u'ng2', u'ng1')
+        except ValueError:
+            pass
+        else:
+            assert False
+        Config.group_adapter.remove_parent(u'ng1', u'ng2')
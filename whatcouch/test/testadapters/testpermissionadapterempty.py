@@ -91,3 +91,13 @@ class TestPermissionAdapterEmpty:
             print e
             assert False
 
+
+    def test_partial_translations(self):
+        """
+        Test the adapter fills in translation keys missing from the given dict.
+        """
+        keys = ('group_class', 'group_name_key', 'group_perms_key', 'group_list_view', 'group_by_perm_view',
+            'perm_class', 'perm_name_key', 'perm_list_view', 'perm_by_group_view')
+        adapter = PermissionAdapter(dict([ (key, Config.t11[key]) for key in keys ]))
+        assert adapter.grant_by_group_view == 'whatcouch/grant_by_group'
+        assert adapter._find_sections('nogroup') == []
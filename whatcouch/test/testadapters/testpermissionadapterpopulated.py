@@ -70,6 +70,14 @@ class TestPermissionAdapterPopulated:
         del Config.items
         del Config.adapter
 
+    def test_page_permission_names(self):
+        """
+        Test PermissionAdapter.page_permission_names() pages through the permission names.
+        """
+        assert Config.adapter.page_permission_names(limit=2) == ([u'p1', u'p2'], u'p3')
+        assert Config.adapter.page_permission_names(start=u'p3', limit=2) == ([u'p3'], None)
+        assert Config.adapter.page_permission_names(prefix=u'p2') == ([u'p2'], None)
+
     def test_get_group__found(self):
         """
         Test PermissionAdapter._get_group() for an existing group.
@@ -142,6 +150,28 @@ class TestPermissionAdapterPopulated:
         """
         self._get_section_items('p1')
 
+    def test_iter_section_items__paged(self):
+        """
+        Test PermissionAdapter.iter_section_items() across several pages for a permission with multiple groups.
+        """
+        items = list(Config.adapter.iter_section_items('p1', page_size=1))
+        assert sorted(items) == sorted(Config.sections['p1'])
+
+    def test_count_section_items(self):
+        """
+        Test PermissionAdapter.count_section_items() returns the number of groups.
+        """
+        assert Config.adapter.count_section_items('p1') == len(Config.sections['p1'])
+        assert Config.adapter.count_section_items('nosection') == 0
+
+    def test_count_all_section_items(self):
+        """
+        Test PermissionAdapter.count_all_section_items() includes empty sections.
+        """
+        counts = Config.adapter.count_all_section_items()
+        for section, items in Config.sections.items():
+            assert counts[section] == len(items)
+
     def test_get_section_items__onefound(self):
         """
         Test PermissionAdapter._get_section_items() for a permission with
@@ -372,6 +402,14 @@ class TestPermissionAdapterPopulated:
         assert new_perm.name == new_section
         new_perm.delete()
 
+    def test_set_group_permissions(self):
+        """
+        Test PermissionAdapter.set_group_permissions() applies only the difference.
+        """
+        assert Config.adapter.set_group_permissions(u'g3', [u'p3', u'noperm']) == ([u'p3'], [])
+        assert Config.adapter._find_sections(u'g3') == [u'p3']
+        assert Config.adapter.set_groups_permissions({u'g3': [], u'nogroup': [u'p3']}) == {u'g3': ([], [u'p3'])}
+
     def test_delete_section(self):
         """
         Test PermissionAdapter._delete_section().
@@ -0,0 +1,176 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+from whatcouch.test import Config
+from whatcouch.adapters import GroupAdapter, PermissionAdapter
+from whatcouch.unitofwork import UnitOfWork
+from whatcouch.edges import membership_id
+from whatcouch.model import User
+
+class EdgeDB:
+    """
+    A database stand-in holding edge documents, failing to save the IDs in
+    fail.
+    """
+
+    def __init__(self, fail):
+        self.docs = {}
+        self.fail = fail
+
+    def bulk_save(self, docs):
+        results = []
+        for doc in docs:
+            if doc['_id'] in self.fail:
+                results.append({'id': doc['_id'], 'error': 'forbidden'})
+            elif doc.get('_deleted'):
+                del self.docs[doc['_id']]
+                results.append({'id': doc['_id'], 'rev': '2'})
+            else:
+                self.docs[doc['_id']] = doc
+                results.append({'id': doc['_id'], 'rev': '1'})
+        return results
+
+    def all_docs(self, keys):
+        return [ {'id': key, 'value': {'rev': '1'}} for key in keys if key in self.docs ]
+
+    def view(self, name, keys):
+        return [ {'key': key} for key in keys ]
+
+class EdgeAdapter:
+    """
+    A group adapter stand-in storing memberships as edges and recording index
+    updates.
+    """
+
+    edges = True
+    Group = None
+    group_name_key = 'name'
+    group_names_view = 'group_names'
+
+    def __init__(self, db):
+        self.db = db
+        self.updates = []
+
+    def _edge_db(self):
+        return self.db
+
+    def _existing_users(self, names):
+        return names
+
+    def _update_index(self, method, *args):
+        self.updates.append((method,) + args)
+
+    def _invalidate_claims(self):
+        pass
+
+class TestUnitOfWork:
+    """
+    Test batching adapter changes in a unit of work.
+    """
+
+    @staticmethod
+    def setup_class():
+        """
+        Create the adapters and the users to add to groups.
+        """
+        Config.group_adapter = GroupAdapter(Config.t11)
+        Config.perm_adapter = PermissionAdapter(Config.t11)
+        User(username=u'wu1').save()
+        User(username=u'wu2').save()
+
+    @staticmethod
+    def teardown_class():
+        """
+        Delete the documents and the adapters.
+        """
+        for name in (u'wu1', u'wu2'):
+            user = Config.group_adapter._get_user(name)
+            if user is not None:
+                user.delete()
+        for name in (u'wg1', u'wg2'):
+            if Config.group_adapter._section_exists(name):
+                Config.group_adapter._delete_section(name)
+        if Config.perm_adapter._section_exists(u'wp1'):
+            Config.perm_adapter._delete_section(u'wp1')
+        del Config.group_adapter
+        del Config.perm_adapter
+
+    def test_commit(self):
+        """
+        Test new sections, memberships and grants are written on exit.
+        """
+        with UnitOfWork(Config.group_adapter, Config.perm_adapter) as work:
+            work.create_permission(u'wp1')
+            work.create_group(u'wg1')
+            work.include_users(u'wg1', [u'wu1', u'wu2', u'nouser'])
+            work.grant(u'wp1', [u'wg1'])
+        assert work.errors == {}
+        assert Config.group_adapter._item_is_included(u'wg1', u'wu1')
+        assert Config.group_adapter._item_is_included(u'wg1', u'wu2')
+        assert Config.perm_adapter._item_is_included(u'wp1', u'wg1')
+
+    def test_coalesce(self):
+        """
+        Test the last change to a membership wins.
+        """
+        work = UnitOfWork(Config.group_adapter)
+        work.create_group(u'wg2')
+        work.include_users(u'wg2', [u'wu1', u'wu2'])
+        work.exclude_users(u'wg2', [u'wu2'])
+        assert work.commit() == {}
+        assert Config.group_adapter._item_is_included(u'wg2', u'wu1')
+        assert not Config.group_adapter._item_is_included(u'wg2', u'wu2')
+
+    def test_rollback(self):
+        """
+        Test nothing is written when the block raises.
+        """
+        try:
+            with UnitOfWork(Config.group_adapter) as work:
+                work.create_group(u'wg3')
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        assert not Config.group_adapter._section_exists(u'wg3')
+
+    def test_requires_perm_adapter(self):
+        """
+        Test grants cannot be recorded without a permission adapter.
+        """
+        work = UnitOfWork(Config.group_adapter)
+        try:
+            work.grant(u'wp1', [u'wg1'])
+        except ValueError:
+            pass
+        else:
+            assert False
+
+class TestUnitOfWorkEdges:
+    """
+    Test committing edge documents without a database.
+    """
+
+    def test_failed_edges(self):
+        """
+        Test edges which could not be written are reported and left out of the index.
+        """
+        db = EdgeDB([membership_id(u'u2', u'g1')])
+        adapter = EdgeAdapter(db)
+        work = UnitOfWork(adapter)
+        work.include_users(u'g1', [u'u1', u'u2'])
+        errors = work.commit()
+        assert errors == {membership_id(u'u2', u'g1'): 'forbidden'}
+        assert adapter.updates == [('add_membership', u'u1', u'g1')]
+        adapter.updates = []
+        db.fail = [membership_id(u'u1', u'g1')]
+        work.exclude_users(u'g1', [u'u1'])
+        assert work.commit() == {membership_id(u'u1', u'g1'): 'forbidden'}
+        assert adapter.updates == []
@@ -0,0 +1,73 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+from couchdbkit.resource import ResourceNotFound
+from whatcouch.test import Config
+from whatcouch.adapters import PermissionAdapter
+from whatcouch.model import Group, Permission
+
+class TestWildcardAdapters:
+    """
+    Test wildcard grants through the permission adapter.
+    """
+
+    @staticmethod
+    def setup_class():
+        """
+        Create a group granted 'wbilling.*' and the permissions below it.
+        """
+        docs = [Group(name=u'wcg1'), Group(name=u'wcg2')]
+        for name in (u'wbilling.*', u'wbilling.invoices.read', u'wbilling.refunds', u'wreports.read'):
+            docs.append(Permission(name=name))
+        for doc in docs:
+            doc.save()
+        Config.docs = docs
+        Config.perm_adapter = PermissionAdapter(Config.t11, wildcards=True)
+        Config.perm_adapter._include_items(u'wbilling.*', [u'wcg1'])
+        Config.perm_adapter._include_items(u'wbilling.invoices.read', [u'wcg2'])
+
+    @staticmethod
+    def teardown_class():
+        """
+        Delete the documents and the adapter.
+        """
+        for doc in Config.docs:
+            try:
+                doc.delete()
+            except ResourceNotFound:
+                pass
+        del Config.docs
+        del Config.perm_adapter
+
+    def test_item_is_included(self):
+        """
+        Test a wildcard grant includes the group in the permissions below it.
+        """
+        assert Config.perm_adapter._item_is_included(u'wbilling.invoices.read', u'wcg1')
+        assert Config.perm_adapter._item_is_included(u'wbilling.refunds', u'wcg1')
+        assert not Config.perm_adapter._item_is_included(u'wreports.read', u'wcg1')
+        assert not Config.perm_adapter._item_is_included(u'wbilling.refunds', u'wcg2')
+
+    def test_find_sections(self):
+        """
+        Test the permissions seen by repoze.what's predicates include those granted by wildcards.
+        """
+        sections = Config.perm_adapter._find_sections(u'wcg1')
+        assert sections == [u'wbilling.*', u'wbilling.invoices.read', u'wbilling.refunds']
+        assert Config.perm_adapter._find_sections(u'wcg2') == [u'wbilling.invoices.read']
+
+    def test_get_section_items(self):
+        """
+        Test listings and counts of a permission include groups granted it by a wildcard.
+        """
+        assert sorted(Config.perm_adapter._get_section_items(u'wbilling.invoices.read')) == [u'wcg1', u'wcg2']
+        assert Config.perm_adapter._get_section_items(u'wbilling.refunds') == [u'wcg1']
+        assert Config.perm_adapter.count_section_items(u'wbilling.invoices.read') == 2
@@ -0,0 +1,100 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+import threading
+from whatcouch.audit import AuditLog
+
+class RecordingDB:
+    """
+    A database stand-in recording bulk saves, optionally blocking or failing.
+    """
+
+    def __init__(self):
+        self.batches = []
+        self.block = None
+        self.fail = False
+
+    def bulk_save(self, docs):
+        if self.block is not None:
+            self.block.wait()
+        if self.fail:
+            raise IOError('database unavailable')
+        self.batches.append(list(docs))
+
+class TestAuditLog:
+    """
+    Test the audit log without a database.
+    """
+
+    def setup(self):
+        self.db = RecordingDB()
+
+    def test_batches(self):
+        """
+        Test that queued events are written in batches.
+        """
+        audit = AuditLog(self.db, batch_size=3, interval=60)
+        for i in range(7):
+            assert audit.record({'n': i})
+        audit.close()
+        assert [ len(batch) for batch in self.db.batches ] == [3, 3, 1]
+        assert [ event['n'] for batch in self.db.batches for event in batch ] == range(7)
+        assert audit.metrics['written'] == 7
+        assert audit.metrics['flushes'] == 3
+        assert audit.depth == 0
+
+    def test_close(self):
+        """
+        Test that closing the log writes the queued events and drops later ones.
+        """
+        audit = AuditLog(self.db, batch_size=100, interval=3600)
+        for i in range(5):
+            audit.record({'n': i})
+        audit.close()
+        assert [ event['n'] for batch in self.db.batches for event in batch ] == range(5)
+        assert not audit.thread.is_alive()
+        assert not audit.record({'n': 5})
+        assert audit.metrics['dropped'] == 1
+
+    def test_drop(self):
+        """
+        Test that events are dropped when the queue is full.
+        """
+        self.db.block = threading.Event()
+        audit = AuditLog(self.db, max_queue=2, batch_size=1, interval=0)
+        results = [ audit.record({'n': i}) for i in range(10) ]
+        assert not all(results)
+        assert audit.metrics['dropped'] == results.count(False)
+        self.db.block.set()
+        audit.close()
+        assert audit.metrics['written'] == results.count(True)
+
+    def test_block(self):
+        """
+        Test that the block policy gives up after its timeout.
+        """
+        self.db.block = threading.Event()
+        audit = AuditLog(self.db, max_queue=1, batch_size=1, interval=0, policy='block', block_timeout=0.01)
+        results = [ audit.record({'n': i}) for i in range(4) ]
+        assert results.count(False) >= 1
+        self.db.block.set()
+        audit.close()
+
+    def test_failed(self):
+        """
+        Test that events which cannot be written are counted.
+        """
+        self.db.fail = True
+        audit = AuditLog(self.db, batch_size=10, interval=60)
+        audit.record({'n': 1})
+        audit.close()
+        assert audit.metrics['failed'] == 1
+        assert audit.metrics['written'] == 0
@@ -0,0 +1,102 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+from whatcouch.binding import bulk_edit
+
+class Doc(dict):
+    """
+    A minimal document class wrapping a dict.
+    """
+
+    @classmethod
+    def wrap(cls, data):
+        return cls(data)
+
+class MemoryDB:
+    """
+    A database stand-in holding documents in a dict.  Each save of a document
+    listed in conflicts fails with a conflict while another writer adds an item
+    to it, as many times as listed.
+    """
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.conflicts = {}
+        self.fetched = []
+
+    def all_docs(self, keys, include_docs):
+        self.fetched.append(list(keys))
+        return [ {'key': key, 'doc': dict(self.docs[key], items=list(self.docs[key]['items']))} for key in keys ]
+
+    def bulk_save(self, docs):
+        results = []
+        for doc in docs:
+            if self.conflicts.get(doc['_id']):
+                self.conflicts[doc['_id']] -= 1
+                self.docs[doc['_id']]['items'].append('other')
+                results.append({'id': doc['_id'], 'error': 'conflict'})
+            else:
+                self.docs[doc['_id']] = dict(doc)
+                results.append({'id': doc['_id'], 'rev': '2'})
+        return results
+
+def add(doc):
+    """
+    An edit adding 'mine' to the items of a document.
+    """
+    if 'mine' in doc['items']:
+        return False
+    doc['items'].append('mine')
+    return True
+
+class TestBulkEdit:
+    """
+    Test saving edits with targeted conflict retries.
+    """
+
+    def setup(self):
+        self.db = MemoryDB(dict([ (key, {'_id': key, 'items': []}) for key in ('a', 'b', 'c') ]))
+        self.metrics = {'conflicts': 0, 'retries': 0, 'failures': 0}
+
+    def count(self, name, value):
+        self.metrics[name] += value
+
+    def docs(self):
+        return [ Doc(self.db.docs[key], items=list(self.db.docs[key]['items'])) for key in ('a', 'b', 'c') ]
+
+    def test_no_conflicts(self):
+        saved, errors = bulk_edit(Doc, self.db, self.docs(), add, count=self.count)
+        assert sorted([ doc['_id'] for doc in saved ]) == ['a', 'b', 'c']
+        assert errors == []
+        assert self.db.fetched == []
+        assert self.metrics == {'conflicts': 0, 'retries': 0, 'failures': 0}
+
+    def test_unchanged(self):
+        self.db.docs['a']['items'].append('mine')
+        saved, errors = bulk_edit(Doc, self.db, self.docs(), add)
+        assert sorted([ doc['_id'] for doc in saved ]) == ['b', 'c']
+
+    def test_retry(self):
+        self.db.conflicts['b'] = 1
+        saved, errors = bulk_edit(Doc, self.db, self.docs(), add, backoff=0, count=self.count)
+        assert sorted([ doc['_id'] for doc in saved ]) == ['a', 'b', 'c']
+        assert errors == []
+        assert self.db.fetched == [['b']]
+        assert self.db.docs['b']['items'] == ['other', 'mine']
+        assert self.metrics == {'conflicts': 1, 'retries': 1, 'failures': 0}
+
+    def test_give_up(self):
+        self.db.conflicts['c'] = 5
+        saved, errors = bulk_edit(Doc, self.db, self.docs(), add, retries=2, backoff=0, count=self.count)
+        assert sorted([ doc['_id'] for doc in saved ]) == ['a', 'b']
+        assert [ error['id'] for error in errors ] == ['c']
+        assert len(self.db.fetched) == 2
+        assert self.metrics == {'conflicts': 3, 'retries': 2, 'failures': 1}
@@ -0,0 +1,184 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+import time, threading
+from whatcouch.breaker import CircuitBreaker, CircuitOpenError, CallTimeoutError, guarded_read, guarded_call
+
+class Flaky:
+    """
+    A callable which fails or blocks on demand.
+    """
+
+    def __init__(self):
+        self.fail = False
+        self.block = None
+        self.value = 'v1'
+
+    def __call__(self, *args):
+        if self.block is not None:
+            self.block.wait()
+        if self.fail:
+            raise IOError('database unavailable')
+        return self.value
+
+class Guarded:
+    """
+    An object with guarded methods taking keyword arguments.
+    """
+
+    def __init__(self, breaker):
+        self.breaker = breaker
+        self.reads = 0
+
+    @guarded_read
+    def lookup(self, name, limit=None):
+        self.reads += 1
+        return (name, limit)
+
+    @guarded_call
+    def change(self, name, until=None):
+        return (name, until)
+
+class TestCircuitBreaker:
+    """
+    Test the circuit breaker without a database.
+    """
+
+    def test_read__fallback(self):
+        """
+        Test that a failed read returns the last good value.
+        """
+        breaker = CircuitBreaker(failure_threshold=10)
+        func = Flaky()
+        assert breaker.read('k', func) == 'v1'
+        func.fail = True
+        func.value = 'v2'
+        assert breaker.read('k', func) == 'v1'
+        assert breaker.metrics['fallbacks'] == 1
+
+    def test_read__nofallback(self):
+        """
+        Test that a failed read without a cached value raises.
+        """
+        breaker = CircuitBreaker()
+        func = Flaky()
+        func.fail = True
+        try:
+            breaker.read('k', func)
+        except IOError:
+            pass
+        else:
+            assert False
+
+    def test_open(self):
+        """
+        Test that the breaker opens after the failure threshold and rejects calls.
+        """
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        func = Flaky()
+        func.fail = True
+        for i in range(2):
+            try:
+                breaker.call(func)
+            except IOError:
+                pass
+        assert breaker.state == 'open'
+        func.fail = False
+        try:
+            breaker.call(func)
+        except CircuitOpenError:
+            pass
+        else:
+            assert False
+        assert breaker.metrics['rejected'] == 1
+
+    def test_caller_errors(self):
+        """
+        Test that caller mistakes are raised without opening the breaker.
+        """
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        def invalid():
+            raise ValueError('cycle')
+        for i in range(3):
+            try:
+                breaker.call(invalid)
+            except ValueError:
+                pass
+            else:
+                assert False
+        try:
+            breaker.read('k', invalid)
+        except ValueError:
+            pass
+        else:
+            assert False
+        assert breaker.state == 'closed'
+        assert breaker.metrics['failures'] == 0
+
+    def test_half_open(self):
+        """
+        Test that a successful trial call closes the breaker.
+        """
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        func = Flaky()
+        func.fail = True
+        try:
+            breaker.call(func)
+        except IOError:
+            pass
+        assert breaker.state == 'half-open'
+        func.fail = False
+        assert breaker.call(func) == 'v1'
+        assert breaker.state == 'closed'
+
+    def test_timeout(self):
+        """
+        Test that a slow read falls back and the late result refreshes the cache.
+        """
+        breaker = CircuitBreaker(call_timeout=0.05)
+        func = Flaky()
+        assert breaker.read('k', func) == 'v1'
+        func.block = threading.Event()
+        func.value = 'v2'
+        assert breaker.read('k', func) == 'v1'
+        assert breaker.metrics['timeouts'] == 1
+        func.block.set()
+        for i in range(100):
+            if breaker.cache.get('k') == 'v2':
+                break
+            time.sleep(0.01)
+        assert breaker.read('k', func) == 'v2'
+
+    def test_keyword_arguments(self):
+        """
+        Test that guarded methods pass keyword arguments through and key reads on them.
+        """
+        for breaker in (None, CircuitBreaker(), CircuitBreaker(call_timeout=1)):
+            guarded = Guarded(breaker)
+            assert guarded.lookup(u'a', limit=5) == (u'a', 5)
+            assert guarded.lookup(u'a', limit=6) == (u'a', 6)
+            assert guarded.change(u'a', until=10) == (u'a', 10)
+        assert len(guarded.breaker.cache) == 2
+
+    def test_timeout__call(self):
+        """
+        Test that a slow call raises CallTimeoutError.
+        """
+        breaker = CircuitBreaker(call_timeout=0.05)
+        func = Flaky()
+        func.block = threading.Event()
+        try:
+            breaker.call(func)
+        except CallTimeoutError:
+            pass
+        else:
+            assert False
+        func.block.set()
@@ -0,0 +1,100 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+from whatcouch.bulkcheck import BulkChecker
+from whatcouch.index import AuthzIndex
+
+class Entry(object):
+    """
+    A document stand-in with attributes.
+    """
+
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+class GrantDB(object):
+    """
+    A database stand-in answering the permission by group view.
+    """
+
+    def __init__(self, grants):
+        self.grants = grants
+        self.queries = []
+
+    def view(self, view_name, keys):
+        self.queries.append(sorted(keys))
+        return [ {'key': group, 'value': {'name': perm}} for group in keys for perm in self.grants.get(group, []) ]
+
+class Adapter(object):
+    """
+    An adapter stand-in with embedded memberships.
+    """
+
+    edges = False
+    tries = None
+    tree = None
+    index = None
+    user_list_view = 'users'
+    perm_by_group_view = 'perms'
+    user_name_key = 'username'
+    user_groups_key = 'groups'
+    group_name_key = 'name'
+    group_expiry_key = 'expires'
+    perm_name_key = 'name'
+    Permission = None
+
+    def __init__(self, users, db):
+        self.users = users
+        self.db = db
+        self.user_queries = []
+
+    def _use_index(self):
+        return self.index is not None
+
+    def _query_users(self, view_name, keys):
+        self.user_queries.append(sorted(keys))
+        return [ Entry(username=name, groups=[ Entry(name=group) for group in self.users[name] ])
+            for name in keys if name in self.users ]
+
+class TestBulkChecker:
+    """
+    Test the bulk checker without a database.
+    """
+
+    def setup(self):
+        self.db = GrantDB({'g1': ['p1', 'p2'], 'g2': ['p3']})
+        self.adapter = Adapter({'u1': ['g1'], 'u2': ['g1', 'g2'], 'u3': []}, self.db)
+
+    def test_check(self):
+        pairs = [('u1', 'p1'), ('u1', 'p3'), ('u2', 'p3'), ('u3', 'p1'), ('nouser', 'p1')]
+        checker = BulkChecker(self.adapter, self.adapter, batch_size=10)
+        assert list(checker.check(pairs)) == [('u1', 'p1', True), ('u1', 'p3', False), ('u2', 'p3', True),
+            ('u3', 'p1', False), ('nouser', 'p1', False)]
+        assert len(self.adapter.user_queries) == 1
+        assert self.db.queries == [['g1', 'g2']]
+
+    def test_batches(self):
+        pairs = [ ('u%i' % (i % 3 + 1), 'p1') for i in range(7) ]
+        checker = BulkChecker(self.adapter, self.adapter, batch_size=3, max_groups=1)
+        results = list(checker.check(pairs))
+        assert [ allowed for user, perm, allowed in results ] == [True, True, False] * 2 + [True]
+        assert checker.metrics['batches'] == 3
+        assert len(self.adapter.user_queries) == 3
+        assert len(checker.group_perms) <= 2
+
+    def test_index(self):
+        self.adapter.index = AuthzIndex()
+        self.adapter.index.add_membership('u1', 'g2')
+        self.adapter.index.grant('g2', 'p3')
+        checker = BulkChecker(self.adapter, self.adapter)
+        assert list(checker.check([('u1', 'p3'), ('u2', 'p1')])) == [('u1', 'p3', True), ('u2', 'p1', True)]
+        assert self.adapter.user_queries == [['u2']]
+        assert checker.metrics['indexed'] == 1
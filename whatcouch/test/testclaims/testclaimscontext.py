@@ -0,0 +1,127 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+import time
+from whatcouch.claims import Claims, ClaimsContext, encode_claims, decode_claims
+
+class MemoryDB:
+    """
+    A database stand-in holding documents in a dict.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self.reads = 0
+
+    def all_docs(self, keys, include_docs):
+        self.reads += 1
+        return [ {'key': key, 'doc': dict(self.docs[key])} if key in self.docs else {'key': key, 'error': 'not_found'}
+            for key in keys ]
+
+    def bulk_save(self, docs):
+        for doc in docs:
+            self.docs[doc['_id']] = {'_id': doc['_id'], 'version': doc.version}
+        return [ {'id': doc['_id'], 'rev': '1'} for doc in docs ]
+
+class TestClaimsContext:
+    """
+    Test encoding, validating and binding claims.
+    """
+
+    def test_encode_decode(self):
+        """
+        Test that decode_claims() reverses encode_claims() for awkward names.
+        """
+        groups = [u'g1', u'with,comma', u'caf\xe9']
+        perms = {u'g1': [u'p1', u'p:2'], u'with,comma': [], u'caf\xe9': [u'p!3']}
+        claims = decode_claims(encode_claims(Claims(2, 100, groups, perms)))
+        assert claims.version == 2
+        assert claims.issued == 100
+        assert claims.groups == groups
+        assert claims.permissions == perms
+
+    def test_decode__noclaims(self):
+        """
+        Test decode_claims() for tokens without claims.
+        """
+        assert decode_claims(['other']) is None
+        assert decode_claims('') is None
+
+    def test_issue(self):
+        """
+        Test ClaimsContext.issue() replaces old claims and keeps other tokens.
+        """
+        context = ClaimsContext()
+        identity = {'tokens': ['other', 'wcg:stale']}
+        context.issue(identity, [u'g1'], {u'g1': [u'p1']})
+        claims = context.from_identity(identity)
+        assert 'other' in identity['tokens']
+        assert claims.groups == [u'g1']
+
+    def test_invalidate(self):
+        """
+        Test that bumping the version rejects claims.
+        """
+        context = ClaimsContext()
+        identity = {}
+        context.issue(identity, [u'g1'], {u'g1': []})
+        context.invalidate()
+        assert context.from_identity(identity) is None
+
+    def test_max_age(self):
+        """
+        Test that expired claims are rejected.
+        """
+        context = ClaimsContext(max_age=60)
+        assert context.is_valid(Claims(0, int(time.time()), [], {}))
+        assert not context.is_valid(Claims(0, int(time.time()) - 120, [], {}))
+
+    def test_membership_expiry(self):
+        """
+        Test that claims are rejected once a membership they cover expires.
+        """
+        context = ClaimsContext()
+        identity = {}
+        context.issue(identity, [u'g1'], {u'g1': []}, int(time.time()) + 60)
+        assert context.from_identity(identity).expires is not None
+        context.issue(identity, [u'g1'], {u'g1': []}, int(time.time()) - 1)
+        assert context.from_identity(identity) is None
+        assert decode_claims(['wcv:1:100']).expires is None
+
+    def test_bind(self):
+        """
+        Test reading groups and permissions from bound claims.
+        """
+        context = ClaimsContext()
+        context.bind('u1', Claims(0, int(time.time()), [u'g1'], {u'g1': [u'p1']}))
+        assert context.groups('u1') == [u'g1']
+        assert context.groups('u2') is None
+        assert context.permissions(u'g1') == [u'p1']
+        assert context.permissions(u'g2') is None
+        context.release()
+        assert context.groups('u1') is None
+
+    def test_shared_version(self):
+        """
+        Test that invalidating claims in one context rejects them in another
+        sharing its database once the check interval has passed.
+        """
+        db = MemoryDB()
+        first = ClaimsContext(db=db, check_interval=0)
+        second = ClaimsContext(db=db, check_interval=60)
+        identity = {}
+        second.issue(identity, [u'g1'], {u'g1': []})
+        assert second.from_identity(identity) is not None
+        first.invalidate()
+        assert first.current_version() == 1
+        assert second.from_identity(identity) is not None
+        second.checked = 0
+        assert second.from_identity(identity) is None
@@ -0,0 +1,97 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+from datetime import datetime
+from whatcouch.expiry import ExpirySweeper, format_expiry, expiry_time, is_expired, next_expiry, active_groups
+
+class Entry(object):
+    """
+    A group embedded in a user.
+    """
+
+    def __init__(self, name, expires=None):
+        self.name = name
+        if expires is not None:
+            self.expires = expires
+
+class ExpiringAdapter(object):
+    """
+    A group adapter stand-in holding memberships as (expiry, user, group)
+    tuples.  Removes at most limit due memberships per call, like the view.
+    """
+
+    edges = False
+
+    def __init__(self, memberships):
+        self.memberships = sorted(memberships)
+        self.calls = 0
+
+    def _remove_expired(self, current, limit):
+        self.calls += 1
+        due = [ m for m in self.memberships if m[0] <= current ][:limit]
+        for m in due:
+            self.memberships.remove(m)
+        return len(due), len(due)
+
+class TestExpiry:
+    """
+    Test the expiry helpers and the sweeper without a database.
+    """
+
+    def test_format_expiry(self):
+        assert format_expiry(datetime(2010, 5, 1, 12, 30, 5)) == '2010-05-01T12:30:05Z'
+        assert format_expiry(0) == '1970-01-01T00:00:00Z'
+        assert format_expiry('2010-05-01T12:30:05Z') == '2010-05-01T12:30:05Z'
+        assert expiry_time('1970-01-01T00:01:00Z') == 60
+        assert expiry_time(datetime(1970, 1, 1, 0, 1)) == 60
+
+    def test_is_expired(self):
+        assert is_expired(None) == False
+        assert is_expired('2010-05-01T12:30:05Z', '2010-05-01T12:30:05Z') == True
+        assert is_expired('2010-05-01T12:30:06Z', '2010-05-01T12:30:05Z') == False
+        assert is_expired('1970-01-01T00:00:00Z') == True
+
+    def test_is_expired__datetime(self):
+        # Expiries read back from the database are wrapped as datetimes.
+        assert is_expired(datetime(2010, 5, 1, 12, 30, 5), '2010-05-01T12:30:05Z') == True
+        assert is_expired(datetime(2010, 5, 1, 12, 30, 6), '2010-05-01T12:30:05Z') == False
+        groups = [Entry('g1', datetime(2010, 1, 1)), Entry('g2', datetime(2011, 1, 1))]
+        assert active_groups(groups, 'name', 'expires', '2010-06-01T00:00:00Z') == ['g2']
+
+    def test_next_expiry(self):
+        expiries = [None, '2010-01-01T00:00:00Z', datetime(2012, 1, 1), '2011-01-01T00:00:00Z']
+        assert next_expiry(expiries, '2010-06-01T00:00:00Z') == '2011-01-01T00:00:00Z'
+        assert next_expiry(expiries, '2013-01-01T00:00:00Z') is None
+        assert next_expiry([]) is None
+
+    def test_active_groups(self):
+        groups = [Entry('g1'), Entry('g2', '2010-01-01T00:00:00Z'), Entry('g3', '2011-01-01T00:00:00Z')]
+        assert active_groups(groups, 'name', 'expires', '2010-06-01T00:00:00Z') == ['g1', 'g3']
+
+    def test_sweep_batches(self):
+        memberships = [ ('2010-01-01T00:00:%02iZ' % i, 'u%i' % i, 'g1') for i in range(5) ]
+        memberships.append(('2011-01-01T00:00:00Z', 'u9', 'g1'))
+        adapter = ExpiringAdapter(memberships)
+        sweeper = ExpirySweeper(adapter, batch_size=2, start=False)
+        assert sweeper.sweep('2010-06-01T00:00:00Z') == 5
+        assert adapter.calls == 3
+        assert [ m[1] for m in adapter.memberships ] == ['u9']
+        assert sweeper.metrics['removed'] == 5
+        assert sweeper.sweep('2010-06-01T00:00:00Z') == 0
+
+    def test_edges_unsupported(self):
+        adapter = ExpiringAdapter([])
+        adapter.edges = True
+        try:
+            ExpirySweeper(adapter, start=False)
+            assert False
+        except ValueError:
+            pass
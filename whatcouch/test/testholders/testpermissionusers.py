@@ -0,0 +1,76 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+from whatcouch.holders import iter_permission_users, page_permission_users
+
+class ViewDB(object):
+    """
+    A database stand-in answering the group by permission view and the user
+    names by group view from lists of grants and memberships.
+    """
+
+    def __init__(self, grants, memberships):
+        self.grants = grants
+        self.memberships = sorted(memberships)
+        self.requests = 0
+
+    def view(self, view_name, **params):
+        self.requests += 1
+        if view_name == 'grants':
+            return [ {'key': perm, 'value': {'name': group}} for perm, group in self.grants if perm in params['keys'] ]
+        group = params['endkey'][0]
+        start = params['startkey'][1:] and params['startkey'][1]
+        rows = [ {'key': [g, user], 'id': user, 'value': expires} for g, user, expires in self.memberships
+            if g == group and user >= start ]
+        return rows[:params['limit']]
+
+class Adapter(object):
+    """
+    An adapter stand-in with embedded memberships and grants.
+    """
+
+    edges = False
+    tries = None
+    tree = None
+    user_shards = None
+    User = None
+    Group = None
+    group_by_perm_view = 'grants'
+    group_name_key = 'name'
+    t11 = {'user_names_by_group_view': 'users'}
+
+    def __init__(self, db):
+        self.db = db
+
+class TestPermissionUsers:
+    """
+    Test the permission holder queries without a database.
+    """
+
+    def setup(self):
+        self.db = ViewDB([('p1', 'g1'), ('p1', 'g2'), ('p2', 'g2'), ('a.*', 'g3')],
+            [('g1', 'u1', None), ('g1', 'u3', None), ('g1', 'u4', '1970-01-01T00:00:00Z'),
+             ('g2', 'u2', None), ('g2', 'u3', None), ('g2', 'u5', None), ('g3', 'u6', None)])
+        self.adapter = Adapter(self.db)
+
+    def test_iter(self):
+        assert list(iter_permission_users(self.adapter, self.adapter, 'p1')) == ['u1', 'u2', 'u3', 'u5']
+        assert list(iter_permission_users(self.adapter, self.adapter, 'p1', 'u3', page_size=1)) == ['u3', 'u5']
+        assert list(iter_permission_users(self.adapter, self.adapter, 'p3')) == []
+
+    def test_page(self):
+        assert page_permission_users(self.adapter, self.adapter, 'p1', limit=2) == (['u1', 'u2'], 'u3')
+        assert page_permission_users(self.adapter, self.adapter, 'p1', 'u3', limit=2) == (['u3', 'u5'], None)
+
+    def test_wildcards(self):
+        assert list(iter_permission_users(self.adapter, self.adapter, 'a.b')) == []
+        self.adapter.tries = {}
+        assert list(iter_permission_users(self.adapter, self.adapter, 'a.b')) == ['u6']
@@ -0,0 +1,114 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+from whatcouch.index import AuthzIndex
+
+class TestAuthzIndex:
+    """
+    Test the bitset authorization index without a database.
+    """
+
+    def setup(self):
+        """
+        Build an index with two users, two groups and two permissions.
+        """
+        self.index = AuthzIndex()
+        self.index.grant('g1', 'p1')
+        self.index.grant('g1', 'p2')
+        self.index.grant('g2', 'p1')
+        self.index.add_membership('u1', 'g1')
+        self.index.add_membership('u1', 'g2')
+        self.index.add_membership('u2', 'g2')
+        self.index.add_user('u3')
+
+    def test_groups_of(self):
+        assert sorted(self.index.groups_of('u1')) == ['g1', 'g2']
+        assert self.index.groups_of('u3') == []
+        assert self.index.groups_of('nouser') is None
+
+    def test_permissions_of(self):
+        assert sorted(self.index.permissions_of('g1')) == ['p1', 'p2']
+        assert self.index.permissions_of('nogroup') is None
+
+    def test_groups_with(self):
+        assert sorted(self.index.groups_with('p1')) == ['g1', 'g2']
+
+    def test_is_member(self):
+        assert self.index.is_member('u2', 'g2') == True
+        assert self.index.is_member('u2', 'g1') == False
+        assert self.index.is_member('u2', 'nogroup') == False
+        assert self.index.is_member('nouser', 'g1') is None
+
+    def test_has_permission(self):
+        assert self.index.has_permission('u1', 'p2') == True
+        assert self.index.has_permission('u2', 'p2') == False
+        assert self.index.has_permission('u3', 'p1') == False
+        assert self.index.has_permission('u1', 'noperm') == False
+
+    def test_remove_membership(self):
+        self.index.remove_membership('u1', 'g1')
+        assert self.index.has_permission('u1', 'p2') == False
+        assert self.index.has_permission('u1', 'p1') == True
+
+    def test_revoke(self):
+        self.index.revoke('g2', 'p1')
+        assert self.index.has_permission('u2', 'p1') == False
+        assert self.index.groups_with('p1') == ['g1']
+
+    def test_remove_group(self):
+        self.index.remove_group('g1')
+        assert self.index.groups_of('u1') == ['g2']
+        assert self.index.groups_with('p2') == []
+        self.index.add_group('g3')
+        assert self.index.is_member('u1', 'g3') == False
+
+    def test_remove_permission(self):
+        self.index.remove_permission('p1')
+        assert self.index.permissions_of('g2') == []
+        assert self.index.has_permission('u2', 'p1') == False
+
+    def test_nested(self):
+        self.index.add_group('g3')
+        self.index.grant('g3', 'p3')
+        self.index.set_ancestors('g2', ['g3'])
+        assert sorted(self.index.groups_of('u2')) == ['g2', 'g3']
+        assert self.index.is_member('u2', 'g3') == True
+        assert self.index.has_permission('u2', 'p3') == True
+        assert sorted(self.index.permissions_of('g2')) == ['p1', 'p3']
+        assert self.index.is_granted('g2', 'p3') == True
+        self.index.set_ancestors('g2', [])
+        assert self.index.has_permission('u2', 'p3') == False
+        self.index.set_ancestors('g2', ['g3'])
+        self.index.remove_group('g3')
+        assert self.index.groups_of('u2') == ['g2']
+
+    def test_expiry(self):
+        self.index.add_membership('u2', 'g1', '1970-01-01T00:00:00Z')
+        assert self.index.is_member('u2', 'g1') == False
+        assert self.index.has_permission('u2', 'p2') == False
+        assert self.index.groups_of('u2') == ['g2']
+        self.index.add_membership('u2', 'g1')
+        assert self.index.has_permission('u2', 'p2') == True
+        self.index.add_membership('u2', 'g1', '9999-01-01T00:00:00Z')
+        assert self.index.is_member('u2', 'g1') == True
+
+    def test_nested_closure(self):
+        self.index.grant('g3', 'p3')
+        self.index.set_ancestors('g1', ['g3'])
+        self.index.remove_membership('u1', 'g2')
+        def decode(mask):
+            raise AssertionError('checks must not decode bitsets')
+        self.index.groups.decode = decode
+        assert self.index.has_permission('u1', 'p3') == True
+        assert self.index.is_member('u1', 'g3') == True
+        assert self.index.is_member('u1', 'g2') == False
+        assert self.index.is_granted('g1', 'p3') == True
+        assert self.index.has_permission('u2', 'p3') == False
@@ -0,0 +1,100 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+import os, time, shutil, tempfile
+from whatcouch.index import AuthzIndex
+from whatcouch.expiry import format_expiry
+from whatcouch.snapshot import Snapshot, write_snapshot
+
+class TestSnapshot:
+    """
+    Test writing and reading authorization snapshots.
+    """
+
+    @staticmethod
+    def setup_class():
+        """
+        Write a snapshot of a small index to a temporary directory.
+        """
+        TestSnapshot.dir = tempfile.mkdtemp()
+        TestSnapshot.path = os.path.join(TestSnapshot.dir, 'authz.snap')
+        index = AuthzIndex()
+        index.grant(u'g1', u'p1')
+        index.grant(u'g1', u'p2')
+        index.grant(u'caf\xe9', u'p1')
+        index.add_group(u'g3')
+        index.add_membership(u'u1', u'g1')
+        index.add_membership(u'u2', u'caf\xe9')
+        index.add_user(u'u3')
+        write_snapshot(TestSnapshot.path, index, generation=1)
+        TestSnapshot.snapshot = Snapshot(TestSnapshot.path, check_interval=0)
+
+    @staticmethod
+    def teardown_class():
+        """
+        Remove the temporary directory.
+        """
+        shutil.rmtree(TestSnapshot.dir)
+
+    def test_generation(self):
+        assert self.snapshot.generation == 1
+
+    def test_groups_of(self):
+        assert self.snapshot.groups_of(u'u1') == [u'g1']
+        assert self.snapshot.groups_of(u'u2') == [u'caf\xe9']
+        assert self.snapshot.groups_of(u'u3') == []
+        assert self.snapshot.groups_of(u'nouser') is None
+
+    def test_permissions_of(self):
+        assert sorted(self.snapshot.permissions_of(u'g1')) == [u'p1', u'p2']
+        assert self.snapshot.permissions_of(u'g3') == []
+        assert self.snapshot.permissions_of(u'nogroup') is None
+
+    def test_groups_with(self):
+        assert sorted(self.snapshot.groups_with(u'p1')) == sorted([u'g1', u'caf\xe9'])
+
+    def test_checks(self):
+        assert self.snapshot.is_member(u'u1', u'g1') == True
+        assert self.snapshot.is_member(u'u1', u'g3') == False
+        assert self.snapshot.is_granted(u'g1', u'p2') == True
+        assert self.snapshot.is_granted(u'caf\xe9', u'p2') == False
+        assert self.snapshot.has_permission(u'u2', u'p1') == True
+        assert self.snapshot.has_permission(u'u2', u'p2') == False
+        assert self.snapshot.has_permission(u'nouser', u'p1') is None
+
+    def test_refresh(self):
+        path = os.path.join(self.dir, 'refresh.snap')
+        write_snapshot(path, AuthzIndex(), generation=1)
+        snapshot = Snapshot(path, check_interval=0)
+        index = AuthzIndex()
+        index.add_membership(u'u4', u'g4')
+        write_snapshot(path, index, generation=2)
+        assert snapshot.refresh(force=True)
+        assert snapshot.generation == 2
+        assert snapshot.groups_of(u'u4') == [u'g4']
+        assert snapshot.groups_of(u'u1') is None
+        assert self.snapshot.groups_of(u'u1') == [u'g1']
+
+    def test_membership_expiry(self):
+        path = os.path.join(self.dir, 'expiry.snap')
+        index = AuthzIndex()
+        index.grant(u'g1', u'p1')
+        index.add_membership(u'u1', u'g1', format_expiry(time.time() + 2))
+        index.add_membership(u'u2', u'g1', format_expiry(time.time() + 3600))
+        write_snapshot(path, index, generation=1)
+        snapshot = Snapshot(path, check_interval=0)
+        assert snapshot.groups_of(u'u1') == [u'g1']
+        assert snapshot.has_permission(u'u2', u'p1') == True
+        time.sleep(2)
+        assert snapshot.groups_of(u'u1') is None
+        assert snapshot.is_member(u'u1', u'g1') is None
+        assert snapshot.has_permission(u'u1', u'p1') is None
+        assert snapshot.is_member(u'u2', u'g1') == True
@@ -10,7 +10,8 @@
 # fitness for a particular purpose are disclaimed.
 
 import bcrypt
-from whatcouch.model import hashpw, hashcmp, init_model, User, Group, Permission
+from whatcouch.model import hashpw, hashcmp, init_model, User, Group, Permission, \
+    set_work_factor, calibrate, get_rounds, needs_rehash, set_default_scheme, identify, benchmark, HashScheme
 from whatcouch.test import Config
 
 class TestModelFunctions:
@@ -51,6 +52,103 @@ class TestModelFunctions:
         hash = hashpw(Config.password)
         assert hashcmp(hash, Config.password)
 
+    def test_work_factor(self):
+        """
+        Test that hashpw() uses the configured work factor.
+        """
+        set_work_factor(4)
+        try:
+            hash = hashpw(Config.password)
+            assert get_rounds(hash) == 4
+            assert not needs_rehash(hash)
+            set_work_factor(5)
+            assert needs_rehash(hash)
+            assert hashcmp(hash, Config.password)
+        finally:
+            set_work_factor(None)
+
+    def test_explicit_rounds(self):
+        """
+        Test that an explicit cost overrides the work factor without changing it.
+        """
+        hash = hashpw(Config.password, rounds=4)
+        assert get_rounds(hash) == 4
+        assert not needs_rehash(hash, rounds=4)
+        assert needs_rehash(hash, rounds=5)
+        assert needs_rehash(hash, scheme='pbkdf2-sha256')
+        user = User.create('roundsuser', Config.password, rounds=5)
+        assert get_rounds(user.password) == 5
+        assert not user.needs_rehash(rounds=5)
+        assert user.needs_rehash(rounds=4)
+
+    def test_calibrate(self):
+        """
+        Test the calibrate function stays within its bounds.
+        """
+        assert calibrate(target=0, minimum=4, maximum=6) == 4
+        assert calibrate(target=60, minimum=4, maximum=6) == 6
+
+    def test_pbkdf2(self):
+        """
+        Test PBKDF2 hashes are generated and detected by prefix.
+        """
+        set_work_factor(1000, 'pbkdf2-sha256')
+        try:
+            hash = hashpw(Config.password, scheme='pbkdf2-sha256')
+            assert hash.startswith('$pbkdf2-sha256$1000$')
+            assert identify(hash).name == 'pbkdf2-sha256'
+            assert get_rounds(hash) == 1000
+            assert hashcmp(hash, Config.password)
+            assert not hashcmp(hash, 'wrong')
+        finally:
+            set_work_factor(None, 'pbkdf2-sha256')
+
+    def test_default_scheme(self):
+        """
+        Test that hashes of other schemes need rehashing and still verify.
+        """
+        bcrypt_hash = hashpw(Config.password)
+        set_default_scheme('pbkdf2-sha256')
+        try:
+            assert needs_rehash(bcrypt_hash)
+            assert hashcmp(bcrypt_hash, Config.password)
+            user = User.create('schemeuser', Config.password)
+            assert user.password.startswith('$pbkdf2-sha256$')
+            assert user.authenticate(Config.password)
+            assert not user.needs_rehash()
+        finally:
+            set_default_scheme('bcrypt')
+
+    def test_hashcmp__unknown(self):
+        """
+        Test that hashes of unknown schemes never match.
+        """
+        assert not hashcmp('plaintext', 'plaintext')
+        assert not hashcmp(None, Config.password)
+
+    def test_hash_scheme__abstract(self):
+        """
+        Test that the scheme base class cannot be used without the hashing methods.
+        """
+        class Incomplete(HashScheme):
+            def hash(self, password, rounds=None):
+                return password
+        for cls in (HashScheme, Incomplete):
+            try:
+                cls()
+            except TypeError:
+                pass
+            else:
+                assert False
+
+    def test_benchmark(self):
+        """
+        Test the benchmark reports a rate for each scheme and cost.
+        """
+        results = benchmark(['pbkdf2-sha256'], [1000, 2000], duration=0)
+        assert [ r[:2] for r in results ] == [('pbkdf2-sha256', 1000), ('pbkdf2-sha256', 2000)]
+        assert all([ r[2] > 0 for r in results ])
+
     def test_init_model(self):
         """
         Test the init_model function.
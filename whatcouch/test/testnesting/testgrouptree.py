@@ -0,0 +1,121 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+from whatcouch.nesting import GroupTree
+
+class Doc(dict):
+    """
+    A minimal document class wrapping a dict with attribute access.
+    """
+
+    def __getattr__(self, name):
+        return self[name]
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    @classmethod
+    def wrap(cls, data):
+        return cls(data)
+
+def group(name, parents=(), perms=()):
+    """
+    Build a group document.
+    """
+    return Doc(_id=name, doc_type='Group', name=name, parents=list(parents), ancestors=[],
+        permissions=[ Doc(name=perm) for perm in perms ], inherited_permissions=[])
+
+class MemoryDB:
+    """
+    A database stand-in answering the views used by GroupTree from a dict of
+    group documents.
+    """
+
+    def __init__(self, groups):
+        self.docs = dict([ (doc.name, doc) for doc in groups ])
+        self.queries = 0
+
+    def view(self, name, schema=None, keys=None):
+        self.queries += 1
+        if name.endswith('group_list'):
+            return [ Doc(self.docs[key]) for key in keys if key in self.docs ]
+        if name.endswith('group_by_ancestor'):
+            return [ Doc(doc) for doc in self.docs.values() if set(doc.ancestors) & set(keys) ]
+        if name.endswith('group_ancestors'):
+            return [ {'key': key, 'value': self.docs[key].ancestors} for key in keys if key in self.docs ]
+        raise ValueError(name)
+
+    def bulk_save(self, docs):
+        for doc in docs:
+            self.docs[doc.name] = doc
+        return [ {'id': doc['_id'], 'rev': '2'} for doc in docs ]
+
+class TestGroupTree:
+    """
+    Test maintaining the precomputed group hierarchy.
+    """
+
+    def setup(self):
+        """
+        Build the chain staff <- editors <- juniors and an unrelated group.
+        """
+        self.db = MemoryDB([group('staff', perms=['read']), group('editors', perms=['edit']),
+            group('juniors'), group('other', perms=['admin'])])
+        t11 = {'group_class': Doc, 'group_name_key': 'name', 'group_perms_key': 'permissions',
+            'group_parents_key': 'parents', 'group_ancestors_key': 'ancestors',
+            'group_inherited_key': 'inherited_permissions', 'perm_name_key': 'name',
+            'group_list_view': 'whatcouch/group_list', 'group_ancestors_view': 'whatcouch/group_ancestors',
+            'group_by_ancestor_view': 'whatcouch/group_by_ancestor'}
+        self.tree = GroupTree(t11, self.db, backoff=0)
+        self.tree.update(['editors'], {'editors': ['staff']})
+        self.tree.update(['juniors'], {'juniors': ['editors']})
+
+    def perms(self, name):
+        return sorted([ perm.name for perm in self.db.docs[name].inherited_permissions ])
+
+    def test_closure(self):
+        assert self.db.docs['juniors'].ancestors == ['editors', 'staff']
+        assert self.perms('juniors') == ['edit', 'read']
+        assert self.perms('editors') == ['read']
+
+    def test_expand(self):
+        assert self.tree.expand(['juniors', 'other']) == ['juniors', 'other', 'editors', 'staff']
+
+    def test_reparent(self):
+        changed = self.tree.update(['editors'], {'editors': ['other']})
+        assert changed == {'editors': ['other'], 'juniors': ['editors', 'other']}
+        assert self.perms('juniors') == ['admin', 'edit']
+
+    def test_permission_change(self):
+        self.db.docs['staff'].permissions.append(Doc(name='write'))
+        self.tree.update(['staff'])
+        assert self.perms('juniors') == ['edit', 'read', 'write']
+
+    def test_cycle(self):
+        try:
+            self.tree.update(['staff'], {'staff': ['juniors']})
+        except ValueError:
+            pass
+        else:
+            assert False
+        assert self.db.docs['staff'].parents == []
+
+    def test_delete(self):
+        del self.db.docs['editors']
+        changed = self.tree.update(['editors'], deleted=['editors'])
+        assert changed == {'juniors': []}
+        assert self.db.docs['juniors'].parents == []
+        assert self.perms('juniors') == []
+
+    def test_constant_queries(self):
+        self.db.queries = 0
+        self.tree.update(['staff'])
+        assert self.db.queries <= 4
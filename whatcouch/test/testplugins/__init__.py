@@ -10,17 +10,22 @@
 # fitness for a particular purpose are disclaimed.
 
 from whatcouch.test import Config
-from whatcouch.model import init_model, User
+from whatcouch.model import init_model, User, Group, Permission
 from whatcouch.quickstart import default_translations
 
 def setup_package():
     User.set_db(Config.db)
+    Group.set_db(Config.db)
+    Permission.set_db(Config.db)
     Config.environ = {}
     Config.t11 = default_translations
     Config.t11['user_class'] = User
+    Config.t11['group_class'] = Group
+    Config.t11['perm_class'] = Permission
 
 def teardown_package():
     User.set_db(None)
+    Group.set_db(None)
+    Permission.set_db(None)
     del Config.environ
     del Config.t11
-
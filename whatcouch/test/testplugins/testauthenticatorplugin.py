@@ -10,8 +10,11 @@
 # fitness for a particular purpose are disclaimed.
 
 from whatcouch.test import Config
-from whatcouch.model import User
+from whatcouch.model import User, set_work_factor, get_rounds, hashpw
 from whatcouch.plugins import AuthenticatorPlugin
+from whatcouch.writebehind import WriteBehindQueue
+from whatcouch.throttle import LoginThrottle
+from whatcouch.audit import AuditLog
 
 class TestAuthenticatorPlugin:
 
@@ -51,3 +54,101 @@ class TestAuthenticatorPlugin:
         username = Config.plugin.authenticate(Config.environ, identity)
         assert username is None
 
+    def test_authenticate__rehash(self):
+        set_work_factor(4)
+        user = User.create('rehash', Config.password)
+        user.save()
+        queue = WriteBehindQueue(User, interval=3600)
+        try:
+            set_work_factor(5)
+            plugin = AuthenticatorPlugin(Config.t11, write_behind=queue)
+            identity = {'login': 'rehash', 'password': Config.password}
+            assert plugin.authenticate(Config.environ, identity) == 'rehash'
+            assert get_rounds(User.get(user._id).password) == 4
+            queue.flush()
+            user = User.get(user._id)
+            assert get_rounds(user.password) == 5
+            assert user.authenticate(Config.password)
+        finally:
+            set_work_factor(None)
+            queue.close()
+            user.delete()
+
+    def test_partial_translations(self):
+        t11 = {'user_class': User, 'user_name_key': 'username', 'user_list_view': 'whatcouch/user_list',
+            'user_auth_method': 'authenticate'}
+        plugin = AuthenticatorPlugin(t11)
+        assert plugin.user_rehash_method == 'needs_rehash'
+        assert plugin.user_login_keys == ('email',)
+        identity = {'login': Config.username, 'password': Config.password}
+        assert plugin.authenticate(Config.environ, identity) == Config.username
+
+    def test_authenticate__rehash_options(self):
+        user = User.create('rehashopts', Config.password, rounds=4)
+        user.save()
+        queue = WriteBehindQueue(User, interval=3600)
+        try:
+            plugin = AuthenticatorPlugin(Config.t11, write_behind=queue, password_rounds=5)
+            identity = {'login': 'rehashopts', 'password': Config.password}
+            assert plugin.authenticate(Config.environ, identity) == 'rehashopts'
+            queue.flush()
+            assert get_rounds(User.get(user._id).password) == 5
+            assert get_rounds(hashpw(Config.password)) != 5
+        finally:
+            queue.close()
+            user.delete()
+
+    def test_authenticate__record_login(self):
+        queue = WriteBehindQueue(User, interval=3600)
+        try:
+            plugin = AuthenticatorPlugin(Config.t11, write_behind=queue)
+            identity = {'login': Config.username, 'password': Config.password}
+            count = User.get(Config.user._id).login_count
+            assert plugin.authenticate(Config.environ, identity) == Config.username
+            assert plugin.authenticate(Config.environ, identity) == Config.username
+            assert queue.size == 1
+            queue.flush()
+            user = User.get(Config.user._id)
+            assert user.login_count == count + 2
+            assert user.last_login is not None
+        finally:
+            queue.close()
+
+    def test_authenticate__throttled(self):
+        throttle = LoginThrottle(max_attempts=2)
+        plugin = AuthenticatorPlugin(Config.t11, throttle=throttle)
+        environ = {'REMOTE_ADDR': '10.0.0.1'}
+        for i in range(2):
+            assert plugin.authenticate(environ, {'login': Config.username, 'password': 'nopass'}) is None
+        def fail(name):
+            raise AssertionError('throttled login was looked up')
+        plugin._get_user = fail
+        identity = {'login': Config.username, 'password': Config.password}
+        assert plugin.authenticate(environ, identity) is None
+
+    def test_authenticate__audit(self):
+        class Events(list):
+            def bulk_save(self, docs):
+                self.extend(docs)
+        events = Events()
+        audit = AuditLog(events)
+        plugin = AuthenticatorPlugin(Config.t11, audit=audit)
+        plugin.authenticate(Config.environ, {'login': Config.username, 'password': Config.password})
+        plugin.authenticate(Config.environ, {'login': Config.username, 'password': 'nopass'})
+        plugin.authenticate(Config.environ, {'login': 'nobody', 'password': 'nopass'})
+        audit.close()
+        assert [ event['result'] for event in events ] == ['success', 'bad_password', 'unknown_user']
+
+    def test_authenticate__normalized(self):
+        user = User.create('MixedCase', Config.password)
+        user.email = 'Mixed@Example.com'
+        user.save()
+        try:
+            plugin = AuthenticatorPlugin(Config.t11, normalize_logins=True)
+            for login in ('MixedCase', 'mixedcase', ' MIXEDCASE ', 'mixed@example.com'):
+                identity = {'login': login, 'password': Config.password}
+                assert plugin.authenticate(Config.environ, identity) == 'MixedCase'
+            identity = {'login': 'mixedcase', 'password': Config.password}
+            assert Config.plugin.authenticate(Config.environ, identity) is None
+        finally:
+            user.delete()
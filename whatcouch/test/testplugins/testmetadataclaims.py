@@ -0,0 +1,73 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+from whatcouch.test import Config
+from whatcouch.model import User, Group, Permission
+from whatcouch.plugins import MetadataPlugin
+from whatcouch.adapters import GroupAdapter, PermissionAdapter
+from whatcouch.claims import ClaimsContext
+
+class TestMetadataClaims:
+    """
+    Test the metadata plugin and adapters with cookie claims enabled.
+    """
+
+    @staticmethod
+    def setup_class():
+        Config.perm = Permission(name='claimperm')
+        Config.perm.save()
+        Config.group = Group(name='claimgroup')
+        Config.group.permissions.append(Config.perm)
+        Config.group.save()
+        Config.user = User.create('claimuser', 'password')
+        Config.user.groups.append(Config.group)
+        Config.user.save()
+        Config.claims = ClaimsContext()
+        Config.plugin = MetadataPlugin(Config.t11, claims=Config.claims)
+
+    @staticmethod
+    def teardown_class():
+        Config.user.delete()
+        Config.group.delete()
+        Config.perm.delete()
+        del Config.user
+        del Config.group
+        del Config.perm
+        del Config.claims
+        del Config.plugin
+
+    def test_add_metadata__issue(self):
+        identity = {'repoze.who.userid': 'claimuser'}
+        Config.plugin.add_metadata(Config.environ, identity)
+        assert 'user' in identity
+        claims = Config.claims.from_identity(identity)
+        assert claims.groups == [u'claimgroup']
+        assert claims.permissions == {u'claimgroup': [u'claimperm']}
+
+    def test_add_metadata__cached(self):
+        identity = {'repoze.who.userid': 'claimuser'}
+        Config.plugin.add_metadata(Config.environ, identity)
+        identity = {'repoze.who.userid': 'claimuser', 'tokens': identity['tokens']}
+        Config.plugin.add_metadata(Config.environ, identity)
+        assert 'user' not in identity
+        assert GroupAdapter(Config.t11, claims=Config.claims)._find_sections(
+            {'repoze.what.userid': 'claimuser'}) == [u'claimgroup']
+        assert PermissionAdapter(Config.t11, claims=Config.claims)._find_sections(
+            u'claimgroup') == [u'claimperm']
+
+    def test_add_metadata__invalidated(self):
+        identity = {'repoze.who.userid': 'claimuser'}
+        Config.plugin.add_metadata(Config.environ, identity)
+        Config.claims.invalidate()
+        identity = {'repoze.who.userid': 'claimuser', 'tokens': identity['tokens']}
+        Config.plugin.add_metadata(Config.environ, identity)
+        assert 'user' in identity
+        assert Config.claims.from_identity(identity).version == Config.claims.version
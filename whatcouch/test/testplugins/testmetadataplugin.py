@@ -11,7 +11,7 @@
 
 from whatcouch.test import Config
 from whatcouch.model import User
-from whatcouch.plugins import MetadataPlugin
+from whatcouch.plugins import MetadataPlugin, LazyUser
 
 class TestMetadataPlugin:
 
@@ -44,3 +44,16 @@ class TestMetadataPlugin:
         Config.plugin.add_metadata(Config.environ, identity)
         assert 'user' not in identity
 
+    def test_add_metadata__lazy(self):
+        environ = {}
+        identity = {'repoze.who.userid': Config.username}
+        MetadataPlugin(Config.t11, lazy=True).add_metadata(environ, identity)
+        assert isinstance(identity['user'], LazyUser)
+        assert 'whatcouch.users' not in environ
+        assert identity['user'].username == Config.username
+        assert Config.username in environ['whatcouch.users']
+
+    def test_add_metadata__lazybadid(self):
+        identity = {'repoze.who.userid': 'nobody'}
+        MetadataPlugin(Config.t11, lazy=True).add_metadata({}, identity)
+        assert not identity['user']
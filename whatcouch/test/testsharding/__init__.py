@@ -0,0 +1,51 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+Tests partitioning users across several databases.
+"""
+
+from couchdbkit.loaders import FileSystemDocsLoader
+from whatcouch.test import Config
+from whatcouch.model import User, Group, Permission
+from whatcouch.quickstart import default_translations
+from whatcouch.sharding import UserShards
+
+def setup_package():
+    """
+    Create the shard databases and load the design documents into them.
+    Groups and permissions use the primary test database.
+    """
+    Config.shard_names = ['%s_shard%i' % (Config.db_name, i) for i in range(3)]
+    loader = FileSystemDocsLoader(Config.design_path)
+    databases = []
+    for name in Config.shard_names:
+        db = Config.server.create_db(name)
+        loader.sync(db)
+        databases.append(db)
+    Config.shards = UserShards(databases)
+    Group.set_db(Config.db)
+    Permission.set_db(Config.db)
+    Config.t11 = default_translations
+    Config.t11['user_class'] = User
+    Config.t11['group_class'] = Group
+    Config.t11['perm_class'] = Permission
+
+def teardown_package():
+    """
+    Delete the shard databases.
+    """
+    for name in Config.shard_names:
+        Config.server.delete_db(name)
+    Group.set_db(None)
+    Permission.set_db(None)
+    del Config.shard_names
+    del Config.shards
+    del Config.t11
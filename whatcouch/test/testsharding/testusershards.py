@@ -0,0 +1,100 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+from whatcouch.test import Config
+from whatcouch.adapters import GroupAdapter
+from whatcouch.plugins import AuthenticatorPlugin
+from whatcouch.model import User, Group
+from whatcouch.sharding import shard_index
+
+class TestUserShards:
+    """
+    Test the group adapter and authenticator with users spread across shards.
+    """
+
+    @staticmethod
+    def setup_class():
+        """
+        Create a group and enough users that every shard holds at least one.
+        """
+        Config.adapter = GroupAdapter(Config.t11, user_shards=Config.shards)
+        Config.group = Group(name='sharded')
+        Config.group.save()
+        Config.usernames = [u'user%i' % i for i in range(12)]
+        users = []
+        for name in Config.usernames:
+            user = User.create(name, 'password')
+            user.groups.append(Config.group)
+            users.append(user)
+        Config.shards.bulk_save(users, lambda user: user.username)
+
+    @staticmethod
+    def teardown_class():
+        """
+        Delete the group and the adapter.  The users go with the shards.
+        """
+        Config.group.delete()
+        del Config.group
+        del Config.usernames
+        del Config.adapter
+
+    def test_shard_index(self):
+        """
+        Test that shard placement is stable and within range.
+        """
+        index = shard_index(u'user1', len(Config.shards))
+        assert 0 <= index < len(Config.shards)
+        assert index == shard_index('user1', len(Config.shards))
+
+    def test_placement(self):
+        """
+        Test that each user is stored only in its own shard.
+        """
+        for name in Config.usernames:
+            for db in Config.shards.databases:
+                found = len(db.view(Config.t11['user_list_view'], key=name)) > 0
+                assert found == (db is Config.shards.get_db(name))
+
+    def test_get_user(self):
+        """
+        Test GroupAdapter._get_user() routes to the right shard.
+        """
+        for name in Config.usernames:
+            user = Config.adapter._get_user(name)
+            assert user is not None
+            assert user.username == name
+
+    def test_get_section_items(self):
+        """
+        Test GroupAdapter._get_section_items() merges users from all shards.
+        """
+        items = Config.adapter._get_section_items('sharded')
+        assert sorted(items) == sorted(Config.usernames)
+
+    def test_exclude_include_items(self):
+        """
+        Test removing and re-adding users saves them back to their shards.
+        """
+        names = Config.usernames[:4]
+        Config.adapter._exclude_items('sharded', names)
+        for name in names:
+            assert not Config.adapter._item_is_included('sharded', name)
+        Config.adapter._include_items('sharded', names)
+        for name in names:
+            assert Config.adapter._item_is_included('sharded', name)
+
+    def test_authenticate(self):
+        """
+        Test AuthenticatorPlugin.authenticate() against a sharded user.
+        """
+        plugin = AuthenticatorPlugin(Config.t11, user_shards=Config.shards)
+        identity = {'login': Config.usernames[5], 'password': 'password'}
+        assert plugin.authenticate({}, identity) == Config.usernames[5]
@@ -0,0 +1,76 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+import time
+from whatcouch.throttle import LoginThrottle, SlidingWindow
+
+class TestLoginThrottle:
+    """
+    Test the login throttle without a database.
+    """
+
+    def setup(self):
+        self.throttle = LoginThrottle(max_attempts=3, window=3600, address_attempts=5, max_keys=4)
+        self.environ = {'REMOTE_ADDR': '10.0.0.1'}
+
+    def fail(self, login, count, environ=None):
+        for i in range(count):
+            self.throttle.failure(environ or self.environ, login)
+
+    def test_login_limit(self):
+        """
+        Test a login is rejected once it reaches its limit.
+        """
+        self.fail('u1', 2)
+        assert self.throttle.allow(self.environ, 'u1')
+        self.fail('u1', 1)
+        assert not self.throttle.allow(self.environ, 'u1')
+        assert not self.throttle.allow({'REMOTE_ADDR': '10.0.0.2'}, 'u1')
+
+    def test_address_limit(self):
+        """
+        Test an address is rejected once it reaches its limit across logins.
+        """
+        for login in ('u1', 'u2', 'u3', 'u4', 'u5'):
+            self.fail(login, 1)
+        assert not self.throttle.allow(self.environ, 'u6')
+        assert self.throttle.allow({'REMOTE_ADDR': '10.0.0.2'}, 'u6')
+
+    def test_success(self):
+        """
+        Test a successful login clears the count of its login name.
+        """
+        self.fail('u1', 3)
+        self.throttle.success(self.environ, 'u1')
+        assert self.throttle.allow(self.environ, 'u1')
+
+    def test_max_keys(self):
+        """
+        Test the least recently used counters are dropped.
+        """
+        self.fail('u1', 3, {})
+        for login in ('u2', 'u3', 'u4', 'u5'):
+            self.fail(login, 1, {})
+        assert len(self.throttle.counters) == 4
+        assert self.throttle.allow({}, 'u1')
+
+    def test_sliding_window(self):
+        """
+        Test the previous window is weighted by its overlap.
+        """
+        counter = SlidingWindow(10, 4, 0)
+        counter.roll(11)
+        assert counter.estimate(11.25) == 3
+        assert counter.estimate(12.5) == 0
+        counter.merge(12, 2, 7)
+        assert (counter.period, counter.current, counter.previous) == (12, 2, 7)
+        counter.merge(11, 9, 0)
+        assert (counter.period, counter.current, counter.previous) == (12, 2, 9)
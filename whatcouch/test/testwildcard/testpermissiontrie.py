@@ -0,0 +1,86 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+from whatcouch.wildcard import PermissionTrie, TrieCache, covering_grants, wildcard_prefix
+
+class TestPermissionTrie:
+    """
+    Test matching permission names against exact and wildcard grants.
+    """
+
+    def setup(self):
+        self.trie = PermissionTrie(['billing.*', 'reports.monthly.read', 'admin'])
+
+    def test_exact(self):
+        assert self.trie.matches('reports.monthly.read')
+        assert self.trie.matches('admin')
+        assert not self.trie.matches('reports.monthly')
+        assert not self.trie.matches('reports.monthly.read.all')
+        assert not self.trie.matches('admin.users')
+
+    def test_wildcard(self):
+        assert self.trie.matches('billing.invoices.read')
+        assert self.trie.matches('billing.refunds')
+        assert not self.trie.matches('billing')
+        assert not self.trie.matches('billingx.refunds')
+
+    def test_global_wildcard(self):
+        assert PermissionTrie(['*']).matches('anything.at.all')
+        assert not PermissionTrie([]).matches('anything')
+
+    def test_literal_inner_wildcard(self):
+        trie = PermissionTrie(['billing.*.read'])
+        assert trie.matches('billing.*.read')
+        assert not trie.matches('billing.invoices.read')
+
+    def test_covering_grants(self):
+        grants = covering_grants('billing.invoices.read')
+        assert grants == ['billing.invoices.read', '*', 'billing.*', 'billing.invoices.*']
+        for name in grants:
+            assert PermissionTrie([name]).matches('billing.invoices.read')
+
+    def test_wildcard_prefix(self):
+        assert wildcard_prefix('billing.*') == 'billing.'
+        assert wildcard_prefix('*') == ''
+        assert wildcard_prefix('billing.*.read') is None
+        assert wildcard_prefix('billing') is None
+
+class TestTrieCache:
+    """
+    Test caching tries per group.
+    """
+
+    def test_cache(self):
+        cache = TrieCache()
+        assert cache.get('g1') is None
+        trie = cache.put('g1', ['p.*'])
+        assert cache.get('g1') is trie
+        cache.invalidate()
+        assert cache.get('g1') is None
+
+    def test_stale_generation(self):
+        cache = TrieCache()
+        generation = cache.generation
+        cache.invalidate()
+        assert cache.put('g1', ['p1'], generation).matches('p1')
+        assert cache.get('g1') is None
+
+    def test_expiry(self):
+        cache = TrieCache(max_age=-1)
+        cache.put('g1', ['p1'])
+        assert cache.get('g1') is None
+
+    def test_bounded(self):
+        cache = TrieCache(max_entries=2)
+        for name in ('g1', 'g2', 'g3'):
+            cache.put(name, [])
+        assert cache.get('g1') is None
+        assert cache.get('g3') is not None
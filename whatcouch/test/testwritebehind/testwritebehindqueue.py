@@ -0,0 +1,163 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+
+from whatcouch.writebehind import WriteBehindQueue
+
+class Doc(dict):
+    """
+    A minimal document class wrapping a dict.
+    """
+
+    @classmethod
+    def wrap(cls, data):
+        return cls(data)
+
+class MemoryDB:
+    """
+    A database stand-in holding documents in a dict.  Saves of the documents
+    listed in conflicts fail once with a conflict.
+    """
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.conflicts = set()
+        self.saves = 0
+        self.down = False
+        self.fail_reads = None
+
+    def all_docs(self, keys, include_docs):
+        if self.fail_reads is not None:
+            self.fail_reads -= 1
+            if self.fail_reads < 0:
+                raise IOError('database unavailable')
+        if self.down:
+            raise IOError('database unavailable')
+        return [ {'key': key, 'doc': dict(self.docs[key])} if key in self.docs else {'key': key, 'error': 'not_found'}
+            for key in keys ]
+
+    def bulk_save(self, docs):
+        self.saves += 1
+        results = []
+        for doc in docs:
+            if doc['_id'] in self.conflicts:
+                self.conflicts.discard(doc['_id'])
+                self.docs[doc['_id']]['count'] += 10
+                results.append({'id': doc['_id'], 'error': 'conflict'})
+            else:
+                self.docs[doc['_id']] = dict(doc)
+                results.append({'id': doc['_id'], 'rev': '2'})
+        return results
+
+class Increment(object):
+    """
+    A mergeable update incrementing a counter.
+    """
+
+    def __init__(self, count=1):
+        self.count = count
+
+    def __call__(self, doc):
+        doc['count'] = doc.get('count', 0) + self.count
+        return True
+
+    def merge(self, update):
+        return Increment(self.count + update.count)
+
+class TestWriteBehindQueue:
+    """
+    Test the write-behind queue without a database.
+    """
+
+    def setup(self):
+        self.db = MemoryDB({'d1': {'_id': 'd1', 'count': 0}})
+        self.queue = WriteBehindQueue(Doc, interval=3600, max_pending=2)
+
+    def teardown(self):
+        self.queue.close()
+
+    def test_merge(self):
+        """
+        Test that mergeable updates to a document are combined.
+        """
+        for i in range(5):
+            assert self.queue.submit(self.db, 'd1', Increment())
+        assert self.queue.size == 1
+        assert self.queue.metrics['merged'] == 4
+        self.queue.flush()
+        assert self.db.docs['d1']['count'] == 5
+        assert self.db.saves == 1
+
+    def test_bounded(self):
+        """
+        Test that updates submitted to a full queue are dropped.
+        """
+        assert self.queue.submit(self.db, 'd1', lambda doc: False)
+        assert self.queue.submit(self.db, 'd2', lambda doc: False)
+        assert not self.queue.submit(self.db, 'd3', lambda doc: False)
+        assert self.queue.metrics['dropped'] == 1
+        assert 'd3' not in self.queue.pending[self.db]
+
+    def test_conflict_retry(self):
+        """
+        Test that conflicting documents are fetched and updated again.
+        """
+        self.db.conflicts.add('d1')
+        self.queue.submit(self.db, 'd1', Increment())
+        self.queue.flush()
+        assert self.db.docs['d1']['count'] == 11
+        assert self.queue.metrics['conflicts'] == 1
+        assert self.queue.metrics['saved'] == 1
+
+    def test_requeue(self):
+        """
+        Test that updates are kept when the database cannot be reached.
+        """
+        self.db.down = True
+        self.queue.submit(self.db, 'd1', Increment())
+        self.queue.flush()
+        assert self.queue.size == 1
+        self.db.down = False
+        self.queue.flush()
+        assert self.db.docs['d1']['count'] == 1
+
+    def test_requeue__remainder(self):
+        """
+        Test that only updates which were not saved are queued again.
+        """
+        self.db.docs['d2'] = {'_id': 'd2', 'count': 0}
+        self.db.conflicts.add('d2')
+        self.db.fail_reads = 1
+        self.queue.submit(self.db, 'd1', Increment())
+        self.queue.submit(self.db, 'd2', Increment())
+        self.queue.flush()
+        assert self.db.docs['d1']['count'] == 1
+        assert self.queue.pending[self.db].keys() == ['d2']
+        self.db.fail_reads = None
+        self.queue.flush()
+        assert self.db.docs['d1']['count'] == 1
+        assert self.db.docs['d2']['count'] == 11
+
+    def test_submit__closed(self):
+        """
+        Test that updates submitted after closing are rejected.
+        """
+        self.queue.close()
+        assert not self.queue.submit(self.db, 'd1', Increment())
+        assert self.queue.size == 0
+
+    def test_close(self):
+        """
+        Test that closing the queue saves pending updates.
+        """
+        self.queue.submit(self.db, 'd1', Increment())
+        self.queue.close()
+        assert self.db.docs['d1']['count'] == 1
+        assert not self.queue.thread.is_alive()
@@ -0,0 +1,211 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+This module provides failed login throttling for the authenticator plugin.
+
+Failed logins are counted per login name and per client address.  Once either
+count reaches its limit within the window, further attempts are rejected
+before the user is looked up or a password is hashed.  A successful login
+clears the local count of its login name but not of its address.
+
+Counts are kept with sliding window counters: the number of failures in the
+current fixed window plus the failures of the previous window weighted by how
+much of it still overlaps the sliding window.  Each counter is three integers
+and at most max_keys counters are kept, the least recently used being dropped
+first.
+
+When given a database, failures are also written to AttemptCounter documents
+through a write-behind queue.  Applying a queued failure reads the counts
+written by every node, so each node learns the shared count of a key whenever
+it flushes a failure for that key.
+"""
+
+import time, threading
+from collections import OrderedDict
+from couchdbkit import Document, StringProperty, IntegerProperty
+from whatcouch.writebehind import WriteBehindQueue
+
+__all__ = ['LoginThrottle', 'AttemptCounter']
+
+class AttemptCounter(Document):
+    """
+    Persisted failure counts of one throttling key.
+    """
+    key = StringProperty()
+    period = IntegerProperty(default=0)
+    current = IntegerProperty(default=0)
+    previous = IntegerProperty(default=0)
+
+class SlidingWindow(object):
+    """
+    Failure counts of the current and previous fixed windows.
+    """
+    __slots__ = ('period', 'current', 'previous')
+
+    def __init__(self, period=0, current=0, previous=0):
+        """
+        Constructor.
+        :param period: The number of the current fixed window.
+        :param current: The failures in the current window.
+        :param previous: The failures in the previous window.
+        """
+        self.period = period
+        self.current = current
+        self.previous = previous
+
+    def roll(self, period):
+        """
+        Advance to a later fixed window.
+        :param period: The number of the window to advance to.
+        """
+        if period <= self.period:
+            return
+        if period == self.period + 1:
+            self.previous = self.current
+        else:
+            self.previous = 0
+        self.current = 0
+        self.period = period
+
+    def merge(self, period, current, previous):
+        """
+        Merge counts read from another source, keeping the higher of each.
+        """
+        other = SlidingWindow(period, current, previous)
+        other.roll(self.period)
+        self.roll(other.period)
+        self.current = max(self.current, other.current)
+        self.previous = max(self.previous, other.previous)
+
+    def estimate(self, position):
+        """
+        Estimate the failures within the sliding window.
+        :param position: The current time divided by the window length.
+        :return: The weighted failure count.
+        """
+        period = int(position)
+        self.roll(period)
+        return self.previous * (1 - (position - period)) + self.current
+
+class LoginThrottle(object):
+    """
+    Sliding window throttle for failed logins keyed by login name and client address.
+    """
+
+    def __init__(self, max_attempts=5, window=300, address_attempts=50, max_keys=100000, db=None,
+            write_behind=None):
+        """
+        Constructor.
+        :param max_attempts: The failures per login name allowed within the window.
+        :param window: The length of the sliding window in seconds.
+        :param address_attempts: The failures per client address allowed within the window.  None disables address throttling.
+        :param max_keys: The maximum number of counters kept in memory.
+        :param db: Optional database to share counters across nodes through.
+        :param write_behind: The WriteBehindQueue used to persist counters.  Created when db is given.
+        """
+        self.max_attempts = max_attempts
+        self.window = window
+        self.address_attempts = address_attempts
+        self.max_keys = max_keys
+        self.db = db
+        if db is not None and write_behind is None:
+            write_behind = WriteBehindQueue(AttemptCounter, create_missing=True)
+        self.write_behind = write_behind
+        self.lock = threading.Lock()
+        self.counters = OrderedDict()
+
+    def _keys(self, environ, login):
+        """
+        Get the throttling keys of an attempt with their limits.
+        """
+        keys = [ (u'login:%s' % login, self.max_attempts) ]
+        address = environ.get('REMOTE_ADDR')
+        if address is not None and self.address_attempts is not None:
+            keys.append((u'addr:%s' % address, self.address_attempts))
+        return keys
+
+    def _counter(self, key):
+        """
+        Get the counter of a key, creating it and evicting the least recently
+        used counter if necessary.  Must be called with the lock held.
+        """
+        counter = self.counters.pop(key, None)
+        if counter is None:
+            counter = SlidingWindow()
+            while len(self.counters) >= self.max_keys:
+                self.counters.popitem(last=False)
+        self.counters[key] = counter
+        return counter
+
+    def allow(self, environ, login):
+        """
+        Check if a login attempt may proceed.
+        :param environ: WSGI environment.
+        :param login: The login name of the attempt.
+        :return: True if the attempt is under every limit, False otherwise.
+        """
+        position = time.time() / self.window
+        with self.lock:
+            for key, limit in self._keys(environ, login):
+                counter = self.counters.get(key)
+                if counter is not None and counter.estimate(position) >= limit:
+                    return False
+        return True
+
+    def failure(self, environ, login):
+        """
+        Record a failed login attempt.
+        :param environ: WSGI environment.
+        :param login: The login name of the attempt.
+        """
+        period = int(time.time() // self.window)
+        with self.lock:
+            for key, limit in self._keys(environ, login):
+                counter = self._counter(key)
+                counter.roll(period)
+                counter.current += 1
+        if self.write_behind is not None:
+            for key, limit in self._keys(environ, login):
+                self.write_behind.submit(self.db, u'throttle:%s' % key, self._persist(key, period))
+
+    def success(self, environ, login):
+        """
+        Record a successful login, clearing the count of its login name.
+        :param environ: WSGI environment.
+        :param login: The login name of the attempt.
+        """
+        with self.lock:
+            self.counters.pop(u'login:%s' % login, None)
+
+    def _persist(self, key, period):
+        """
+        Create a write-behind update adding one failure to the stored counter
+        of a key and merging the stored counts into the local counter.
+        """
+        def update(doc):
+            stored = SlidingWindow(doc.period, doc.current, doc.previous)
+            stored.roll(period)
+            if stored.period == period:
+                stored.current += 1
+            doc.key = key
+            doc.period, doc.current, doc.previous = stored.period, stored.current, stored.previous
+            with self.lock:
+                if key in self.counters:
+                    self.counters[key].merge(stored.period, stored.current, stored.previous)
+            return True
+        return update
+
+    def close(self):
+        """
+        Flush persisted counters and stop the write-behind queue.
+        """
+        if self.write_behind is not None:
+            self.write_behind.close()
@@ -0,0 +1,106 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+This module provides the default translations.  These are substituted for
+missing values in the translations dict passed to the quickstart function,
+the adapters and the plugins, so translations written before a key was added
+keep working.
+
+The following table documents the supported key values in the translations
+dict and each key's purpose:
+
+user_class:             The class for User documents.  Not used by quickstart.
+user_name_key:          User attribute where the login name is stored.
+user_password_key:      User attribute where the password hash is stored.
+user_groups_key:        User attribute where the groups collection is stored.
+user_list_view:         The name of a view that maps user names to user documents.
+user_by_group_view:     The name of a view that maps group names to user documents.  Reduces with _count.
+user_names_view:        The name of a view that emits user names with null values.
+user_names_by_group_view: The name of a view that maps [group name, user name] keys to membership expiry timestamps, from User and Membership documents.
+user_login_view:        The name of a view that maps lower-cased user names and alternate login keys to user documents.
+group_expiry_key:       Attribute of the groups embedded in a user where the membership expiry timestamp is stored.
+membership_expiry_view: The name of a view that maps membership expiry timestamps to group names, one row per expiring membership.
+user_login_keys:        User attributes holding alternate login identifiers, such as an email address.  The login view must emit them lower-cased.
+user_auth_method:       Method on the User document which should be used to authenticate the user.  Takes the password as an argument.
+user_rehash_method:     Method on the User document which returns True if the password hash is outdated.  Takes optional scheme and rounds keyword arguments.
+user_password_method:   Method on the User document which sets the password.  Takes the password as an argument and optional scheme and rounds keyword arguments.
+user_login_method:      Method on the User document which records logins.  Takes the datetime of the latest login and the number of logins.
+group_class:            The class for Group documents.  Not used by quickstart.
+group_name_key:         Group attribute where the group name is stored.
+group_perms_key:        Group attribute where the permissions collection is stored.
+group_list_view:        The name of a view that maps group names to group documents.
+group_by_perm_view:     The name of a view that maps permission names to group documents.  Reduces with _count.
+group_names_view:       The name of a view that emits group names with null values.
+group_parents_key:      Group attribute where the names of the parent groups are stored.
+group_ancestors_key:    Group attribute where the precomputed names of all ancestor groups are stored.
+group_inherited_key:    Group attribute where the precomputed permissions inherited from ancestors are stored.
+group_ancestors_view:   The name of a view that maps group names to lists of their ancestor group names.
+group_by_ancestor_view: The name of a view that maps group names to the documents of the groups nested in them at any depth.
+perm_class:             The class for Permission documents.  Not used by quickstart.
+perm_name_key:          Permission attribute where the permission name is stored.
+perm_list_view:         The name of a view that maps permission names to permission documents.
+perm_by_group_view:     The name of a view that maps group names to permission documents, including inherited permissions.
+perm_names_view:        The name of a view that emits permission names with null values.
+membership_by_user_view:  The name of a view that maps user names to group names from Membership documents.
+membership_by_group_view: The name of a view that maps group names to user names from Membership documents.  Reduces with _count.
+grant_by_group_view:    The name of a view that maps group names to permission names from Grant documents.
+grant_by_perm_view:     The name of a view that maps permission names to group names from Grant documents.  Reduces with _count.
+"""
+
+__all__ = ['default_translations', 'merge_translations']
+
+default_translations = {
+    'user_class': None,
+    'user_name_key': 'username',
+    'user_password_key': 'password',
+    'user_groups_key': 'groups',
+    'user_list_view': 'whatcouch/user_list',
+    'user_by_group_view': 'whatcouch/user_by_group',
+    'user_names_view': 'whatcouch/user_names',
+    'user_login_view': 'whatcouch/user_by_login',
+    'user_names_by_group_view': 'whatcouch/user_names_by_group',
+    'user_login_keys': ('email',),
+    'group_expiry_key': 'expires',
+    'membership_expiry_view': 'whatcouch/membership_by_expiry',
+    'user_auth_method': 'authenticate',
+    'user_rehash_method': 'needs_rehash',
+    'user_password_method': 'set_password',
+    'user_login_method': 'record_login',
+    'group_class': None,    
+    'group_name_key': 'name',
+    'group_perms_key': 'permissions',
+    'group_list_view': 'whatcouch/group_list',
+    'group_by_perm_view': 'whatcouch/group_by_permission',
+    'group_names_view': 'whatcouch/group_names',
+    'group_parents_key': 'parents',
+    'group_ancestors_key': 'ancestors',
+    'group_inherited_key': 'inherited_permissions',
+    'group_ancestors_view': 'whatcouch/group_ancestors',
+    'group_by_ancestor_view': 'whatcouch/group_by_ancestor',
+    'perm_class': None,
+    'perm_name_key': 'name',
+    'perm_list_view': 'whatcouch/permission_list',
+    'perm_by_group_view': 'whatcouch/permission_by_group',
+    'perm_names_view': 'whatcouch/permission_names',
+    'membership_by_user_view': 'whatcouch/membership_by_user',
+    'membership_by_group_view': 'whatcouch/membership_by_group',
+    'grant_by_group_view': 'whatcouch/grant_by_group',
+    'grant_by_perm_view': 'whatcouch/grant_by_permission'}
+
+def merge_translations(translations):
+    """
+    Fill in the keys missing from a translations dict with their defaults.
+    :param translations: The translations to use.
+    :return: A new dict holding the default translations updated with the given ones.
+    """
+    t11 = dict(default_translations)
+    t11.update(translations)
+    return t11
@@ -0,0 +1,376 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+This module provides a unit of work over the group and permission adapters.
+
+A unit of work records the sections to create and the memberships and grants
+to change instead of applying each call to the database.  Changes to the same
+link are coalesced, the last one winning, and on commit every affected
+document is read with one multi-key query per document type and written with
+one bulk request per document type:
+
+    with UnitOfWork(group_adapter, perm_adapter) as work:
+        work.create_group(u'editors')
+        work.include_users(u'editors', [u'alice', u'bob'])
+        work.grant(u'edit', [u'editors'])
+
+Permissions are written first, then groups and finally users, so new sections
+can be used in the same unit.  Documents which could not be written, usually
+because of a conflict with a concurrent change, are reported per document ID
+in the dict returned by commit() and kept in the errors attribute.  When the
+block raises nothing is written.
+"""
+
+from whatcouch.binding import get_db, view, bulk_write
+from whatcouch.edges import membership_id, grant_id, membership_doc, grant_doc, insert_edges, delete_edges
+
+__all__ = ['UnitOfWork']
+
+class UnitOfWork(object):
+    """
+    Collects section and membership changes and commits them in bulk.
+    """
+
+    def __init__(self, group_adapter, perm_adapter=None):
+        """
+        Constructor.
+        :param group_adapter: The GroupAdapter to write users and groups through.
+        :param perm_adapter: Optional PermissionAdapter to write permissions and grants through.
+        """
+        self.group_adapter = group_adapter
+        self.perm_adapter = perm_adapter
+        self.errors = {}
+        self._reset()
+
+    def _reset(self):
+        """
+        Forget all pending changes.
+        """
+        self.new_groups = []
+        self.new_perms = []
+        self.memberships = {}
+        self.grants = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self._reset()
+        return False
+
+    def create_group(self, name):
+        """
+        Create a group on commit.
+        :param name: The name of the new group.
+        """
+        if name not in self.new_groups:
+            self.new_groups.append(name)
+
+    def create_permission(self, name):
+        """
+        Create a permission on commit.
+        :param name: The name of the new permission.
+        """
+        self._require_perm_adapter()
+        if name not in self.new_perms:
+            self.new_perms.append(name)
+
+    def include_users(self, group, users):
+        """
+        Add users to a group on commit.
+        :param group: The name of the group.
+        :param users: The names of the users to add.
+        """
+        for user in users:
+            self.memberships.setdefault(user, {})[group] = True
+
+    def exclude_users(self, group, users):
+        """
+        Remove users from a group on commit.
+        :param group: The name of the group.
+        :param users: The names of the users to remove.
+        """
+        for user in users:
+            self.memberships.setdefault(user, {})[group] = False
+
+    def grant(self, perm, groups):
+        """
+        Add groups to a permission on commit.
+        :param perm: The name of the permission.
+        :param groups: The names of the groups to add.
+        """
+        self._require_perm_adapter()
+        for group in groups:
+            self.grants.setdefault(group, {})[perm] = True
+
+    def revoke(self, perm, groups):
+        """
+        Remove groups from a permission on commit.
+        :param perm: The name of the permission.
+        :param groups: The names of the groups to remove.
+        """
+        self._require_perm_adapter()
+        for group in groups:
+            self.grants.setdefault(group, {})[perm] = False
+
+    def commit(self):
+        """
+        Write all pending changes.
+        :return: A dict mapping the ID of each document which could not be written to its error.
+        """
+        self.errors = {}
+        memberships, grants = bool(self.memberships), bool(self.grants)
+        try:
+            perms = self._commit_permissions()
+            groups = self._commit_groups(perms)
+            self._commit_memberships(groups)
+        finally:
+            self._reset()
+            if memberships:
+                self.group_adapter._invalidate_claims()
+            if grants:
+                self.perm_adapter._invalidate_claims()
+        return self.errors
+
+    def _require_perm_adapter(self):
+        """
+        Check that permission changes can be written.
+        """
+        if self.perm_adapter is None:
+            raise ValueError('permission changes require a PermissionAdapter')
+
+    def _record_errors(self, results):
+        """
+        Remember the documents which could not be written.
+        :param results: The result rows with errors.
+        :return: The set of IDs which failed.
+        """
+        for result in results:
+            self.errors[result.get('id')] = result.get('error')
+        return set([ result.get('id') for result in results ])
+
+    def _new_docs(self, cls, name_key, names):
+        """
+        Build new section documents.
+        """
+        docs = {}
+        for name in names:
+            doc = cls()
+            setattr(doc, name_key, name)
+            docs[name] = doc
+        return docs
+
+    def _commit_permissions(self):
+        """
+        Create the new permissions.
+        :return: A dict mapping the names of the created permissions to their documents.
+        """
+        if not self.new_perms:
+            return {}
+        adapter = self.perm_adapter
+        perms = self._new_docs(adapter.Permission, adapter.perm_name_key, self.new_perms)
+        failed = self._record_errors(bulk_write(get_db(adapter.Permission, adapter.db), perms.values()))
+        for name, perm in perms.items():
+            if perm._id in failed:
+                del perms[name]
+            else:
+                adapter._update_index('add_permission', name)
+        return perms
+
+    def _commit_groups(self, new_perms):
+        """
+        Create the new groups and apply grants to embedded permissions.  New
+        and changed groups are written with one bulk request.
+        :param new_perms: The permissions created in this unit by name.
+        :return: A dict mapping group names to the group documents read or created.
+        """
+        adapter = self.group_adapter
+        groups = self._new_docs(adapter.Group, adapter.group_name_key, self.new_groups)
+        new_names = set(groups)
+        changed = set(new_names)
+        grants = {}
+        perm_adapter = self.perm_adapter
+        if self.grants and not perm_adapter.edges:
+            existing = [ name for name in self.grants if name not in groups ]
+            if existing:
+                for group in view(adapter.Group, adapter.db, adapter.group_list_view, keys=existing):
+                    groups[getattr(group, adapter.group_name_key)] = group
+            wanted = set()
+            for ops in self.grants.itervalues():
+                wanted |= set([ perm for perm, add in ops.iteritems() if add ])
+            perms = dict(new_perms)
+            missing = [ name for name in wanted if name not in perms ]
+            if missing:
+                for perm in view(perm_adapter.Permission, perm_adapter.db, perm_adapter.perm_list_view, keys=missing):
+                    perms[getattr(perm, perm_adapter.perm_name_key)] = perm
+            for name, ops in self.grants.iteritems():
+                if name not in groups:
+                    continue
+                grants[name] = self._apply(getattr(groups[name], perm_adapter.group_perms_key),
+                    perm_adapter.perm_name_key, ops, perms)
+                if grants[name][0] or grants[name][1]:
+                    changed.add(name)
+        docs = [ groups[name] for name in changed ]
+        failed = self._record_errors(bulk_write(get_db(adapter.Group, adapter.db), docs))
+        for name in changed:
+            if groups[name]._id in failed:
+                del groups[name]
+                continue
+            if name in new_names:
+                adapter._update_index('add_group', name)
+            added, removed = grants.get(name, ((), ()))
+            for perm in added:
+                perm_adapter._update_index('grant', name, perm)
+            for perm in removed:
+                perm_adapter._update_index('revoke', name, perm)
+        if self.grants and perm_adapter.edges:
+            self._commit_grant_edges(groups, new_perms)
+        elif self.grants:
+            perm_adapter._refresh_inherited([ name for name in grants if name in groups and
+                (grants[name][0] or grants[name][1]) ])
+        return groups
+
+    def _apply(self, embedded, name_key, ops, docs):
+        """
+        Apply coalesced link changes to a list of embedded documents.
+        :param embedded: The embedded list to change in place.
+        :param name_key: The attribute holding the names of the embedded documents.
+        :param ops: A dict mapping names to True to add or False to remove.
+        :param docs: The documents which may be added, by name.
+        :return: A tuple of the lists of names added and removed.
+        """
+        current = set([ getattr(doc, name_key) for doc in embedded ])
+        added = [ name for name, add in ops.iteritems() if add and name not in current and name in docs ]
+        removed = [ name for name, add in ops.iteritems() if not add and name in current ]
+        for i in range(len(embedded)-1, -1, -1):
+            if getattr(embedded[i], name_key) in removed:
+                del embedded[i]
+        for name in added:
+            embedded.append(docs[name])
+        return added, removed
+
+    def _commit_grant_edges(self, groups, new_perms):
+        """
+        Apply grants as Grant documents.
+        """
+        adapter = self.perm_adapter
+        db = adapter._edge_db()
+        known = set(groups) | set(adapter._existing_groups([ name for name in self.grants if name not in groups ]))
+        wanted = set()
+        for ops in self.grants.itervalues():
+            wanted |= set(ops)
+        perms = set(new_perms)
+        missing = [ name for name in wanted if name not in perms ]
+        if missing:
+            perms |= set([ row['key'] for row in get_db(adapter.Permission, adapter.db).view(adapter.perm_names_view,
+                keys=missing) ])
+        insert = []
+        remove = []
+        updates = []
+        for group, ops in self.grants.iteritems():
+            if group not in known:
+                continue
+            for perm, add in ops.iteritems():
+                if add and perm in perms:
+                    insert.append(grant_doc(group, perm))
+                    updates.append((grant_id(group, perm), 'grant', group, perm))
+                elif not add:
+                    remove.append(grant_id(group, perm))
+                    updates.append((grant_id(group, perm), 'revoke', group, perm))
+        self._write_edges(adapter, db, insert, remove, updates)
+
+    def _write_edges(self, adapter, db, insert, remove, updates):
+        """
+        Insert and delete edge documents, then apply index updates for the
+        edges which were written.  Edges which could not be written are
+        recorded as errors.
+        :param adapter: The adapter whose index to update.
+        :param db: The database holding the edges.
+        :param insert: The edge documents to insert.
+        :param remove: The IDs of the edges to delete.
+        :param updates: A list of (edge ID, index method, first name, second name) tuples.
+        """
+        errors = []
+        written = set(insert_edges(db, insert, False, errors)) | set(delete_edges(db, remove, errors))
+        self._record_errors(errors)
+        for doc_id, method, first, second in updates:
+            if doc_id in written:
+                adapter._update_index(method, first, second)
+
+    def _commit_memberships(self, groups):
+        """
+        Apply membership changes.  Changed users are written with one bulk
+        request, routed to their shards if the users are sharded.
+        :param groups: The group documents read or created in this unit by name.
+        """
+        if not self.memberships:
+            return
+        adapter = self.group_adapter
+        if adapter.edges:
+            self._commit_membership_edges(groups)
+            return
+        wanted = set()
+        for ops in self.memberships.itervalues():
+            wanted |= set([ group for group, add in ops.iteritems() if add ])
+        missing = [ name for name in wanted if name not in groups ]
+        if missing:
+            for group in view(adapter.Group, adapter.db, adapter.group_list_view, keys=missing):
+                groups[getattr(group, adapter.group_name_key)] = group
+        users = adapter._query_users(adapter.user_list_view, keys=self.memberships.keys())
+        changes = {}
+        save_users = []
+        for user in users:
+            name = getattr(user, adapter.user_name_key)
+            changes[name] = self._apply(getattr(user, adapter.user_groups_key), adapter.group_name_key,
+                self.memberships[name], groups)
+            if changes[name][0] or changes[name][1]:
+                save_users.append(user)
+        failed = self._record_errors(adapter._save_users(save_users))
+        for user in save_users:
+            if user._id in failed:
+                continue
+            name = getattr(user, adapter.user_name_key)
+            for group in changes[name][0]:
+                adapter._update_index('add_membership', name, group)
+            for group in changes[name][1]:
+                adapter._update_index('remove_membership', name, group)
+
+    def _commit_membership_edges(self, groups):
+        """
+        Apply membership changes as Membership documents.
+        """
+        adapter = self.group_adapter
+        db = adapter._edge_db()
+        users = set(adapter._existing_users(self.memberships.keys()))
+        wanted = set()
+        for ops in self.memberships.itervalues():
+            wanted |= set(ops)
+        known = set(groups)
+        missing = [ name for name in wanted if name not in known ]
+        if missing:
+            known |= set([ row['key'] for row in db.view(adapter.group_names_view, keys=missing) ])
+        insert = []
+        remove = []
+        updates = []
+        for user, ops in self.memberships.iteritems():
+            if user not in users:
+                continue
+            for group, add in ops.iteritems():
+                if add and group in known:
+                    insert.append(membership_doc(user, group))
+                    updates.append((membership_id(user, group), 'add_membership', user, group))
+                elif not add:
+                    remove.append(membership_id(user, group))
+                    updates.append((membership_id(user, group), 'remove_membership', user, group))
+        self._write_edges(adapter, db, insert, remove, updates)
@@ -0,0 +1,159 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+This module provides hierarchical permission names with wildcard grants.
+
+Permission names are split into segments on dots, as in
+'billing.invoices.read'.  A granted name whose last segment is '*' grants
+every permission below its prefix, so 'billing.*' grants
+'billing.invoices.read' and 'billing.refunds' but not 'billing' itself.  A
+grant of '*' alone grants every permission.  A '*' anywhere but the last
+segment has no special meaning.
+
+The names granted to a group are stored in a PermissionTrie with one node per
+segment.  Checking a name walks one node per segment of the name, so the cost
+depends on the depth of the name and not on the number of grants.  Tries are
+kept per group in a TrieCache by the permission adapter.
+
+repoze.what's permission predicates look names up in the lists returned by
+the permission adapter, so the adapter also expands each wildcard grant into
+the names of the existing permissions below its prefix.
+"""
+
+import time, threading
+from collections import OrderedDict
+
+__all__ = ['PermissionTrie', 'TrieCache', 'covering_grants', 'wildcard_prefix']
+
+SEPARATOR = '.'
+WILDCARD = '*'
+END = None
+
+def covering_grants(name):
+    """
+    Get the granted names which grant a permission: the name itself and the
+    wildcard of each of its proper prefixes.
+    :param name: The permission name.
+    :return: A list of granted names.
+    """
+    segments = name.split(SEPARATOR)
+    return [name] + [ SEPARATOR.join(segments[:i] + [WILDCARD]) for i in range(len(segments)) ]
+
+def wildcard_prefix(name):
+    """
+    Get the prefix of the permission names granted by a wildcard grant.
+    :param name: The granted name.
+    :return: The prefix, which is empty for a grant of '*', or None if the name is not a wildcard grant.
+    """
+    if name == WILDCARD:
+        return ''
+    if name.endswith(SEPARATOR + WILDCARD):
+        return name[:-len(WILDCARD)]
+    return None
+
+class PermissionTrie(object):
+    """
+    A prefix trie of granted permission names.
+    """
+
+    def __init__(self, names=()):
+        """
+        Constructor.
+        :param names: The granted permission names.
+        """
+        self.root = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        """
+        Add a granted permission name.
+        :param name: The name, which may end with a wildcard segment.
+        """
+        node = self.root
+        for segment in name.split(SEPARATOR):
+            node = node.setdefault(segment, {})
+        node[END] = True
+
+    def matches(self, name):
+        """
+        Check if a permission name is granted, exactly or by a wildcard.
+        :param name: The permission name to check.
+        :return: True if the name is granted, False otherwise.
+        """
+        node = self.root
+        for segment in name.split(SEPARATOR):
+            wildcard = node.get(WILDCARD)
+            if wildcard is not None and END in wildcard:
+                return True
+            node = node.get(segment)
+            if node is None:
+                return False
+        return END in node
+
+class TrieCache(object):
+    """
+    A bounded cache of permission tries by group name.  Entries expire after
+    a maximum age so that changes made by other processes are picked up.
+    """
+
+    def __init__(self, max_age=60, max_entries=10000):
+        """
+        Constructor.
+        :param max_age: The number of seconds a trie is used before it is built again.  None keeps tries until invalidated.
+        :param max_entries: The maximum number of groups to keep tries for.
+        """
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.generation = 0
+
+    def get(self, group):
+        """
+        Get the cached trie of a group.
+        :param group: The name of the group.
+        :return: The trie or None if it is not cached or has expired.
+        """
+        with self.lock:
+            entry = self.entries.get(group)
+            if entry is None:
+                return None
+            if self.max_age is not None and time.time() - entry[0] > self.max_age:
+                del self.entries[group]
+                return None
+            return entry[1]
+
+    def put(self, group, names, generation=None):
+        """
+        Build and cache the trie of a group.
+        :param group: The name of the group.
+        :param names: The permission names granted to the group.
+        :param generation: The generation the names were read at.  The trie is not cached if the cache was invalidated since.
+        :return: The new trie.
+        """
+        trie = PermissionTrie(names)
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return trie
+            self.entries.pop(group, None)
+            self.entries[group] = (time.time(), trie)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return trie
+
+    def invalidate(self):
+        """
+        Discard every cached trie.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
@@ -0,0 +1,225 @@
+# Copyright (c) 2010, Ryan Bourgeois <bluedragonx@gmail.com>
+# All rights reserved.
+#
+# This software is licensed under a modified BSD license as defined in the
+# provided license file at the root of this project.  You may modify and/or
+# distribute in accordance with those terms.
+#
+# This software is provided "as is" and any express or implied warranties,
+# including, but not limited to, the implied warranties of merchantability and
+# fitness for a particular purpose are disclaimed.
+"""
+This module provides a write-behind queue for document updates which need not
+be saved before a request completes, such as upgrading a password hash or
+recording a login.
+
+Updates are callables which modify a document in place and return True if they
+changed it.  They are queued per document and applied by a background thread
+which periodically fetches the current revision of every pending document in
+one request, applies the queued updates in order and saves the changed
+documents with a single bulk request per database.
+
+An update may provide a merge(update) method returning a single update with
+the effect of both, or None if they cannot be combined.  A new update is
+merged into the last pending update of its document, so frequent updates such
+as login counters take constant memory per document.
+
+The number of pending updates is bounded.  Updates submitted to a full queue
+are dropped and counted.  Documents whose save conflicts with a concurrent
+write are fetched again and their updates reapplied, up to a number of
+retries.  If the database fails during a flush, the updates of the documents
+not saved yet are queued again.  Pending updates are flushed when the queue
+is closed, which happens at interpreter exit if it has not been done before.
+Updates submitted after the queue is closed are rejected.
+"""
+
+import atexit, logging, threading
+from whatcouch.binding import bulk_write
+
+__all__ = ['WriteBehindQueue']
+
+log = logging.getLogger(__name__)
+
+class WriteBehindQueue(object):
+    """
+    Collects document updates and saves them in periodic batches.
+    """
+
+    def __init__(self, doc_class, interval=5, create_missing=False, max_pending=10000, retries=3):
+        """
+        Constructor.  Starts the flush thread.
+        :param doc_class: The document class used to wrap fetched documents.
+        :param interval: The number of seconds between flushes.
+        :param create_missing: Whether updates to missing documents are applied to new documents instead of dropped.
+        :param max_pending: The maximum number of pending updates.
+        :param retries: The number of times conflicting documents are fetched and updated again.
+        """
+        self.doc_class = doc_class
+        self.interval = interval
+        self.create_missing = create_missing
+        self.max_pending = max_pending
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.size = 0
+        self.closed = False
+        self.metrics = dict([ (name, 0) for name in ('submitted', 'merged', 'dropped', 'saved', 'conflicts') ])
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='whatcouch-write-behind')
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def submit(self, db, doc_id, update):
+        """
+        Queue an update to a document.
+        :param db: The database holding the document.
+        :param doc_id: The ID of the document.
+        :param update: A callable taking the current document, modifying it and returning True if it changed.
+        :return: True if the update was queued, False if it was dropped because the queue is full or closed.
+        """
+        with self.lock:
+            self.metrics['submitted'] += 1
+            if self.closed:
+                self.metrics['dropped'] += 1
+                return False
+            updates = self.pending.setdefault(db, {}).setdefault(doc_id, [])
+            if updates and hasattr(updates[-1], 'merge'):
+                merged = updates[-1].merge(update)
+                if merged is not None:
+                    updates[-1] = merged
+                    self.metrics['merged'] += 1
+                    return True
+            if self.size >= self.max_pending:
+                if not updates:
+                    del self.pending[db][doc_id]
+                self.metrics['dropped'] += 1
+                self.wakeup.set()
+                return False
+            updates.append(update)
+            self.size += 1
+            if self.size >= self.max_pending // 2:
+                self.wakeup.set()
+        return True
+
+    def run(self):
+        """
+        Flush thread main loop.  Flushes every interval, or early when the
+        queue is half full.
+        """
+        while not self.stopped.is_set():
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            if self.stopped.is_set():
+                break
+            try:
+                self.flush()
+            except Exception:
+                log.exception('write-behind flush failed')
+
+    def flush(self):
+        """
+        Apply and save all pending updates.  Updates for a database which
+        cannot be reached are queued again.
+        """
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+            self.size = 0
+        for db, updates in pending.iteritems():
+            unsaved = self._flush_db(db, updates)
+            if unsaved:
+                self._requeue(db, unsaved)
+
+    def _requeue(self, db, updates):
+        """
+        Queue updates again ahead of any submitted since they were taken.
+        :param db: The database.
+        :param updates: A dict mapping document IDs to lists of updates.
+        """
+        with self.lock:
+            pending = self.pending.setdefault(db, {})
+            for doc_id, doc_updates in updates.iteritems():
+                pending[doc_id] = doc_updates + pending.get(doc_id, [])
+                self.size += len(doc_updates)
+
+    def _apply(self, db, updates):
+        """
+        Fetch the pending documents and apply their updates.
+        :param db: The database.
+        :param updates: A dict mapping document IDs to lists of updates.
+        :return: A list of changed documents.
+        """
+        rows = db.all_docs(keys=updates.keys(), include_docs=True)
+        save_docs = []
+        for row in rows:
+            if row.get('doc') is not None:
+                doc = self.doc_class.wrap(row['doc'])
+            elif self.create_missing:
+                doc = self.doc_class.wrap({'_id': row['key']})
+            else:
+                continue
+            changed = False
+            for update in updates[row['key']]:
+                if update(doc):
+                    changed = True
+            if changed:
+                save_docs.append(doc)
+        return save_docs
+
+    def _save(self, db, docs):
+        """
+        Save documents in bulk.
+        :param db: The database.
+        :param docs: The documents to save.
+        :return: The IDs of the documents which were not saved due to a conflict.
+        """
+        conflicts = []
+        for result in bulk_write(db, docs):
+            if result['error'] == 'conflict':
+                conflicts.append(result['id'])
+            else:
+                log.error('write-behind save of %s failed: %s', result.get('id'), result.get('reason'))
+        return conflicts
+
+    def _flush_db(self, db, updates):
+        """
+        Apply and save the pending updates for one database, retrying
+        documents which conflict.
+        :param db: The database.
+        :param updates: A dict mapping document IDs to lists of updates.
+        :return: The updates of the documents not saved because the database failed, by document ID.
+        """
+        attempt = 0
+        while updates:
+            try:
+                save_docs = self._apply(db, updates)
+                if not save_docs:
+                    return {}
+                conflicts = self._save(db, save_docs)
+            except Exception:
+                log.exception('write-behind flush failed, requeueing %i documents', len(updates))
+                return updates
+            with self.lock:
+                self.metrics['saved'] += len(save_docs) - len(conflicts)
+                self.metrics['conflicts'] += len(conflicts)
+            updates = dict([ (doc_id, updates[doc_id]) for doc_id in conflicts ])
+            attempt += 1
+            if updates and attempt > self.retries:
+                log.warning('write-behind dropping updates to %i conflicting documents', len(updates))
+                return {}
+        return {}
+
+    def close(self):
+        """
+        Stop the flush thread and save any pending updates.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.stopped.set()
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()